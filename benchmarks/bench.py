@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Times ``CloneSyncer.run()`` end to end against synthetic clone farms
+(see clonefarm.py) and appends the results to a JSON-lines file, so that
+changes to parallelism, caching and discovery can be compared across
+farm sizes and over time.
+
+Example - compare the two engines at 10, 100 and 1000 clones, with 1 and 8 jobs::
+
+    python benchmarks/bench.py --sizes 10,100,1000 --jobs 1,8 --engines gitpython,subprocess
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from itertools import product
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from clonefarm import CloneFarm, git  # noqa
+from gitclonesync import VERSION  # noqa
+from gitclonesync.clonesyncer import CloneSyncer  # noqa
+from gitclonesync.scheduler import SyncResult  # noqa
+
+DEFAULT_RESULTS = os.path.join(HERE, 'results.jsonl')
+
+logger = logging.getLogger('bench')
+
+
+def _int_list(s):
+    return [int(x) for x in s.split(',')]
+
+
+def _str_list(s):
+    return s.split(',')
+
+
+def environment():
+    """ dict describing the machine and code being benchmarked """
+    try:
+        commit = git(os.path.dirname(HERE), 'rev-parse', '--short', 'HEAD')
+    except (RuntimeError, OSError):
+        commit = None
+    return {
+        'version': VERSION,
+        'commit': commit,
+        'git': git(HERE, '--version'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': _cpu_count(),
+    }
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def time_run(farm, workdir, engine, jobs, args):
+    """
+    run one CloneSyncer over the farm
+
+    :returns: dict of timings and result counts
+    :rtype: dict
+    """
+    report = os.path.join(workdir, 'report.json')
+    cs = CloneSyncer(
+        farm.clones_dir,
+        disable_github=True,
+        jobs=jobs,
+        engine=engine,
+        remote_jobs=args.remote_jobs,
+        max_per_host=args.max_per_host,
+        ref_cache_path=None if args.no_ref_cache else os.path.join(workdir, 'refcache.json'),
+        index_path=None if args.no_index else os.path.join(workdir, 'index.jsonl'),
+        report_path=report,
+    )
+    start = time.time()
+    results = cs.run()
+    elapsed = time.time() - start
+    with open(report) as fh:
+        timings = json.load(fh)
+    counts = dict((s, 0) for s in (SyncResult.SYNCED, SyncResult.SKIPPED, SyncResult.FAILED))
+    for r in results:
+        counts[r.status] += 1
+    return {
+        'elapsed': elapsed,
+        'discovery_time': timings['discovery_time'],
+        'phase_totals': timings['phase_totals'],
+        'fetches_avoided': cs.ref_cache.avoided if cs.ref_cache is not None else 0,
+        'dirs_scanned': cs.finder.dirs_scanned,
+        'dirs_cached': cs.finder.dirs_cached,
+        'results': counts,
+    }
+
+
+def bench_size(size, args, env, out):
+    """ build one farm of ``size`` clones and run every configuration against it """
+    root = tempfile.mkdtemp(prefix='gcs-bench-{n}-'.format(n=size), dir=args.tmpdir)
+    try:
+        farm = CloneFarm(os.path.join(root, 'farm'), size, remotes=args.remotes, history=args.history,
+                         dirty_ratio=args.dirty_ratio, seed=args.seed)
+        start = time.time()
+        farm.build()
+        build_time = time.time() - start
+        logger.info("size=%d: built farm in %.1fs", size, build_time)
+        for engine, jobs in product(args.engines, args.jobs):
+            workdir = os.path.join(root, '{e}-{j}'.format(e=engine, j=jobs))
+            os.makedirs(workdir)
+            for run in range(args.runs):
+                changed = farm.advance(args.changed_ratio)
+                rec = dict(env)
+                rec.update({
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'label': args.label,
+                    'size': size,
+                    'remotes': len(farm.remotes),
+                    'history': args.history,
+                    'dirty_ratio': args.dirty_ratio,
+                    'changed_ratio': args.changed_ratio,
+                    'remotes_changed': changed,
+                    'engine': engine,
+                    'jobs': jobs,
+                    'remote_jobs': args.remote_jobs,
+                    'max_per_host': args.max_per_host,
+                    'ref_cache': not args.no_ref_cache,
+                    'index': not args.no_index,
+                    'run': run,
+                    'farm_build_time': build_time,
+                })
+                rec.update(time_run(farm, workdir, engine, jobs, args))
+                if rec['results'][SyncResult.FAILED]:
+                    # a run whose clones fail did less work, so its time isn't comparable to others
+                    logger.warning("size=%d engine=%s jobs=%d run=%d: %d clone(s) failed; %s",
+                                   size, engine, jobs, run, rec['results'][SyncResult.FAILED],
+                                   'recording it anyway' if args.allow_failures else 'not recording it')
+                    if not args.allow_failures:
+                        continue
+                out.write(json.dumps(rec, sort_keys=True) + '\n')
+                out.flush()
+                logger.info("size=%d engine=%s jobs=%d run=%d: %.2fs (discovery %.2fs) %s",
+                            size, engine, jobs, run, rec['elapsed'], rec['discovery_time'], rec['results'])
+    finally:
+        if args.keep:
+            logger.info("kept farm at %s", root)
+        else:
+            shutil.rmtree(root)
+
+
+# result fields that identify a configuration in --summarize output
+SUMMARY_KEYS = ['commit', 'label', 'size', 'remotes', 'engine', 'jobs', 'remote_jobs', 'ref_cache', 'index', 'run']
+
+
+def summarize(path, out=sys.stdout):
+    """ print the mean elapsed time of every configuration recorded in ``path`` """
+    groups = {}
+    with open(path) as fh:
+        for line in fh:
+            rec = json.loads(line)
+            key = tuple(rec.get(k) for k in SUMMARY_KEYS)
+            groups.setdefault(key, []).append(rec['elapsed'])
+    out.write('\t'.join(SUMMARY_KEYS + ['n', 'mean_elapsed']) + '\n')
+    for key in sorted(groups, key=lambda k: [str(x) for x in k]):
+        times = groups[key]
+        out.write('\t'.join([str(x) for x in key] + [str(len(times)), '{t:.3f}'.format(t=sum(times) / len(times))]))
+        out.write('\n')
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description='Benchmark git_clone_sync against synthetic clone farms')
+    p.add_argument('--sizes', type=_int_list, default=[10, 100],
+                   help='comma-separated farm sizes (number of clones); default 10,100')
+    p.add_argument('--remotes', type=int, default=2, help='remotes per clone (default 2)')
+    p.add_argument('--history', type=int, default=100, help='commits of history per remote (default 100)')
+    p.add_argument('--dirty-ratio', type=float, default=0.1,
+                   help='fraction of clones with uncommitted changes (default 0.1)')
+    p.add_argument('--changed-ratio', type=float, default=0.2,
+                   help='fraction of remotes given new commits before each run (default 0.2)')
+    p.add_argument('--engines', type=_str_list, default=['gitpython'],
+                   help='comma-separated sync engines to compare (default gitpython)')
+    p.add_argument('--jobs', type=_int_list, default=[1],
+                   help='comma-separated --jobs values to compare (default 1)')
+    p.add_argument('--remote-jobs', type=int, default=1, help='--remote-jobs for every run (default 1)')
+    p.add_argument('--max-per-host', type=int, default=4, help='--max-per-host for every run (default 4)')
+    p.add_argument('--no-ref-cache', action='store_true', default=False, help='disable the ref cache')
+    p.add_argument('--no-index', action='store_true', default=False, help='disable the discovery index')
+    p.add_argument('--runs', type=int, default=2,
+                   help='consecutive runs per configuration; the first is cold (default 2)')
+    p.add_argument('--seed', type=int, default=0, help='random seed for dirty/changed selection')
+    p.add_argument('--label', type=str, default=None, help='free-form label stored with each result')
+    p.add_argument('--allow-failures', action='store_true', default=False,
+                   help='record runs in which some clones failed to sync (default: warn and skip them)')
+    p.add_argument('--results', type=str, default=DEFAULT_RESULTS,
+                   help='JSON-lines file to append results to (default benchmarks/results.jsonl)')
+    p.add_argument('--tmpdir', type=str, default=None, help='directory to build farms in')
+    p.add_argument('--keep', action='store_true', default=False, help='do not delete the farms afterwards')
+    p.add_argument('--summarize', action='store_true', default=False,
+                   help='do not run anything; print mean times per configuration from --results')
+    p.add_argument('-v', '--verbose', action='store_true', default=False,
+                   help='show git_clone_sync logging')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    logger.setLevel(logging.INFO)
+    if args.summarize:
+        summarize(args.results)
+        return
+    env = environment()
+    with open(args.results, 'a') as out:
+        for size in args.sizes:
+            bench_size(size, args, env, out)
+
+
+if __name__ == "__main__":
+    main()
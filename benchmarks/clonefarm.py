@@ -0,0 +1,152 @@
+"""
+Builds synthetic "clone farms" for benchmarking: a directory of N clones
+whose remotes are local ``file://`` bare repositories.
+
+Layout under the farm root::
+
+    template.git            history shared (hardlinked) by every remote
+    remotes/rNNNN-<remote>.git
+    clones/rNNNN/           clone of rNNNN-origin.git, with the other remotes added
+"""
+
+import logging
+import os
+import random
+import subprocess
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'bench', 'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'bench', 'GIT_COMMITTER_EMAIL': 'bench@example.com',
+    'GIT_CONFIG_NOSYSTEM': '1',
+}
+
+# remote names, in the order they're added to each clone
+REMOTE_NAMES = ['origin', 'upstream'] + ['fork{i}'.format(i=i) for i in range(1, 64)]
+
+logger = logging.getLogger(__name__)
+
+
+def git(cwd, *args, **kwargs):
+    """ run a git command in ``cwd`` and return its stdout; ``input`` is fed to stdin """
+    env = dict(os.environ)
+    env.update(GIT_ENV)
+    p = subprocess.Popen(('git',) + args, cwd=cwd, env=env, stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate(kwargs.get('input'))
+    if p.returncode != 0:
+        raise RuntimeError("git {a} in {c} failed: {e}".format(a=' '.join(args), c=cwd, e=err))
+    return out.decode('utf-8').strip()
+
+
+def _data(s):
+    """ a fast-import ``data`` command for string ``s`` """
+    return 'data {n}\n{s}\n'.format(n=len(s), s=s)
+
+
+def fast_import_commits(gitdir, count, label, parent=True):
+    """
+    add ``count`` commits to refs/heads/master of the repository at ``gitdir``
+    with a single ``git fast-import``, each changing one file
+
+    :param gitdir: path to the (bare) git directory
+    :type gitdir: string
+    :param count: number of commits
+    :type count: int
+    :param label: distinguishes the file contents/names of this batch
+    :type label: string
+    :param parent: if True, build on the existing tip of master
+    :type parent: boolean
+    """
+    stream = []
+    for i in range(count):
+        stream.append('commit refs/heads/master\n')
+        stream.append('committer bench <bench@example.com> {t} +0000\n'.format(t=1400000000 + i))
+        stream.append(_data('{l} commit {i}'.format(l=label, i=i)))
+        if i == 0 and parent:
+            stream.append('from refs/heads/master^0\n')
+        stream.append('M 644 inline {l}/file{n}.txt\n'.format(l=label, n=i % 50))
+        stream.append(_data('{l} {i}\n'.format(l=label, i=i) * 20))
+        stream.append('\n')
+    git(gitdir, '--git-dir', gitdir, 'fast-import', '--quiet', input=''.join(stream).encode('utf-8'))
+
+
+class CloneFarm:
+    """
+    A directory of synthetic clones and their local bare-repo remotes
+    """
+
+    def __init__(self, root, size, remotes=2, history=100, dirty_ratio=0.0, seed=0):
+        """
+        init
+
+        :param root: directory to build the farm in (created if missing)
+        :type root: string
+        :param size: number of clones
+        :type size: int
+        :param remotes: number of remotes per clone (origin, upstream, fork1, ...)
+        :type remotes: int
+        :param history: number of commits in each remote's history
+        :type history: int
+        :param dirty_ratio: fraction of clones given an uncommitted change
+        :type dirty_ratio: float
+        :param seed: random seed, so that the same clones are dirty/changed each time
+        :type seed: int
+        """
+        self.root = os.path.abspath(root)
+        self.size = size
+        self.remotes = REMOTE_NAMES[:max(1, remotes)]
+        self.history = history
+        self.dirty_ratio = dirty_ratio
+        self.random = random.Random(seed)
+        self.clones_dir = os.path.join(self.root, 'clones')
+        self.remotes_dir = os.path.join(self.root, 'remotes')
+        self._advanced = 0
+
+    def remote_path(self, i, name):
+        return os.path.join(self.remotes_dir, 'r{i:04d}-{n}.git'.format(i=i, n=name))
+
+    def clone_path(self, i):
+        return os.path.join(self.clones_dir, 'r{i:04d}'.format(i=i))
+
+    def build(self):
+        """ create the template, the remotes and the clones """
+        template = os.path.join(self.root, 'template.git')
+        os.makedirs(self.clones_dir)
+        os.makedirs(self.remotes_dir)
+        git(self.root, 'init', '-q', '--bare', template)
+        git(template, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        fast_import_commits(template, self.history, 'history', parent=False)
+        dirty = set(self.random.sample(range(self.size), int(round(self.size * self.dirty_ratio))))
+        for i in range(self.size):
+            for name in self.remotes:
+                # local clones hardlink the template's objects, so this is cheap
+                git(self.root, 'clone', '-q', '--bare', template, self.remote_path(i, name))
+            path = self.clone_path(i)
+            git(self.root, 'clone', '-q', self.remote_path(i, 'origin'), path)
+            git(path, 'remote', 'set-url', 'origin', 'file://' + self.remote_path(i, 'origin'))
+            for name in self.remotes[1:]:
+                git(path, 'remote', 'add', name, 'file://' + self.remote_path(i, name))
+            git(path, 'fetch', '-q', '--all')
+            if i in dirty:
+                with open(os.path.join(path, 'history', 'file0.txt'), 'a') as fh:
+                    fh.write('uncommitted change\n')
+        logger.info("Built farm of %d clones with %d remote(s) each in %s", self.size, len(self.remotes), self.root)
+
+    def advance(self, ratio, commits=1):
+        """
+        add new commits to a random ``ratio`` of all remotes, so that the next
+        sync has something to fetch
+
+        :param ratio: fraction of remotes to change
+        :type ratio: float
+        :param commits: number of commits to add to each changed remote
+        :type commits: int
+        :returns: number of remotes changed
+        :rtype: int
+        """
+        everything = [(i, name) for i in range(self.size) for name in self.remotes]
+        chosen = self.random.sample(everything, int(round(len(everything) * ratio)))
+        self._advanced += 1
+        for i, name in chosen:
+            fast_import_commits(self.remote_path(i, name), commits, 'advance{n}'.format(n=self._advanced))
+        return len(chosen)
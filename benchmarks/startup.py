@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Times how long ``git_clone_sync`` takes to start, which dominates its wall
+time when it is run on a single clone from editor hooks and shell prompts,
+and appends the results to a JSON-lines file. Each sample is a fresh Python
+process:
+
+* ``import``: import ``gitclonesync.clonesyncer``, parse the command line and
+  construct the CloneSyncer
+* ``single-clone``: a whole run of ``git_clone_sync`` on one clone of a local
+  remote with nothing to fetch
+
+With ``--max-import``, exits non-zero if the median import time exceeds it,
+so that a startup regression (i.e. an eager import of GitPython) fails CI::
+
+    python benchmarks/startup.py --samples 20 --max-import 0.25
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench import environment  # noqa
+from clonefarm import CloneFarm  # noqa
+
+DEFAULT_RESULTS = os.path.join(HERE, 'startup.jsonl')
+
+# keep the runs off the user's caches, and GitHub
+CLI_ARGS = ['-q', '-G', '--no-ref-cache', '--no-index', '--no-journal']
+
+IMPORT_CODE = ("import sys; from gitclonesync.clonesyncer import CloneSyncer, parse_args; "
+               "args = parse_args(sys.argv); CloneSyncer(args.directory, disable_github=True)")
+
+RUN_CODE = "import sys; from gitclonesync.clonesyncer import cli_entry; cli_entry()"
+
+logger = logging.getLogger('startup')
+
+
+def sample(code, argv):
+    """ run ``code`` in a fresh interpreter and return its wall time in seconds """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(HERE)] + [p for p in [env.get('PYTHONPATH')] if p])
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code] + argv, env=env, stderr=devnull)
+        return time.time() - start
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description='Benchmark git_clone_sync startup time')
+    p.add_argument('--samples', type=int, default=10, help='processes to time per measurement (default 10)')
+    p.add_argument('--max-import', type=float, default=None,
+                   help='exit 1 if the median import time is more than this many seconds')
+    p.add_argument('--label', type=str, default=None, help='free-form label stored with each result')
+    p.add_argument('--results', type=str, default=DEFAULT_RESULTS,
+                   help='JSON-lines file to append results to (default benchmarks/startup.jsonl)')
+    p.add_argument('--no-record', action='store_true', default=False,
+                   help='only print the results, do not append them to --results')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    workdir = tempfile.mkdtemp(prefix='gcs-startup-')
+    try:
+        farm = CloneFarm(workdir, 1, remotes=1, history=10)
+        farm.build()
+        argv = CLI_ARGS + [farm.clone_path(0)]
+        times = {
+            'import': [sample(IMPORT_CODE, argv) for _ in range(args.samples)],
+            'single-clone': [sample(RUN_CODE, argv) for _ in range(args.samples)],
+        }
+    finally:
+        shutil.rmtree(workdir)
+    env = environment()
+    recs = []
+    for name in sorted(times):
+        rec = dict(env)
+        rec.update({
+            'label': args.label,
+            'measure': name,
+            'samples': args.samples,
+            'min': min(times[name]),
+            'median': median(times[name]),
+        })
+        recs.append(rec)
+        logger.info("{m}: median {t:.3f}s, min {n:.3f}s over {s} samples".format(
+            m=name, t=rec['median'], n=rec['min'], s=args.samples))
+    if not args.no_record:
+        with open(args.results, 'a') as out:
+            for rec in recs:
+                out.write(json.dumps(rec, sort_keys=True) + '\n')
+    imported = median(times['import'])
+    if args.max_import is not None and imported > args.max_import:
+        logger.error("median import time {t:.3f}s is over the {m:.3f}s budget".format(t=imported, m=args.max_import))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
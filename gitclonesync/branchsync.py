@@ -0,0 +1,201 @@
+"""
+Mirroring of upstream branches to origin, computed from the remote-tracking
+refs left by the fetch phase - no checkout, and one push per clone
+"""
+
+# names of remotes treated as the upstream that origin is a fork of
+UPSTREAM_NAMES = ['upstream']
+
+# push --porcelain flags for refs that were updated (or were already up to date)
+PUSHED_FLAGS = (' ', '*', '+', '=')
+
+
+def remote_refs_args(*remotes):
+    """
+    arguments for a ``git for-each-ref`` listing the remote-tracking branches of ``remotes``
+
+    :rtype: list
+    """
+    return (['for-each-ref', '--format=%(objectname) %(refname)'] +
+            ['refs/remotes/{r}/'.format(r=r) for r in remotes])
+
+
+def parse_remote_refs(output, remote):
+    """
+    get the remote-tracking branches of one remote from ``remote_refs_args`` output
+
+    :param output: ``git for-each-ref`` output
+    :type output: string
+    :param remote: remote name
+    :type remote: string
+    :returns: dict of branch name to sha (without the symbolic ``HEAD``)
+    :rtype: dict
+    """
+    prefix = 'refs/remotes/{r}/'.format(r=remote)
+    refs = {}
+    for line in output.splitlines():
+        sha, _, ref = line.strip().partition(' ')
+        if ref.startswith(prefix) and ref != prefix + 'HEAD':
+            refs[ref[len(prefix):]] = sha
+    return refs
+
+
+class BranchUpdate:
+    """
+    One branch to be mirrored from the upstream remote to origin
+    """
+
+    def __init__(self, branch, old, new):
+        """
+        init
+
+        :param branch: branch name
+        :type branch: string
+        :param old: sha of the branch on origin; None if origin doesn't have it
+        :type old: string
+        :param new: sha of the branch on upstream
+        :type new: string
+        """
+        self.branch = branch
+        self.old = old
+        self.new = new
+        self.pushed = False
+        self.error = None
+
+    def refspec(self, src_remote):
+        """ push refspec sending this branch from ``src_remote``'s tracking ref """
+        return 'refs/remotes/{r}/{b}:refs/heads/{b}'.format(r=src_remote, b=self.branch)
+
+    def __repr__(self):
+        return "<BranchUpdate {b} {o}..{n}>".format(b=self.branch, o=self.old, n=self.new)
+
+
+def mirror_candidates(src_refs, dst_refs, include_new=False):
+    """
+    branches whose upstream tip differs from origin's; whether each is a
+    fast-forward still has to be checked with ``git merge-base --is-ancestor``
+
+    :param src_refs: upstream branch name to sha
+    :type src_refs: dict
+    :param dst_refs: origin branch name to sha
+    :type dst_refs: dict
+    :param include_new: also return branches origin doesn't have
+    :type include_new: boolean
+    :returns: list of BranchUpdate, sorted by branch name
+    :rtype: list
+    """
+    updates = []
+    for branch in sorted(src_refs):
+        old = dst_refs.get(branch)
+        if old == src_refs[branch] or (old is None and not include_new):
+            continue
+        updates.append(BranchUpdate(branch, old, src_refs[branch]))
+    return updates
+
+
+def push_args(dst_remote, src_remote, updates):
+    """
+    arguments for a single ``git push`` of every update
+
+    :rtype: list
+    """
+    return ['push', '--porcelain', dst_remote] + [u.refspec(src_remote) for u in updates]
+
+
+def apply_push_output(updates, output):
+    """
+    set ``pushed`` / ``error`` on each update from ``git push --porcelain`` output
+
+    :param updates: the BranchUpdates that were pushed
+    :type updates: list
+    :param output: stdout of the push
+    :type output: string
+    """
+    by_ref = dict(('refs/heads/' + u.branch, u) for u in updates)
+    for line in output.splitlines():
+        parts = line.split('\t')
+        if len(parts) < 3:
+            continue
+        u = by_ref.get(parts[1].rpartition(':')[2])
+        if u is None:
+            continue
+        if parts[0] in PUSHED_FLAGS:
+            u.pushed = True
+        else:
+            u.error = parts[2].strip()
+    for u in updates:
+        if not u.pushed and u.error is None:
+            u.error = 'not reported by git push'
+
+
+# lists local branches (with their configured upstream) and remote-tracking refs in one pass
+LOCAL_REFS_ARGS = ['for-each-ref', '--format=%(objectname) %(refname) %(upstream)', 'refs/heads/', 'refs/remotes/']
+
+WORKTREE_LIST_ARGS = ['worktree', 'list', '--porcelain']
+
+# reflog message for branches fast-forwarded without a checkout
+FF_REFLOG_MESSAGE = 'gitclonesync: fast-forward'
+
+
+def checked_out_branches(output):
+    """
+    get the branches checked out in any worktree of a clone
+
+    :param output: ``git worktree list --porcelain`` output
+    :type output: string
+    :returns: set of branch names
+    :rtype: set
+    """
+    branches = set()
+    for line in output.splitlines():
+        if line.startswith('branch refs/heads/'):
+            branches.add(line[len('branch refs/heads/'):])
+    return branches
+
+
+def ff_candidates(output):
+    """
+    local branches whose configured upstream has a different tip; whether
+    each is a fast-forward still has to be checked with
+    ``git merge-base --is-ancestor``
+
+    :param output: output of ``git`` + LOCAL_REFS_ARGS
+    :type output: string
+    :returns: list of BranchUpdate, sorted by branch name
+    :rtype: list
+    """
+    shas = {}
+    upstreams = {}
+    for line in output.splitlines():
+        parts = line.strip().split(' ')
+        if len(parts) < 2:
+            continue
+        shas[parts[1]] = parts[0]
+        if parts[1].startswith('refs/heads/') and len(parts) > 2 and parts[2]:
+            upstreams[parts[1]] = parts[2]
+    updates = []
+    for ref in sorted(upstreams):
+        new = shas.get(upstreams[ref])
+        if new is None or new == shas[ref]:
+            continue
+        updates.append(BranchUpdate(ref[len('refs/heads/'):], shas[ref], new))
+    return updates
+
+
+def update_ref_args(update):
+    """
+    arguments for a ``git update-ref`` fast-forwarding a branch that isn't
+    checked out; it fails if the branch moved since it was listed
+
+    :rtype: list
+    """
+    return ['update-ref', '-m', FF_REFLOG_MESSAGE, 'refs/heads/' + update.branch, update.new, update.old]
+
+
+def merge_ff_args(update):
+    """
+    arguments for fast-forwarding the checked-out branch through the working tree
+
+    :rtype: list
+    """
+    return ['merge', '--ff-only', '--quiet', update.new]
@@ -7,18 +7,49 @@ import sys
 import logging
 import os.path
 import json
-import git
+import threading
+import time
+from contextlib import contextmanager
 
-from gitclonesync.githubclone import GitHubClone, GitHubKeyError
+from gitclonesync.prrefs import PRState, plan_pr_refs, pr_fetch_args, pr_delete_args
+from gitclonesync.branchsync import (UPSTREAM_NAMES, remote_refs_args, parse_remote_refs, mirror_candidates,
+                                     push_args, apply_push_output, LOCAL_REFS_ARGS, WORKTREE_LIST_ARGS,
+                                     checked_out_branches, ff_candidates, update_ref_args, merge_ff_args)
+from gitclonesync.scheduler import HostLimiter, SyncScheduler, SyncResult
+from gitclonesync.timing import RepoTimer, SyncReport, TimedIterator, DEFAULT_SLOWEST
+from gitclonesync.subprocengine import SubprocessEngine
+from gitclonesync.procpool import ProcessPoolRunner
+from gitclonesync.discovery import RepoFinder, DEFAULT_PRUNE
+from gitclonesync.dirindex import DirIndex, DEFAULT_INDEX
+from gitclonesync.gitutils import (CONCURRENT_FETCH_GIT_VERSION, is_ref_lock_error, ls_remote_patterns,
+                                   parse_fetch_progress, REMOTE_CONFIG_ARGS, parse_remote_config, gitpython)
+from gitclonesync.status import get_repo_status, SLOW_STATUS
+from gitclonesync.sharedobjects import (DEFAULT_MIN_CLONES, REFERENCE_CONFIG, group_clones, reference_path,
+                                        reference_fetch_args, add_alternate)
+from gitclonesync.maintenance import (MAINTENANCE_GIT_VERSION, DEFAULT_MAX_PACKS, DEFAULT_MAX_LOOSE,
+                                      COUNT_OBJECTS_ARGS, parse_count_objects, count_packs,
+                                      maintenance_reason, maintenance_steps, maintenance_summary)
+from gitclonesync.daemon import SyncDaemon, DEFAULT_MIN_INTERVAL, DEFAULT_MAX_INTERVAL, DEFAULT_DAEMON_STATE
+from gitclonesync.watcher import CloneWatcher, InotifyError
+from gitclonesync.fetchprofile import (PROFILE_CONFIG_ARGS, PARTIAL_CLONE_GIT_VERSION, parse_profile_config,
+                                       reader_config_items, profile_config, select_profile)
+from gitclonesync.sshmux import SSHMultiplexer, DEFAULT_PERSIST
+from gitclonesync.journal import RunJournal, DEFAULT_JOURNAL, DEFAULT_RESUME_WINDOW
+from gitclonesync.refcache import RefCache, ref_fingerprint, DEFAULT_REF_CACHE, DEFAULT_MAX_AGE
 
-# prefer the pip vendored pkg_resources
 try:
-    from pip._vendor import pkg_resources
+    from Queue import Queue, Empty
 except ImportError:
-    import pkg_resources
+    from queue import Queue, Empty
 
 
-UPSTREAM_NAMES = ['upstream']
+ENGINE_GITPYTHON = 'gitpython'
+ENGINE_SUBPROCESS = 'subprocess'
+ENGINES = (ENGINE_GITPYTHON, ENGINE_SUBPROCESS)
+
+# clones collected from discovery for each run of the pre-pass, so that syncing
+# starts before discovery finishes while GitHub API requests are still batched
+PREPASS_BATCH = 100
 
 
 class CloneSyncer:
@@ -26,11 +57,19 @@ class CloneSyncer:
     Main class for syncing git clones
     """
 
-    def __init__(self, path, sync_dirty=False, disable_github=False, origin_only=False, no_upstream=False, dryrun=False):
+    def __init__(self, path, sync_dirty=False, disable_github=False, origin_only=False, no_upstream=False, dryrun=False,
+                 jobs=1, max_per_host=4, remote_jobs=1, fetch_timeout=None,
+                 ref_cache_path=None, ref_cache_max_age=DEFAULT_MAX_AGE, force_fetch=False,
+                 max_depth=1, prune=None, index_path=None, engine=ENGINE_GITPYTHON,
+                 report_path=None, report_slowest=DEFAULT_SLOWEST, mirror_new_branches=False, pr_refs=False,
+                 processes=0, repo_timeout=None, maintenance=False, max_packs=DEFAULT_MAX_PACKS,
+                 max_loose=DEFAULT_MAX_LOOSE, shared_objects=None, shared_min_clones=DEFAULT_MIN_CLONES,
+                 journal_path=None, resume=False, resume_window=DEFAULT_RESUME_WINDOW, retry_failed=False,
+                 ssh_multiplex=False, ssh_persist=DEFAULT_PERSIST, add_upstreams=False):
         """
         init
 
-        :param path: the directory to sync - either the path to a git clone, or a directory containing git clones (non-recursive)
+        :param path: the directory to sync - either the path to a git clone, or a directory containing git clones
         :type path: string
         :param sync_dirty: if True, also sync dirty clones. Default is False, do not touch dirty clones
         :type sync_dirty: boolean
@@ -38,43 +77,624 @@ class CloneSyncer:
         :type disable_github: boolean
         :param origin_only: if True, do not fetch any remotes other than origin
         :type origin_only: boolean
-        :param no_upstream: if True, do not push upstream/master to origin/master
+        :param no_upstream: if True, do not push upstream branches to origin
         :type no_upstream: boolean
         :param dryrun: if True, don't change anything on disk, just log (at info level) what would be done
         :type dryrun: boolean
+        :param jobs: number of clones to sync concurrently
+        :type jobs: int
+        :param max_per_host: maximum number of concurrent fetches against any one remote host; None for unlimited
+        :type max_per_host: int
+        :param remote_jobs: number of remotes of a single clone to fetch concurrently
+        :type remote_jobs: int
+        :param fetch_timeout: kill any single remote fetch that takes longer than this many seconds; None for no limit
+        :type fetch_timeout: int
+        :param ref_cache_path: path to the advertised-ref cache used to skip fetches of unchanged remotes; None to disable
+        :type ref_cache_path: string
+        :param ref_cache_max_age: re-fetch remotes at least this often (seconds) even if they look unchanged
+        :type ref_cache_max_age: int
+        :param force_fetch: if True, always fetch, even if the ref cache says a remote is unchanged
+        :type force_fetch: boolean
+        :param max_depth: how many directory levels below path to search for clones; None for unlimited
+        :type max_depth: int
+        :param prune: additional fnmatch patterns of directory names not to search for clones
+        :type prune: list
+        :param index_path: path to the discovery index, used to avoid re-listing unchanged directories; None to disable
+        :type index_path: string
+        :param engine: ENGINE_GITPYTHON to sync with GitPython in worker threads, or ENGINE_SUBPROCESS
+          to drive git subprocesses from a single thread (status and fetch only); for the latter,
+          ``jobs`` is the maximum number of concurrent git processes
+        :type engine: string
+        :param report_path: write a per-clone, per-phase timing report to this path (CSV if it ends in .csv, else JSON)
+        :type report_path: string
+        :param report_slowest: number of slowest clones to list in the report
+        :type report_slowest: int
+        :param mirror_new_branches: also create branches on origin that only exist on upstream
+        :type mirror_new_branches: boolean
+        :param pr_refs: fetch the heads of open GitHub pull requests to ``refs/remotes/<remote>-pr/<number>``
+        :type pr_refs: boolean
+        :param processes: if non-zero, sync clones in this many worker processes instead of ``jobs``
+          threads (GitPython engine only); max_per_host is shared by all of them
+        :type processes: int
+        :param repo_timeout: with processes, kill a worker that spends longer than this many seconds on
+          one clone; None for no limit
+        :type repo_timeout: int
+        :param maintenance: after syncing a clone, repack it and write its multi-pack-index and
+          commit-graph if it has more than max_packs packs or max_loose loose objects (git 2.32+)
+        :type maintenance: boolean
+        :param max_packs: count of packs not in the clone's multi-pack-index above which it is maintained
+        :type max_packs: int
+        :param max_loose: loose object count above which a clone is maintained
+        :type max_loose: int
+        :param shared_objects: directory of bare reference repositories; clones that share a remote
+          borrow its objects from one of them via git alternates. None to disable
+        :type shared_objects: string
+        :param shared_min_clones: share a remote's objects once at least this many clones have it
+        :type shared_min_clones: int
+        :param journal_path: path to the run journal each clone's outcome is appended to; None to disable
+        :type journal_path: string
+        :param resume: skip clones the journal shows were synced within resume_window seconds
+        :type resume: boolean
+        :param resume_window: with resume, how recently (seconds) a clone must have been synced to be skipped
+        :type resume_window: int
+        :param retry_failed: only sync the clones that failed the last time they were synced
+        :type retry_failed: boolean
+        :param ssh_multiplex: run all SSH connections to each remote host through one master connection per run
+        :type ssh_multiplex: boolean
+        :param ssh_persist: with ssh_multiplex, seconds a master stays up after its last git command
+        :type ssh_persist: int
+        :param add_upstreams: add an ``upstream`` remote for the parent of every clone whose origin is a GitHub fork
+        :type add_upstreams: boolean
         """
         self.dryrun = dryrun
         self.logger = logging.getLogger(self.__class__.__name__)
-        self._check_versions()
         if dryrun:
             self.logger.warning("Running in dryrun mode - will not make any changes on disk")
         self.sync_dirty = sync_dirty
         self.path = path
         self.origin_only = origin_only
         self.no_upstream = no_upstream
+        self.jobs = jobs
+        self.host_limiter = HostLimiter(max_per_host)
+        self.remote_jobs = remote_jobs
+        self.fetch_timeout = fetch_timeout
+        self.force_fetch = force_fetch
+        self.ref_cache = None
+        if ref_cache_path is not None:
+            self.ref_cache = RefCache(ref_cache_path, max_age=ref_cache_max_age)
+        if engine not in ENGINES:
+            raise ValueError("engine must be one of: {e}".format(e=', '.join(ENGINES)))
+        self.engine = engine
+        if processes and engine != ENGINE_GITPYTHON:
+            raise ValueError("processes can only be used with the {e} engine".format(e=ENGINE_GITPYTHON))
+        self.processes = processes
+        self.repo_timeout = repo_timeout
+        self.report_path = report_path
+        self.report_slowest = report_slowest
+        self.mirror_new_branches = mirror_new_branches
+        self.maintenance = maintenance
+        self.max_packs = max_packs
+        self.max_loose = max_loose
+        self.shared_objects = None
+        if shared_objects is not None:
+            self.shared_objects = os.path.abspath(os.path.expanduser(shared_objects))
+        self.shared_min_clones = shared_min_clones
+        if (resume or retry_failed) and journal_path is None:
+            raise ValueError("resume and retry_failed require a journal_path")
+        self.journal = None
+        if journal_path is not None:
+            self.journal = RunJournal(journal_path, resume_window=resume_window, readonly=dryrun)
+        self.resume = resume
+        self.retry_failed = retry_failed
+        self.ssh_mux = SSHMultiplexer(persist=ssh_persist) if ssh_multiplex else None
+        self.index_path = index_path
+        index = DirIndex(index_path) if index_path is not None else None
+        self.finder = RepoFinder(max_depth=max_depth, prune=DEFAULT_PRUNE + tuple(prune or ()), index=index)
         if disable_github:
             self.logger.warning("Disabling all GitHub API integration per disable_github option")
             self.gh = None
         else:
+            # imported here, as the GitHub client (and requests) is slow to import and often unused
+            from gitclonesync.githubclone import GitHubClone, GitHubKeyError
             try:
                 self.gh = GitHubClone()
             except GitHubKeyError:
                 self.logger.error("ERROR: Unable to find GitHub API Key, disabling GitHub API integration.")
                 self.gh = None
+        self.pr_refs = pr_refs
+        if pr_refs and self.gh is None:
+            self.logger.warning("Fetching pull request refs requires GitHub API integration; disabling it")
+            self.pr_refs = False
+        self.add_upstreams = add_upstreams
+        if add_upstreams and self.gh is None:
+            self.logger.warning("Adding upstream remotes requires GitHub API integration; disabling it")
+            self.add_upstreams = False
+        # clone path -> (PRState, list of PRPlan), filled in by the pre-pass before each clone is synced
+        self.pr_plans = {}
+        # url_key() -> path of the reference repository fetched this run, or None if it couldn't be
+        self._references = {}
 
     def run(self):
         """
         do the actual clone update
+
+        :returns: list of SyncResult when syncing a directory of clones, else None
+        """
+        single = os.path.isdir(os.path.join(self.path, '.git'))
+        if single and self.engine == ENGINE_GITPYTHON:
+            self.logger.info("Syncing {p}".format(p=self.path))
+            start = time.time()
+            timer = RepoTimer(self.path)
+            status = SyncResult.FAILED
+            error = None
+            try:
+                with self._ssh_session():
+                    if self._needs_prepass():
+                        self.pr_plans = {}
+                        self._prepass([self.path])
+                    synced = self._do_git_dir(self.path, timer=timer)
+                status = SyncResult.SYNCED if synced else SyncResult.SKIPPED
+            except Exception as ex:
+                error = str(ex)
+                raise
+            finally:
+                result = SyncResult(self.path, status, time.time() - start, error=error, timer=timer)
+                self._close_journal([result])
+            self._finish_ref_cache()
+            if self.report_path is not None:
+                self._write_report([result], result.elapsed)
+            return
+        if single:
+            found = TimedIterator([self.path])
+        else:
+            self.logger.info("Syncing git directories under {p} with {j} job(s)".format(p=self.path, j=self.jobs))
+            found = TimedIterator(self._iter_git_dirs(self.path))
+        selected = found
+        if self.resume or self.retry_failed:
+            selected = self._select_from_journal(found)
+        results, elapsed = self.sync_paths(selected)
+        self._close_journal()
+        if not single:
+            self._save_index()
+        if self.report_path is not None:
+            self._write_report(results, elapsed, discovery_time=found.elapsed)
+        return results
+
+    def sync_paths(self, paths):
+        """
+        sync the given clones with the configured engine; used by run() and,
+        repeatedly with the same CloneSyncer, by the daemon
+
+        :param paths: paths to the clones
+        :type paths: iterable
+        :returns: (list of SyncResult, wall time in seconds)
+        :rtype: tuple
+        """
+        if self.engine == ENGINE_SUBPROCESS:
+            runner = SubprocessEngine(self, max_procs=self.jobs)
+        elif self.processes:
+            runner = ProcessPoolRunner(self, processes=self.processes, timeout=self.repo_timeout)
+        else:
+            runner = SyncScheduler(self, jobs=self.jobs)
+        with self._ssh_session():
+            if self._needs_prepass():
+                paths = self._prepassed(paths)
+            results = runner.run(paths)
+        runner.log_summary()
+        self._finish_ref_cache()
+        return results, runner.elapsed
+
+    @contextmanager
+    def _ssh_session(self):
+        """
+        context manager that multiplexes SSH connections for its duration, if
+        enabled; the master connections are shut down when it exits
+        """
+        if self.ssh_mux is None:
+            yield
+            return
+        self.ssh_mux.start()
+        try:
+            yield
+        finally:
+            self.ssh_mux.close()
+
+    def _close_journal(self, results=None):
+        """
+        record the outcome of clones that were synced outside of a runner,
+        then close the run journal
+
+        :param results: SyncResults to record; the runners record their own
+        :type results: list
+        """
+        if self.journal is None:
+            return
+        for result in results or []:
+            self.journal.record(result)
+        self.journal.close()
+
+    def _select_from_journal(self, paths):
+        """
+        filter discovered clones by the run journal: with retry_failed, only
+        those that failed the last time they were synced; with resume, all
+        but those synced within the journal's resume window
+
+        :param paths: paths to the clones
+        :type paths: iterable
+        :rtype: generator
+        """
+        skipped = 0
+        for path in paths:
+            if self.retry_failed and not self.journal.failed(path):
+                skipped += 1
+                continue
+            if self.resume and self.journal.finished_recently(path):
+                skipped += 1
+                continue
+            yield path
+        if self.retry_failed:
+            self.logger.info("Retrying only clones that failed last time; not syncing {n} other(s)".format(
+                n=skipped))
+        else:
+            self.logger.info("Resuming; skipping {n} clone(s) synced in the last {w}s".format(
+                n=skipped, w=self.journal.resume_window))
+
+    def discover(self):
+        """
+        list the clones to sync - self.path itself if it is a clone, else
+        every clone found under it - and save the discovery index
+
+        :rtype: list
         """
         if os.path.isdir(os.path.join(self.path, '.git')):
-            logger.info("Syncing {p}".format(p=self.path))
-            self._do_git_dir(self.path)
+            return [self.path]
+        paths = self._get_git_dirs(self.path)
+        self._save_index()
+        return paths
+
+    def _write_report(self, results, elapsed, discovery_time=0.0):
+        """ write the timing report for a run to self.report_path """
+        report = SyncReport(results, elapsed, discovery_time=discovery_time, slowest=self.report_slowest)
+        report.log_slowest()
+        report.write(self.report_path)
+
+    def _needs_prepass(self):
+        """ return True if any enabled feature does work in the pre-pass """
+        return self.add_upstreams or self.pr_refs or self.shared_objects is not None
+
+    def _prepassed(self, paths):
+        """
+        generator that yields ``paths``, running the pre-pass over each batch
+        of PREPASS_BATCH of them as discovery finds them, so that the first
+        clones are synced while later ones are still being discovered
+
+        :param paths: paths to the clones
+        :type paths: iterable
+        """
+        self.pr_plans = {}
+        self._references = {}
+        seen = {}
+        batch = []
+        for path in paths:
+            batch.append(path)
+            if len(batch) < PREPASS_BATCH:
+                continue
+            self._prepass(batch, seen=seen)
+            for p in batch:
+                yield p
+            batch = []
+        if batch:
+            self._prepass(batch, seen=seen)
+            for p in batch:
+                yield p
+
+    def _prepass(self, paths, seen=None):
+        """
+        work done across a batch of clones before any of them is synced, so
+        that it can be batched: with the GitHub API, add missing upstream
+        remotes and work out which pull request refs to fetch, if enabled;
+        then, with a shared object store, fetch the reference repositories
+        of shared remotes
+
+        :param paths: paths to the clones
+        :type paths: list
+        :param seen: dict of clone path to remote URLs of the clones of earlier batches; updated
+          with this batch's
+        :type seen: dict
+        """
+        remotes = dict((path, self._remote_urls(path)) for path in paths)
+        if self.gh is not None and (self.add_upstreams or self.pr_refs):
+            try:
+                if self.add_upstreams:
+                    self._add_upstreams(remotes)
+                if self.pr_refs:
+                    self._plan_pr_refs(remotes)
+            finally:
+                self.gh.client.save()
+        if seen is None:
+            seen = {}
+        seen.update(remotes)
+        if self.shared_objects is not None:
+            self._share_objects(remotes, seen=seen)
+
+    def _add_upstreams(self, remotes):
+        """
+        add an ``upstream`` remote to every clone whose origin is a GitHub fork
+        and that doesn't have one yet, resolving the parents of all of their
+        origins with batched GitHub API requests
+
+        :param remotes: dict of clone path to a dict of its remote names to URLs; updated with added remotes
+        :type remotes: dict
+        """
+        from gitclonesync.githubapi import GitHubAPIError
+        git = gitpython()
+        if self.origin_only:
+            return
+        origins = {}
+        for path, urls in remotes.items():
+            if 'origin' not in urls or any(name in urls for name in UPSTREAM_NAMES):
+                continue
+            origins[path] = urls['origin']
+        if not origins:
+            return
+        try:
+            upstreams = self.gh.find_upstreams(origins)
+        except GitHubAPIError as ex:
+            self.logger.error("Unable to look up the parents of GitHub forks: {e}".format(e=ex))
             return
-        # else this isn't a git dir itself
-        git_dirs = self._get_git_dirs(self.path)
-        logger.info("Syncing {n} git directories under {p}".format(n=len(git_dirs), p=self.path))
-        for d in git_dirs:
-            self._do_git_dir(d)
+        name = UPSTREAM_NAMES[0]
+        for path in sorted(upstreams):
+            if self.dryrun:
+                self.logger.info("DRYRUN - would add remote '{r}' {u} to {p}".format(r=name, u=upstreams[path], p=path))
+                continue
+            self.logger.info("Adding remote '{r}' {u} to {p}".format(r=name, u=upstreams[path], p=path))
+            try:
+                git.Git(path).remote('add', name, upstreams[path])
+            except git.exc.GitCommandError as ex:
+                self.logger.warning("Unable to add remote '{r}' to {p}: {e}".format(r=name, p=path, e=ex))
+                continue
+            remotes[path][name] = upstreams[path]
+
+    def _plan_pr_refs(self, remotes):
+        """
+        list the pull requests of every GitHub remote opened, updated or closed
+        since the last run, using self.jobs threads, and store the resulting
+        (PRState, [PRPlan, ...]) of each clone in self.pr_plans
+
+        :param remotes: dict of clone path to a dict of its remote names to URLs
+        :type remotes: dict
+        """
+        from gitclonesync.githubapi import GitHubAPIError, parse_github_url
+        git = gitpython()
+        work = Queue()
+        for path in sorted(remotes):
+            names = [n for n in sorted(remotes[path]) if n == 'origin' or not self.origin_only]
+            github = [(n, parse_github_url(remotes[path][n], host=self.gh.host)) for n in names]
+            github = [(n, full_name) for n, full_name in github if full_name is not None]
+            if github:
+                work.put((path, github))
+
+        def plan_clone(path, github):
+            git_dir = git.Git(path).execute(['git', 'rev-parse', '--absolute-git-dir'], with_exceptions=False)
+            if not git_dir:
+                return
+            state = PRState(git_dir)
+            plans = []
+            for name, full_name in github:
+                try:
+                    plans.append(plan_pr_refs(self.gh.client, name, full_name, state.get(name)))
+                except GitHubAPIError as ex:
+                    self.logger.error("Unable to list pull requests of {n} ({p} remote '{r}'): {e}".format(
+                        n=full_name, p=path, r=name, e=ex))
+            self.pr_plans[path] = (state, plans)
+
+        def worker():
+            while True:
+                try:
+                    path, github = work.get_nowait()
+                except Empty:
+                    return
+                plan_clone(path, github)
+
+        start = time.time()
+        threads = [threading.Thread(target=worker) for _ in range(min(self.jobs, work.qsize()))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.logger.info("Planned pull request refs for {n} clone(s) in {t:.1f}s with {r} API request(s)".format(
+            n=len(self.pr_plans), t=time.time() - start, r=self.gh.client.requests_made))
+
+    def _share_objects(self, remotes, seen=None):
+        """
+        fetch a bare reference repository for every remote that at least
+        self.shared_min_clones clones have, using self.jobs threads, and make
+        each of those clones borrow objects from it. A clone that newly
+        borrows from a reference is repacked with ``-l`` once, which drops
+        its own copies of the objects the reference has. Each reference is
+        fetched at most once per run, however many batches have its remote.
+
+        :param remotes: dict of clone path to a dict of its remote names to URLs, for this batch
+        :type remotes: dict
+        :param seen: the same, for every clone discovered so far (including this batch), to count
+          the clones that have each remote
+        :type seen: dict
+        """
+        git = gitpython()
+        groups = {}
+        for key, (url, paths) in group_clones(seen or remotes, min_clones=self.shared_min_clones).items():
+            paths = [p for p in paths if p in remotes]
+            if paths:
+                groups[key] = (url, paths)
+        if not groups:
+            return
+        work = Queue()
+        for key in sorted(groups):
+            if key not in self._references:
+                work.put(key)
+        start = time.time()
+        fetches = work.qsize()
+
+        def fetch_reference(key):
+            url, paths = groups[key]
+            ref = reference_path(self.shared_objects, key)
+            self._references[key] = None
+            if self.dryrun:
+                self.logger.info("DRYRUN - would fetch {u} into reference {r} for {n} clone(s)".format(
+                    u=url, r=ref, n=len(paths)))
+                return
+            if not os.path.isdir(ref):
+                self.logger.info("Creating reference repository {r} for {u}".format(r=ref, u=url))
+                git.Git().init('--bare', '--quiet', ref)
+                for name, value in REFERENCE_CONFIG:
+                    git.Git(ref).config(name, value)
+            if self.ssh_mux is not None:
+                self.ssh_mux.connect(url)
+            with self.host_limiter.limit(url):
+                status, _, err = git.Git(ref).execute(['git'] + reference_fetch_args(url), with_exceptions=False,
+                                                      with_extended_output=True, kill_after_timeout=self.fetch_timeout)
+            if status != 0:
+                self.logger.error("Error fetching {u} into reference {r}: {e}".format(u=url, r=ref, e=err.strip()))
+                return
+            self._references[key] = ref
+
+        def worker():
+            while True:
+                try:
+                    key = work.get_nowait()
+                except Empty:
+                    return
+                fetch_reference(key)
+
+        threads = [threading.Thread(target=worker) for _ in range(min(max(1, self.jobs), work.qsize()))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        fetched = dict((key, self._references[key]) for key in groups if self._references.get(key) is not None)
+        added = 0
+        for key in sorted(fetched):
+            objects = os.path.join(fetched[key], 'objects')
+            for path in groups[key][1]:
+                g = git.Git(path)
+                git_dir = g.execute(['git', 'rev-parse', '--absolute-git-dir'], with_exceptions=False)
+                if not git_dir or not add_alternate(git_dir, objects):
+                    continue
+                added += 1
+                self.logger.info("{p} now borrows objects from {r}; repacking it without them".format(
+                    p=path, r=fetched[key]))
+                status, _, err = g.execute(['git', 'repack', '-a', '-d', '-l', '-q'], with_exceptions=False,
+                                           with_extended_output=True)
+                if status != 0:
+                    self.logger.warning("Unable to repack {p}: {e}".format(p=path, e=err.strip()))
+        self.logger.info("Fetched {n} shared reference repositories for {c} clone(s) in {t:.1f}s; "
+                         "{a} clone(s) newly borrowing objects".format(
+                             n=fetches, c=len(set(p for k in fetched for p in groups[k][1])),
+                             t=time.time() - start, a=added))
+
+    def _fetch_pr_refs(self, repo, path, failed, timer):
+        """
+        apply the pull request plans for one clone: fetch the heads of open and
+        updated pull requests with explicit refspecs, delete the refs of closed
+        ones, and record the new state
+
+        :param repo: the clone
+        :type repo: git.Repo
+        :param path: path to the clone, as given to _do_git_dir
+        :type path: string
+        :param failed: names of remotes whose fetch failed
+        :type failed: list
+        :param timer: records how long each fetch takes
+        :type timer: gitclonesync.timing.RepoTimer
+        """
+        state, plans = self.pr_plans.get(path, (None, []))
+        applied = False
+        for plan in plans:
+            if plan.remote in failed:
+                continue
+            if self.dryrun:
+                self.logger.info("DRYRUN - would fetch {f} and prune {p} pull request ref(s) of '{r}'".format(
+                    f=len(plan.fetch), p=len(plan.prune), r=plan.remote))
+                continue
+            if plan.fetch:
+                with self.host_limiter.limit(repo.remote(plan.remote).url):
+                    with timer.phase('pr-fetch', remote=plan.remote):
+                        status, out, err = repo.git.execute(
+                            ['git'] + pr_fetch_args(plan.remote, plan.fetch), with_exceptions=False,
+                            with_extended_output=True, kill_after_timeout=self.fetch_timeout)
+                if status != 0:
+                    self.logger.error("Error fetching pull requests of remote '{r}': {e}".format(
+                        r=plan.remote, e=err.strip()))
+                    continue
+            if plan.prune:
+                status, out, err = repo.git.execute(['git'] + pr_delete_args(plan.remote, plan.prune),
+                                                    with_exceptions=False, with_extended_output=True)
+                if status != 0:
+                    self.logger.debug("Deleting closed pull requests of remote '{r}': {e}".format(
+                        r=plan.remote, e=err.strip()))
+            self.logger.debug("Fetched {f} and pruned {p} pull request ref(s) of '{r}'".format(
+                f=len(plan.fetch), p=len(plan.prune), r=plan.remote))
+            state.update(plan)
+            applied = True
+        if applied:
+            state.save()
+
+    def _remote_urls(self, path):
+        """
+        get the URLs of a clone's remotes from its config, without opening it with GitPython
+
+        :param path: path to the clone
+        :type path: string
+        :returns: dict of remote name to URL
+        :rtype: dict
+        """
+        git = gitpython()
+        output = git.Git(path).execute(['git'] + REMOTE_CONFIG_ARGS, with_exceptions=False)
+        return parse_remote_config(output)[0]
+
+    def rebuild_index(self):
+        """
+        discard the discovery index and rebuild it with a full walk of self.path
+
+        :returns: number of repositories found
+        :rtype: int
+        """
+        if self.index_path is None:
+            raise SystemExit("ERROR: no discovery index path configured")
+        self.finder.index = DirIndex(self.index_path, rebuild=True)
+        count = len(self._get_git_dirs(self.path))
+        self.logger.info("Rebuilt discovery index {i}: {n} repositories in {d} directories".format(
+            i=self.finder.index.path, n=count, d=self.finder.dirs_scanned))
+        self._save_index()
+        return count
+
+    def _save_index(self):
+        """ save the discovery index, if enabled """
+        if self.finder.index is None or self.dryrun:
+            return
+        self.finder.index.save()
+
+    def _finish_ref_cache(self):
+        """ report fetches avoided via the ref cache, and save it """
+        if self.ref_cache is None:
+            return
+        self.logger.info("Skipped {n} fetch(es) of unchanged remotes".format(n=self.ref_cache.avoided))
+        if not self.dryrun:
+            self.ref_cache.save()
+
+    def _iter_git_dirs(self, path):
+        """
+        generator of the paths of all git clones under a given path, yielded
+        as they are found
+
+        :param path: path to check for git directories
+        :type path: string
+        """
+        self.logger.debug("finding git directories under {p}".format(p=path))
+        for repo in self.finder.find(path):
+            yield repo.path
+        self.logger.debug("listed {n} directories under {p}; reused {c} from the index".format(
+            n=self.finder.dirs_scanned, p=path, c=self.finder.dirs_cached))
 
     def _get_git_dirs(self, path):
         """
@@ -83,126 +703,427 @@ class CloneSyncer:
         :param path: path to check for git directories
         :type path: string
         """
-        self.logger.debug("finding git directories under {p}".format(p=path))
-        gitdirs = []
-        for name in os.listdir(path):
-            dirpath = os.path.join(d, name)
-            if os.path.isdir(dirpath) and os.path.isdir(os.path.join(dirpath, '.git')):
-                if dirpath not in gitdirs:
-                    gitdirs.append(dirpath)
-        return gitdirs
+        return list(self._iter_git_dirs(path))
 
-    def _do_git_dir(self, path):
+    def _do_git_dir(self, path, timer=None):
         """
         sync a single git directory/clone
 
         :param path: path to the clone
         :type path: string
+        :param timer: records how long each phase takes
+        :type timer: gitclonesync.timing.RepoTimer
         """
+        git = gitpython()
+        if timer is None:
+            timer = RepoTimer(path)
         self.logger.info("Syncing {p}".format(p=path))
-        repo = git.Repo(path)
+        with timer.phase('open'):
+            repo = git.Repo(path)
         if repo.bare:
-            logger.warining("Skipping bare repo at %s" % path)
+            self.logger.warning("Skipping bare repo at %s" % path)
             return False
-        if repo.is_dirty():
+        with timer.phase('status'):
+            status = self._repo_status(repo)
+        if status.is_dirty():
             if self.sync_dirty:
                 raise NotImplementedError("TODO: implement what to do with dirty repos")
             else:
                 self.logger.warning("Skipping dirty repo: %s" % path)
                 return False
         # ok, repo isn't bare or dirty
-        current_branch = repo.active_branch
-        self.logger.debug("current branch is %s" % current_branch)
-
-        if self.gh is not None:
-            on_github = False
-            for rmt in repo.remotes:
-                if 'github.com' in rmt.url:
-                    on_github = True
-                    break
-            if on_github:
-                raise NotImplementedError('TODO - guard this with a config setting?')
-                # do_github_repo(repo, config, gh_client, dryrun=False)
+        if status.branch is None:
+            self.logger.warning("Skipping repo with detached HEAD: %s" % path)
+            return False
+        self.logger.debug("current branch is %s" % status.branch)
 
         upstream = None
+        origin = None
+        remotes = []
         for rmt in repo.remotes:
             if rmt.name != 'origin' and self.origin_only:
-                logger.debug("skipping non-origin remote '{r}'".format(r=rmt.name))
+                self.logger.debug("skipping non-origin remote '{r}'".format(r=rmt.name))
                 continue
-            self._fetch_remote(rmt)
+            remotes.append(rmt)
             if rmt.name in UPSTREAM_NAMES and not self.no_upstream:
                 upstream = rmt
+            elif rmt.name == 'origin':
+                origin = rmt
+        if self.ssh_mux is not None and not self.dryrun:
+            for rmt in remotes:
+                self.ssh_mux.connect(rmt.url)
+        profiles = self._fetch_profiles(repo, path, remotes)
+        failed = self._fetch_remotes(repo, remotes, timer=timer, profiles=profiles)
+        if path in self.pr_plans:
+            self._fetch_pr_refs(repo, path, failed, timer)
+        if upstream is not None and upstream.name in failed:
+            self.logger.warning("Fetch of upstream remote '{r}' failed; not syncing it to origin".format(r=upstream.name))
+            upstream = None
+        if upstream is not None and origin is not None and origin.name not in failed:
+            self._mirror_upstream(repo, upstream, origin, timer=timer)
 
-        # guard with config setting TODO
-        if repo.is_dirty(untracked_files=True):
-            self.logger.warning("Repo has untracked files, not switching branches.")
-            return False
-        if 'master' not in repo.branches:
-            self.logger.warning("Repo has no 'master' branch; skipping further work")
-            return False
-        raise NotImplementedError("wrap the upstream-to-origin branch sync logic in a func, so we can do for *all* branches in both remotes")
-        # checkout master, pull
-        if current_branch != 'master':
-            self._checkout_branch(repo, 'master')
-        self._pull_remote(repo, 'origin')
-        # if we have an upstream to pull from, do that, then push to origin
-        if upstream is not None:
-            self._pull_remote(repo, upstream.name)
-            self._push_remotr(repo, 'origin')
-        # switch back to original branch
-        self._checkout_branch(repo, current_branch)
+        with timer.phase('fast-forward'):
+            self._fast_forward_branches(repo, status)
+        if self.maintenance:
+            self._maintain(repo, timer)
         return True
 
-    def _pull_remote(self, repo, rmtname):
-        """ pull from a remote """
-        if self.dryrun:
-            self.logger.info("DRYRUN - would pull remote '{r}'".format(r=rmtname))
-            return
-        self.logger.debug("pulling remote '{r}'".format(r=rmtname))
-        repo.remote(name=rmtname).pull()
+    def _maintain(self, repo, timer):
+        """
+        run the maintenance steps a clone needs, if any; see gitclonesync.maintenance
 
-    def _push_remote(self, repo, rmtname):
-        """ push from a remote """
+        :param repo: the clone
+        :type repo: git.Repo
+        :param timer: records how long each step takes, and the object counts before and after
+        :type timer: gitclonesync.timing.RepoTimer
+        """
+        if repo.git.version_info[:2] < MAINTENANCE_GIT_VERSION:
+            self.logger.debug("git {v} is too old for incremental maintenance; skipping it".format(
+                v='.'.join(str(x) for x in repo.git.version_info)))
+            return
+        with timer.phase('count-objects'):
+            before = count_packs(parse_count_objects(repo.git.execute(['git'] + COUNT_OBJECTS_ARGS)), repo.git_dir)
+        steps = maintenance_steps(before, max_packs=self.max_packs, max_loose=self.max_loose)
+        if not steps:
+            return
+        reason = maintenance_reason(before, max_packs=self.max_packs, max_loose=self.max_loose)
         if self.dryrun:
-            self.logger.info("DRYRUN - would push to remote '{r}'".format(r=rmtname))
+            self.logger.info("DRYRUN - would run {s} ({r})".format(
+                s=', '.join(name for name, _ in steps), r=reason or 'packed loose objects'))
             return
-        self.logger.debug("pushing to remote '{r}'".format(r=rmtname))
-        repo.remote(name=rmtname).push()
+        for name, args in steps:
+            with timer.phase(name):
+                status, _, err = repo.git.execute(['git'] + args, with_exceptions=False, with_extended_output=True)
+            if status != 0:
+                self.logger.warning("Maintenance step '{n}' failed: {e}".format(n=name, e=err.strip()))
+                return
+        after = parse_count_objects(repo.git.execute(['git'] + COUNT_OBJECTS_ARGS))
+        timer.maintenance = maintenance_summary(before, after)
+        if reason is not None:
+            self.logger.info("Maintained {p} ({r}): {a} -> {b} packs, {c} -> {d} loose objects".format(
+                p=repo.working_tree_dir, r=reason, a=before.get('packs', 0), b=after.get('packs', 0),
+                c=before.get('count', 0), d=after.get('count', 0)))
+
+    def _repo_status(self, repo):
+        """
+        get the working tree status of a clone in one pass, logging how long it took
+
+        :param repo: the clone
+        :type repo: git.Repo
+        :rtype: gitclonesync.status.RepoStatus
+        """
+        status = get_repo_status(repo, optional_locks=not self.dryrun)
+        self.logger.debug("status of {p} took {t:.3f}s: {c} changed, {u} untracked".format(
+            p=repo.working_tree_dir, t=status.elapsed, c=status.changed, u=status.untracked))
+        if status.elapsed > SLOW_STATUS and not (status.untracked_cache and status.fsmonitor):
+            self.logger.warning("Status check of {p} took {t:.1f}s; consider enabling "
+                                "core.untrackedCache and core.fsmonitor for it".format(
+                                    p=repo.working_tree_dir, t=status.elapsed))
+        return status
+
+    def _fast_forward_branches(self, repo, status):
+        """
+        fast-forward local branches to their (just fetched) upstream tracking
+        branches. Branches that aren't checked out in any worktree are updated
+        with ``git update-ref``, without touching the working tree; the
+        checked-out branch is fast-forwarded with ``git merge --ff-only``, and
+        only if it has no untracked files.
+
+        :param repo: the clone
+        :type repo: git.Repo
+        :param status: status of the clone from before the fetch
+        :type status: gitclonesync.status.RepoStatus
+        :returns: list of gitclonesync.branchsync.BranchUpdate that were (or, in dryrun, would be) applied
+        :rtype: list
+        """
+        checked_out = checked_out_branches(repo.git.execute(['git'] + WORKTREE_LIST_ARGS))
+        updates = []
+        for u in ff_candidates(repo.git.execute(['git'] + LOCAL_REFS_ARGS)):
+            code, _, _ = repo.git.execute(['git', 'merge-base', '--is-ancestor', u.old, u.new],
+                                          with_exceptions=False, with_extended_output=True)
+            if code != 0:
+                self.logger.debug("branch '{b}' has diverged from its upstream; not fast-forwarding it".format(
+                    b=u.branch))
+                continue
+            if u.branch == status.branch:
+                # fetching doesn't touch the work tree, so the status from above is still current
+                if status.is_dirty(untracked_files=True):
+                    self.logger.warning("Repo has untracked files, not fast-forwarding checked-out "
+                                        "branch '{b}'".format(b=u.branch))
+                    continue
+            elif u.branch in checked_out:
+                self.logger.debug("branch '{b}' is checked out in another worktree; not fast-forwarding it".format(
+                    b=u.branch))
+                continue
+            updates.append(u)
+        done = []
+        for u in updates:
+            if self.dryrun:
+                self.logger.info("DRYRUN - would fast-forward branch '{b}' to {n}".format(b=u.branch, n=u.new[:7]))
+                done.append(u)
+                continue
+            args = merge_ff_args(u) if u.branch == status.branch else update_ref_args(u)
+            code, _, err = repo.git.execute(['git'] + args, with_exceptions=False, with_extended_output=True)
+            if code != 0:
+                self.logger.warning("Unable to fast-forward branch '{b}': {e}".format(b=u.branch, e=err.strip()))
+                continue
+            self.logger.info("Fast-forwarded branch '{b}' ({o}..{n})".format(b=u.branch, o=u.old[:7], n=u.new[:7]))
+            done.append(u)
+        return done
 
-    def _checkout_branch(self, repo, branchname):
-        """ check out a branch """
+    def _mirror_upstream(self, repo, upstream, origin, timer=None):
+        """
+        push every branch that upstream has fast-forwarded past origin to
+        origin, in one push, using the remote-tracking refs from the fetch
+
+        :param repo: the clone
+        :type repo: git.Repo
+        :param upstream: the upstream remote
+        :type upstream: git.Remote
+        :param origin: the origin remote
+        :type origin: git.Remote
+        :param timer: records how long the push takes
+        :type timer: gitclonesync.timing.RepoTimer
+        :returns: list of gitclonesync.branchsync.BranchUpdate that were (or, in dryrun, would be) pushed
+        :rtype: list
+        """
+        if timer is None:
+            timer = RepoTimer(repo.working_tree_dir)
+        out = repo.git.execute(['git'] + remote_refs_args(upstream.name, origin.name))
+        candidates = mirror_candidates(parse_remote_refs(out, upstream.name), parse_remote_refs(out, origin.name),
+                                       include_new=self.mirror_new_branches)
+        updates = []
+        for u in candidates:
+            if u.old is not None:
+                status, _, _ = repo.git.execute(['git', 'merge-base', '--is-ancestor', u.old, u.new],
+                                                with_exceptions=False, with_extended_output=True)
+                if status != 0:
+                    self.logger.debug("{o}/{b} is not an ancestor of {u}/{b}; not mirroring it".format(
+                        o=origin.name, u=upstream.name, b=u.branch))
+                    continue
+            updates.append(u)
+        if not updates:
+            self.logger.debug("origin is up to date with upstream")
+            return []
         if self.dryrun:
-            self.logger.info("DRYRUN - would check out branch '{b}'".format(b=branchname))
-            return
-        self.logger.debug("checking out branch '{b}'".format(b=branchname))
-        b = getattr(repo.heads, branchname)
-        b.checkout()
+            for u in updates:
+                self.logger.info("DRYRUN - would push {u}/{b} to {o}/{b}".format(
+                    u=upstream.name, o=origin.name, b=u.branch))
+            return updates
+        with self.host_limiter.limit(origin.url):
+            with timer.phase('push', remote=origin.name):
+                status, out, err = repo.git.execute(['git'] + push_args(origin.name, upstream.name, updates),
+                                                    with_exceptions=False, with_extended_output=True,
+                                                    kill_after_timeout=self.fetch_timeout)
+        apply_push_output(updates, out)
+        for u in updates:
+            if u.pushed:
+                self.logger.info("Mirrored {u}/{b} to {o} ({old}..{new})".format(
+                    u=upstream.name, o=origin.name, b=u.branch, old=(u.old or '')[:7], new=u.new[:7]))
+            else:
+                self.logger.warning("Unable to mirror {u}/{b} to {o}: {e}".format(
+                    u=upstream.name, o=origin.name, b=u.branch, e=u.error))
+        if status != 0:
+            self.logger.debug("push to {o} exited {s}: {e}".format(o=origin.name, s=status, e=err.strip()))
+        return [u for u in updates if u.pushed]
+
+    def _fetch_profiles(self, repo, path, remotes):
+        """
+        select the fetch profile of each remote (see gitclonesync.fetchprofile),
+        first converting the remotes whose profile has a filter to promisor
+        remotes, which makes the clone a partial clone. The settings are read
+        with GitPython's config reader, as the remotes were, rather than by
+        running ``git config``, where the installed GitPython allows it.
+
+        :param repo: the clone
+        :type repo: git.Repo
+        :param path: path to the clone
+        :type path: string
+        :param remotes: list of git.Remote to be fetched
+        :type remotes: list
+        :returns: dict of remote name to FetchProfile, for the remotes that have one
+        :rtype: dict
+        """
+        items = reader_config_items(repo.config_reader())
+        if items is not None:
+            profiles, repo_profile, settings = profile_config(items)
+        else:
+            profiles, repo_profile, settings = parse_profile_config(
+                repo.git.execute(['git'] + PROFILE_CONFIG_ARGS, with_exceptions=False))
+        selected = {}
+        for rmt in remotes:
+            try:
+                profile = select_profile(profiles, repo_profile, settings, rmt.name, rmt.url, path)
+            except ValueError as ex:
+                self.logger.warning("Fetching remote '{r}' of {p} without a profile: {e}".format(
+                    r=rmt.name, p=path, e=ex))
+                continue
+            if profile is None:
+                continue
+            conversion = profile.conversion_args(rmt.name, settings.get(rmt.name, {}))
+            if conversion and repo.git.version_info[:2] < PARTIAL_CLONE_GIT_VERSION:
+                self.logger.warning("git {v} is too old to convert remote '{r}' of {p} to a partial clone; "
+                                    "fetching it without profile '{n}'".format(
+                                        v='.'.join(str(x) for x in repo.git.version_info), r=rmt.name, p=path,
+                                        n=profile.name))
+                continue
+            if conversion and self.dryrun:
+                self.logger.info("DRYRUN - would convert remote '{r}' of {p} to a partial clone with filter "
+                                 "{f}".format(r=rmt.name, p=path, f=profile.filter))
+            elif conversion:
+                for args in conversion:
+                    repo.git.execute(['git'] + args)
+                self.logger.info("Converted remote '{r}' of {p} to a partial clone with filter {f}".format(
+                    r=rmt.name, p=path, f=profile.filter))
+            self.logger.debug("fetching remote '{r}' with profile '{n}'".format(r=rmt.name, n=profile.name))
+            selected[rmt.name] = profile
+        return selected
+
+    def _fetch_remotes(self, repo, remotes, timer=None, profiles=None):
+        """
+        fetch several remotes of one clone, concurrently if self.remote_jobs > 1
+
+        Concurrent fetches don't write FETCH_HEAD (which every fetch would
+        otherwise overwrite) and don't run auto-gc. Each remote updates only its
+        own ``refs/remotes/<name>/`` namespace, but tags are shared, so a fetch
+        that fails on a ref lock held by a sibling fetch is retried serially.
 
-    def _fetch_remote(self, rmt):
-        """ fetch a remote """
+        :param repo: the clone
+        :type repo: git.Repo
+        :param remotes: list of git.Remote to fetch
+        :type remotes: list
+        :param timer: records how long each fetch takes
+        :type timer: gitclonesync.timing.RepoTimer
+        :param profiles: dict of remote name to the FetchProfile to fetch it with
+        :type profiles: dict
+        :returns: names of the remotes that could not be fetched
+        :rtype: list
+        """
+        git = gitpython()
+        profiles = profiles or {}
+        if self.remote_jobs < 2 or len(remotes) < 2 or self.dryrun or not self._can_fetch_concurrently(repo):
+            return [rmt.name for rmt in remotes
+                    if not self._try_fetch_remote(rmt, timer=timer, profile=profiles.get(rmt.name))]
+        errors = {}
+        slots = threading.BoundedSemaphore(self.remote_jobs)
+
+        def fetch(rmt):
+            with slots:
+                try:
+                    self._fetch_remote(rmt, concurrent=True, timer=timer, profile=profiles.get(rmt.name))
+                except git.GitCommandError as ex:
+                    errors[rmt.name] = ex
+
+        threads = [threading.Thread(target=fetch, args=(rmt,)) for rmt in remotes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        failed = []
+        for rmt in remotes:
+            if rmt.name not in errors:
+                continue
+            if is_ref_lock_error(errors[rmt.name].stderr):
+                self.logger.debug("ref lock conflict fetching remote '{r}'; retrying serially".format(r=rmt.name))
+                if self._try_fetch_remote(rmt, timer=timer, profile=profiles.get(rmt.name)):
+                    continue
+            else:
+                self.logger.error("Error fetching remote '{r}': {e}".format(r=rmt.name, e=errors[rmt.name]))
+            failed.append(rmt.name)
+        return failed
+
+    def _can_fetch_concurrently(self, repo):
+        """ return True if the installed git can safely fetch several remotes at once """
+        if repo.git.version_info[:2] >= CONCURRENT_FETCH_GIT_VERSION:
+            return True
+        self.logger.debug("git {v} is too old for concurrent fetches; fetching remotes serially".format(
+            v='.'.join(str(x) for x in repo.git.version_info)))
+        return False
+
+    def _try_fetch_remote(self, rmt, timer=None, profile=None):
+        """ fetch a remote, logging any error; return True on success """
+        git = gitpython()
+        try:
+            self._fetch_remote(rmt, timer=timer, profile=profile)
+        except git.GitCommandError as ex:
+            self.logger.error("Error fetching remote '{r}': {e}".format(r=rmt.name, e=ex))
+            return False
+        return True
+
+    def _fetch_remote(self, rmt, concurrent=False, timer=None, profile=None):
+        """
+        fetch a remote
+
+        :param rmt: the remote to fetch
+        :type rmt: git.Remote
+        :param concurrent: if True, other remotes of this clone are being fetched at the same time
+        :type concurrent: boolean
+        :param timer: records how long the ls-remote and fetch take, and what the fetch transferred
+        :type timer: gitclonesync.timing.RepoTimer
+        :param profile: the fetch profile to fetch the remote with, if any
+        :type profile: gitclonesync.fetchprofile.FetchProfile
+        """
+        git = gitpython()
         if self.dryrun:
             self.logger.info("DRYRUN - would fetch rmt '%s'" % rmt.name)
             return
-        self.logger.debug("fetching remote '%s'" % rmt.name)
-        rmt.fetch()
+        if timer is None:
+            timer = RepoTimer(rmt.repo.working_tree_dir)
+        kwargs = {}
+        if self.fetch_timeout:
+            kwargs['kill_after_timeout'] = self.fetch_timeout
+        with self.host_limiter.limit(rmt.url):
+            fingerprint = None
+            if self.ref_cache is not None:
+                with timer.phase('ls-remote', remote=rmt.name):
+                    fingerprint = self._remote_fingerprint(rmt, profile=profile, **kwargs)
+                if (fingerprint is not None and not self.force_fetch and
+                        self.ref_cache.is_current(rmt.url, rmt.repo.git_dir, fingerprint)):
+                    self.logger.debug("remote '%s' is unchanged since last fetch; skipping" % rmt.name)
+                    self.ref_cache.record_avoided()
+                    return
+            if concurrent:
+                kwargs['no_write_fetch_head'] = True
+                kwargs['no_auto_gc'] = True
+            self.logger.debug("fetching remote '%s'" % rmt.name)
+            try:
+                with timer.phase('fetch', remote=rmt.name):
+                    args = profile.fetch_args(rmt.name) if profile is not None else [rmt.name]
+                    _, _, stderr = rmt.repo.git.fetch(*args, progress=True, with_extended_output=True, **kwargs)
+            except git.GitCommandError:
+                if self.ref_cache is not None:
+                    self.ref_cache.invalidate(rmt.url, rmt.repo.git_dir)
+                raise
+            timer.add_fetch(rmt.name, *parse_fetch_progress(stderr))
+            if fingerprint is not None:
+                self.ref_cache.update(rmt.url, rmt.repo.git_dir, fingerprint)
 
-    def _check_versions(self):
+    def _remote_fingerprint(self, rmt, profile=None, **kwargs):
         """
-        checks that requirements have supported versions
-
-        this is mainly needed for GitPython, where we rely on features
-        in the 0.3.2.1 version
+        list the refs a remote advertises for its fetch refspecs (plus tags)
+        with ``git ls-remote``, and return a fingerprint of them
 
-        thanks to @qwcode for this simple logic
+        :param rmt: the remote
+        :type rmt: git.Remote
+        :param profile: the remote's fetch profile, whose refspecs (if any) replace the configured ones
+        :type profile: gitclonesync.fetchprofile.FetchProfile
+        :param kwargs: extra keyword arguments for the git command, i.e. kill_after_timeout
+        :returns: fingerprint string, or None if the remote could not be listed
         """
-        gp_req_str = 'GitPython>=0.3.2.1'
-        gp_req = pkg_resources.Requirement.parse(gp_req_str)
-        gp_dist = pkg_resources.get_distribution('GitPython')
-        self.logger.debug("Checking GitPython requirement")
-        if gp_dist not in gp_req:
-            raise SystemExit("ERROR: gitclonesync requires %s" % gp_req_str)
-        self.logger.debug("All requirements satisfied")
-        return True
+        git = gitpython()
+        if profile is not None and profile.refspecs:
+            refspecs = profile.refspecs_for(rmt.name)
+        else:
+            try:
+                refspecs = rmt.repo.git.config('--get-all', 'remote.{r}.fetch'.format(r=rmt.name)).splitlines()
+            except git.GitCommandError:
+                refspecs = []
+        try:
+            out = rmt.repo.git.ls_remote(rmt.name, *ls_remote_patterns(refspecs), **kwargs)
+        except git.GitCommandError as ex:
+            self.logger.debug("ls-remote of '{r}' failed; fetching anyway: {e}".format(r=rmt.name, e=ex))
+            return None
+        return ref_fingerprint(out)
 
 
 def parse_args(argv):
@@ -221,7 +1142,121 @@ def parse_args(argv):
     parser.add_argument('-o', '--only-origin', dest='origin_only', action='store_true', default=False,
                         help='only fetch origin, not any other remotes')
     parser.add_argument('-u', '--no-upstream', dest='no_upstream', action='store_true', default=False,
-                        help='do not push upstream/master to origin/master')
+                        help='do not push fast-forwarded upstream branches to origin')
+    parser.add_argument('-j', '--jobs', dest='jobs', action='store', type=int, default=1,
+                        help='number of clones to sync concurrently (default 1)')
+    parser.add_argument('-P', '--processes', dest='processes', action='store', type=int, default=0,
+                        help='sync clones in this many worker processes instead of -j threads, for '
+                        'CPU-bound work (gitpython engine only; --max-per-host is shared by all of them)')
+    parser.add_argument('--repo-timeout', dest='repo_timeout', action='store', type=int, default=None,
+                        help='with --processes, kill and replace a worker that spends longer than this '
+                        'many seconds on one clone')
+    parser.add_argument('--max-per-host', dest='max_per_host', action='store', type=int, default=4,
+                        help='maximum concurrent fetches against any one remote host (default 4)')
+    parser.add_argument('--remote-jobs', dest='remote_jobs', action='store', type=int, default=1,
+                        help='number of remotes of a single clone to fetch concurrently (default 1)')
+    parser.add_argument('--fetch-timeout', dest='fetch_timeout', action='store', type=int, default=None,
+                        help='kill any single remote fetch taking longer than this many seconds')
+    parser.add_argument('--ref-cache', dest='ref_cache_path', action='store', type=str,
+                        default=DEFAULT_REF_CACHE,
+                        help='cache of advertised remote refs, used to skip fetches of unchanged '
+                        'remotes (default {d})'.format(d=DEFAULT_REF_CACHE))
+    parser.add_argument('--no-ref-cache', dest='ref_cache_path', action='store_const', const=None,
+                        help='do not use the ref cache; always fetch every remote')
+    parser.add_argument('--ref-cache-max-age', dest='ref_cache_max_age', action='store', type=int,
+                        default=DEFAULT_MAX_AGE,
+                        help='fetch remotes at least this often (seconds), even if they look '
+                        'unchanged (default {d})'.format(d=DEFAULT_MAX_AGE))
+    parser.add_argument('-f', '--force-fetch', dest='force_fetch', action='store_true', default=False,
+                        help='fetch every remote even if the ref cache says it is unchanged')
+    parser.add_argument('-m', '--max-depth', dest='max_depth', action='store', type=int, default=1,
+                        help='how many directory levels below PATH to search for clones; '
+                        '0 for unlimited (default 1)')
+    parser.add_argument('--prune', dest='prune', action='append', default=[],
+                        help='do not search directories matching this name pattern for clones; '
+                        'may be given multiple times (always pruned: {d})'.format(d=', '.join(DEFAULT_PRUNE)))
+    parser.add_argument('--index', dest='index_path', action='store', type=str, default=DEFAULT_INDEX,
+                        help='discovery index, used to avoid re-listing unchanged directories '
+                        '(default {d})'.format(d=DEFAULT_INDEX))
+    parser.add_argument('--no-index', dest='index_path', action='store_const', const=None,
+                        help='do not use the discovery index; walk PATH fully')
+    parser.add_argument('--rebuild-index', dest='rebuild_index', action='store_true', default=False,
+                        help='rebuild the discovery index with a full walk of PATH, then exit')
+    parser.add_argument('--engine', dest='engine', action='store', choices=ENGINES, default=ENGINE_GITPYTHON,
+                        help='sync engine: "gitpython" (default) syncs clones with GitPython in '
+                        'worker threads; "subprocess" drives git processes from a single thread, '
+                        'with --jobs concurrent processes (status and fetch only)')
+    parser.add_argument('--add-upstreams', dest='add_upstreams', action='store_true', default=False,
+                        help='add an "upstream" remote for the parent of every clone whose origin is a '
+                        'GitHub fork, looked up via the GitHub API')
+    parser.add_argument('--pr-refs', dest='pr_refs', action='store_true', default=False,
+                        help='fetch the heads of open GitHub pull requests to refs/remotes/<remote>-pr/<N>, '
+                        'listing only those updated since the last run via the GitHub API')
+    parser.add_argument('--daemon', dest='daemon', action='store_true', default=False,
+                        help='run forever, re-syncing each clone at an interval adapted to how often it changes')
+    parser.add_argument('--min-interval', dest='min_interval', action='store', type=int,
+                        default=DEFAULT_MIN_INTERVAL,
+                        help='with --daemon, shortest interval between syncs of a clone in seconds '
+                        '(default {d})'.format(d=DEFAULT_MIN_INTERVAL))
+    parser.add_argument('--max-interval', dest='max_interval', action='store', type=int,
+                        default=DEFAULT_MAX_INTERVAL,
+                        help='with --daemon, longest interval between syncs of a clone in seconds '
+                        '(default {d})'.format(d=DEFAULT_MAX_INTERVAL))
+    parser.add_argument('--daemon-state', dest='daemon_state', action='store', type=str,
+                        default=DEFAULT_DAEMON_STATE,
+                        help='with --daemon, file the sync queue is written to after each batch and '
+                        'restored from on startup (default {d}); send SIGUSR1 to log it'.format(
+                            d=DEFAULT_DAEMON_STATE))
+    parser.add_argument('--watch', dest='watch', action='store_true', default=False,
+                        help='implies --daemon; also sync a clone as soon as its HEAD, index or local '
+                        'branches change (Linux inotify)')
+    parser.add_argument('--maintenance', dest='maintenance', action='store_true', default=False,
+                        help='after syncing a clone with too many packs or loose objects, repack it '
+                        'incrementally and write its multi-pack-index and commit-graph (git 2.32+)')
+    parser.add_argument('--max-packs', dest='max_packs', action='store', type=int, default=DEFAULT_MAX_PACKS,
+                        help='with --maintenance, maintain clones with more than this many packs '
+                        'not in their multi-pack-index '
+                        '(default {d})'.format(d=DEFAULT_MAX_PACKS))
+    parser.add_argument('--max-loose', dest='max_loose', action='store', type=int, default=DEFAULT_MAX_LOOSE,
+                        help='with --maintenance, maintain clones with more than this many loose '
+                        'objects (default {d})'.format(d=DEFAULT_MAX_LOOSE))
+    parser.add_argument('--shared-objects', dest='shared_objects', action='store', type=str, default=None,
+                        metavar='DIR',
+                        help='keep a bare reference repository in DIR for every remote that several clones '
+                        'share, fetch it once per run, and have those clones borrow its objects via git '
+                        'alternates')
+    parser.add_argument('--shared-min-clones', dest='shared_min_clones', action='store', type=int,
+                        default=DEFAULT_MIN_CLONES,
+                        help='with --shared-objects, share a remote once this many clones have it '
+                        '(default {d})'.format(d=DEFAULT_MIN_CLONES))
+    parser.add_argument('--journal', dest='journal_path', action='store', type=str, default=DEFAULT_JOURNAL,
+                        help='append-only journal of each clone\'s sync outcome, used by --resume and '
+                        '--retry-failed (default {d})'.format(d=DEFAULT_JOURNAL))
+    parser.add_argument('--no-journal', dest='journal_path', action='store_const', const=None,
+                        help='do not write the run journal')
+    parser.add_argument('--resume', dest='resume', action='store_true', default=False,
+                        help='skip clones the journal shows were synced within --resume-window, i.e. to '
+                        'continue a run that was killed')
+    parser.add_argument('--resume-window', dest='resume_window', action='store', type=int,
+                        default=DEFAULT_RESUME_WINDOW,
+                        help='with --resume, skip clones synced less than this many seconds ago '
+                        '(default {d})'.format(d=DEFAULT_RESUME_WINDOW))
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true', default=False,
+                        help='only sync the clones the journal shows failed the last time they were synced')
+    parser.add_argument('--ssh-multiplex', dest='ssh_multiplex', action='store_true', default=False,
+                        help='run all SSH connections to each remote host through one master connection '
+                        '(OpenSSH ControlMaster), opened once per run and closed at its end')
+    parser.add_argument('--ssh-persist', dest='ssh_persist', action='store', type=int, default=DEFAULT_PERSIST,
+                        help='with --ssh-multiplex, seconds a master connection stays up after its last '
+                        'git command (default {d})'.format(d=DEFAULT_PERSIST))
+    parser.add_argument('--mirror-new-branches', dest='mirror_new_branches', action='store_true', default=False,
+                        help='when mirroring upstream to origin, also create branches origin does not have')
+    parser.add_argument('--report', dest='report_path', action='store', type=str, default=None,
+                        help='write per-clone, per-phase timings and fetch sizes to this file '
+                        '(CSV if it ends in .csv, otherwise JSON)')
+    parser.add_argument('--report-slowest', dest='report_slowest', action='store', type=int,
+                        default=DEFAULT_SLOWEST,
+                        help='number of slowest clones to list in the report (default {d})'.format(d=DEFAULT_SLOWEST))
     parser.add_argument('directory', metavar='PATH', type=str, default=os.getcwd(), nargs='?',
                         help='path to git clone or directory of clones (default ./)')
     args = parser.parse_args(argv[1:])
@@ -240,5 +1275,52 @@ def cli_entry():
     elif args.quiet:
         logger.setLevel(logging.WARNING)
 
-    cs = CloneSyncer(path=args.directory, dryrun=args.dry_run, sync_dirty=args.sync_dirty, disable_github=args.disable_github, origin_only=args.origin_only, no_upstream=args.no_upstream)
+    cs = CloneSyncer(path=args.directory,
+                     dryrun=args.dry_run,
+                     sync_dirty=args.sync_dirty,
+                     disable_github=args.disable_github,
+                     origin_only=args.origin_only,
+                     no_upstream=args.no_upstream,
+                     jobs=args.jobs,
+                     max_per_host=args.max_per_host,
+                     remote_jobs=args.remote_jobs,
+                     fetch_timeout=args.fetch_timeout,
+                     ref_cache_path=args.ref_cache_path,
+                     ref_cache_max_age=args.ref_cache_max_age,
+                     force_fetch=args.force_fetch,
+                     max_depth=args.max_depth or None,
+                     prune=args.prune,
+                     index_path=args.index_path,
+                     engine=args.engine,
+                     report_path=args.report_path,
+                     report_slowest=args.report_slowest,
+                     mirror_new_branches=args.mirror_new_branches,
+                     pr_refs=args.pr_refs,
+                     processes=args.processes,
+                     repo_timeout=args.repo_timeout,
+                     maintenance=args.maintenance,
+                     max_packs=args.max_packs,
+                     max_loose=args.max_loose,
+                     shared_objects=args.shared_objects,
+                     shared_min_clones=args.shared_min_clones,
+                     journal_path=args.journal_path,
+                     resume=args.resume,
+                     resume_window=args.resume_window,
+                     retry_failed=args.retry_failed,
+                     ssh_multiplex=args.ssh_multiplex,
+                     ssh_persist=args.ssh_persist,
+                     add_upstreams=args.add_upstreams)
+    if args.rebuild_index:
+        cs.rebuild_index()
+        return
+    if args.daemon or args.watch:
+        daemon = SyncDaemon(cs, min_interval=args.min_interval, max_interval=args.max_interval,
+                            state_path=args.daemon_state)
+        if args.watch:
+            try:
+                daemon.watcher = CloneWatcher(daemon)
+            except InotifyError as ex:
+                logger.error("Unable to watch clones for local changes: {e}".format(e=ex))
+        daemon.run()
+        return
     cs.run()
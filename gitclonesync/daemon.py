@@ -0,0 +1,356 @@
+"""
+Long-running sync daemon: keeps one CloneSyncer loaded and a priority queue
+of clones, each re-synced at an interval adapted to how often it has been
+seen to change
+"""
+
+import heapq
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+DEFAULT_MIN_INTERVAL = 300
+DEFAULT_MAX_INTERVAL = 86400
+DEFAULT_DAEMON_STATE = '~/.gitclonesync_daemon.json'
+
+# re-walk the sync directory for added and removed clones this often (seconds)
+DEFAULT_REDISCOVER_INTERVAL = 3600
+
+# a clone that changed is next synced after interval / CHANGED_FACTOR; one that didn't, after interval * IDLE_FACTOR
+CHANGED_FACTOR = 2.0
+IDLE_FACTOR = 1.5
+
+# ignore local-change triggers this many seconds after a clone's sync, which itself writes its refs and index
+LOCAL_CHANGE_GRACE = 5
+
+# number of queue entries logged on SIGUSR1
+LOG_QUEUE_ENTRIES = 20
+
+
+class RepoSchedule:
+    """
+    Sync schedule and change history of one clone
+    """
+
+    def __init__(self, path, interval, due):
+        """
+        init
+
+        :param path: path to the clone
+        :type path: string
+        :param interval: current sync interval, in seconds
+        :type interval: float
+        :param due: time the next sync is due at (epoch seconds)
+        :type due: float
+        """
+        self.path = path
+        self.interval = interval
+        self.due = due
+        self.last_sync = None
+        self.last_change = None
+        self.last_status = None
+        self.syncs = 0
+        self.changes = 0
+        self.failures = 0
+        # set while a sync of the clone is in progress, and if it is triggered meanwhile
+        self.running = False
+        self.retrigger = False
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'interval': self.interval,
+            'due': self.due,
+            'last_sync': self.last_sync,
+            'last_change': self.last_change,
+            'last_status': self.last_status,
+            'syncs': self.syncs,
+            'changes': self.changes,
+            'failures': self.failures,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        s = cls(d['path'], d['interval'], d['due'])
+        for k in ('last_sync', 'last_change', 'last_status', 'syncs', 'changes', 'failures'):
+            if k in d:
+                setattr(s, k, d[k])
+        return s
+
+
+def result_changed(result):
+    """
+    whether a sync brought in anything new
+
+    :param result: the clone's sync result
+    :type result: gitclonesync.scheduler.SyncResult
+    :rtype: boolean
+    """
+    if result.timer is None:
+        return False
+    return any(f['objects'] > 0 for f in result.timer.fetches.values())
+
+
+class SyncDaemon:
+    """
+    Re-syncs the clones found by a CloneSyncer forever, soonest-due first
+    """
+
+    def __init__(self, syncer, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 state_path=DEFAULT_DAEMON_STATE, rediscover_interval=DEFAULT_REDISCOVER_INTERVAL):
+        """
+        init
+
+        :param syncer: the CloneSyncer to discover and sync clones with
+        :type syncer: gitclonesync.clonesyncer.CloneSyncer
+        :param min_interval: shortest interval between syncs of one clone, in seconds
+        :type min_interval: int
+        :param max_interval: longest interval between syncs of one clone, in seconds
+        :type max_interval: int
+        :param state_path: JSON file the queue is written to after every batch, and
+          restored from on startup; None to disable
+        :type state_path: string
+        :param rediscover_interval: how often to look for added or removed clones, in seconds
+        :type rediscover_interval: int
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.syncer = syncer
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.state_path = os.path.expanduser(state_path) if state_path is not None else None
+        self.rediscover_interval = rediscover_interval
+        self.repos = {}
+        self.batches = 0
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._log_requested = False
+        self._next_discovery = 0
+        # optional gitclonesync.watcher.CloneWatcher, kept watching every tracked clone
+        self.watcher = None
+
+    def _push(self, sched):
+        """ (re)queue a clone at its due time; stale heap entries are skipped when popped """
+        heapq.heappush(self._heap, (sched.due, sched.path))
+
+    def load_state(self):
+        """ restore the learned intervals and due times of clones from self.state_path """
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as fh:
+                data = json.load(fh)
+        except (IOError, ValueError) as ex:
+            self.logger.warning("Ignoring unreadable daemon state {p}: {e}".format(p=self.state_path, e=ex))
+            return
+        with self._lock:
+            for d in data.get('repos', []):
+                self.repos[d['path']] = RepoSchedule.from_dict(d)
+        self.logger.info("Restored the schedule of {n} clone(s) from {p}".format(
+            n=len(self.repos), p=self.state_path))
+
+    def save_state(self, now=None):
+        """ write the queue to self.state_path, atomically """
+        if self.state_path is None:
+            return
+        data = self.queue_state(now=now)
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh, indent=1, sort_keys=True)
+        os.rename(tmp, self.state_path)
+
+    def queue_state(self, now=None):
+        """
+        the current queue, soonest-due first
+
+        :rtype: dict
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            repos = sorted((s.as_dict() for s in self.repos.values()), key=lambda d: (d['due'], d['path']))
+        return {'updated': now, 'batches': self.batches, 'repos': repos}
+
+    def discover(self, now=None):
+        """ add newly found clones to the queue (due now) and drop ones that have gone away """
+        if now is None:
+            now = time.time()
+        paths = set(self.syncer.discover())
+        with self._lock:
+            added = [p for p in paths if p not in self.repos]
+            removed = [p for p in self.repos if p not in paths]
+            for path in removed:
+                del self.repos[path]
+            for path in added:
+                self.repos[path] = RepoSchedule(path, self.min_interval, now)
+            self._heap = [(sched.due, sched.path) for sched in self.repos.values()]
+            heapq.heapify(self._heap)
+        if self.watcher is not None:
+            self.watcher.update(paths)
+        self._next_discovery = now + self.rediscover_interval
+        self.logger.info("Tracking {n} clone(s): {a} added, {r} removed".format(
+            n=len(self.repos), a=len(added), r=len(removed)))
+
+    def trigger(self, path, now=None, local_change=False):
+        """
+        queue a clone for an immediate sync; safe to call from any thread
+
+        :param path: path to the clone
+        :type path: string
+        :param local_change: the trigger is a change to the clone's HEAD, index or
+          branches; these are ignored during and just after a sync of the clone,
+          which makes such changes itself
+        :type local_change: boolean
+        :returns: False if the clone isn't being tracked, or the trigger was ignored
+        :rtype: boolean
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            sched = self.repos.get(path)
+            if sched is None:
+                return False
+            if local_change and (sched.running or
+                                 (sched.last_sync is not None and now - sched.last_sync < LOCAL_CHANGE_GRACE)):
+                return False
+            if sched.running:
+                # the running sync may have missed the change; go again as soon as it finishes
+                sched.retrigger = True
+            elif sched.due > now:
+                sched.due = now
+                self._push(sched)
+        self._wake.set()
+        return True
+
+    def pop_due(self, now=None):
+        """
+        remove and return every clone that is due
+
+        :rtype: list
+        """
+        if now is None:
+            now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                at, path = heapq.heappop(self._heap)
+                sched = self.repos.get(path)
+                if sched is None or sched.due != at or sched.running:
+                    continue
+                sched.running = True
+                due.append(path)
+        return due
+
+    def next_due(self):
+        """ time the soonest-due clone is due at, or None if none are queued """
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def reschedule(self, result, now=None):
+        """
+        set the next due time of a synced clone: clones that changed are synced
+        more often, down to min_interval, and unchanged ones less often, up to
+        max_interval
+
+        :param result: the clone's sync result
+        :type result: gitclonesync.scheduler.SyncResult
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            sched = self.repos.get(result.path)
+            if sched is None:
+                return
+            sched.syncs += 1
+            sched.last_sync = now
+            sched.last_status = result.status
+            if result.error is not None:
+                sched.failures += 1
+            if result_changed(result):
+                sched.changes += 1
+                sched.last_change = now
+                sched.interval = max(self.min_interval, sched.interval / CHANGED_FACTOR)
+            else:
+                sched.interval = min(self.max_interval, sched.interval * IDLE_FACTOR)
+            sched.due = now if sched.retrigger else now + sched.interval
+            sched.running = False
+            sched.retrigger = False
+            self._push(sched)
+
+    def run_once(self, now=None):
+        """
+        sync every clone that is due, and requeue them
+
+        :returns: number of clones synced
+        :rtype: int
+        """
+        if now is None:
+            now = time.time()
+        if now >= self._next_discovery:
+            self.discover(now=now)
+        due = self.pop_due(now=now)
+        if not due:
+            return 0
+        self.logger.info("Syncing {n} due clone(s)".format(n=len(due)))
+        results, elapsed = self.syncer.sync_paths(due)
+        done = time.time()
+        for result in results:
+            self.reschedule(result, now=done)
+        self.batches += 1
+        self.save_state(now=done)
+        return len(due)
+
+    def log_queue(self):
+        """ log the soonest-due clones """
+        state = self.queue_state()
+        self.logger.warning("{n} clone(s) queued after {b} batch(es); next {m}:".format(
+            n=len(state['repos']), b=state['batches'], m=min(LOG_QUEUE_ENTRIES, len(state['repos']))))
+        for d in state['repos'][:LOG_QUEUE_ENTRIES]:
+            self.logger.warning("  in {t:>7.0f}s every {i:>6.0f}s  {c}/{s} syncs changed  {p}".format(
+                t=d['due'] - state['updated'], i=d['interval'], c=d['changes'], s=d['syncs'], p=d['path']))
+
+    def request_queue_log(self, *args):
+        """
+        have run() log the queue; the SIGUSR1 handler. Logging it here could
+        deadlock, as the signal may arrive while the main thread holds _lock.
+        """
+        self._log_requested = True
+        self._wake.set()
+
+    def stop(self, *args):
+        """ stop after the current batch; the SIGTERM / SIGINT handler """
+        self.logger.warning("Stopping after the current batch")
+        self._stopping = True
+        self._wake.set()
+
+    def run(self):
+        """ sync forever, until stop() is called or SIGTERM / SIGINT is received """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.request_queue_log)
+        self.load_state()
+        self.logger.info("Starting sync daemon; intervals {a}s to {b}s".format(
+            a=self.min_interval, b=self.max_interval))
+        if self.watcher is not None:
+            self.watcher.start()
+        try:
+            while not self._stopping:
+                self.run_once()
+                wait = self._next_discovery - time.time()
+                due = self.next_due()
+                if due is not None:
+                    wait = min(wait, due - time.time())
+                if wait > 0 and not self._stopping and not self._log_requested:
+                    self._wake.wait(wait)
+                self._wake.clear()
+                if self._log_requested:
+                    self._log_requested = False
+                    self.log_queue()
+        finally:
+            if self.watcher is not None:
+                self.watcher.stop()
+        self.save_state()
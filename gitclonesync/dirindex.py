@@ -0,0 +1,120 @@
+"""
+Persistent index of the directories RepoFinder has walked, so later runs only
+re-list directories whose mtime has changed
+"""
+
+import json
+import logging
+import os
+import time
+
+DEFAULT_INDEX = '~/.gitclonesync_index.jsonl'
+
+# a directory modified this close (seconds) to when it was listed may have
+# changed again within the same mtime tick, so its entry isn't trusted
+RACY_WINDOW = 2.0
+
+
+class DirIndex:
+    """
+    JSON-lines file with one entry per walked directory:
+    ``{"dir": path, "mtime": mtime, "scanned": time, "subdirs": [names], "repo": null or [kind, common_dir]}``
+
+    A directory's mtime changes whenever an entry directly inside it is added,
+    removed or renamed, so an entry whose mtime still matches the directory
+    on disk can be reused in place of listing the directory again.
+    """
+
+    def __init__(self, path, rebuild=False):
+        """
+        init
+
+        :param path: path to the index file
+        :type path: string
+        :param rebuild: if True, ignore the existing contents of the index
+        :type rebuild: boolean
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.expanduser(path)
+        self._entries = {} if rebuild else self._load()
+        self._roots = set()
+        self._visited = {}
+
+    def _load(self):
+        """ read the index file; unparseable lines are ignored """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path) as fh:
+            for line in fh:
+                try:
+                    e = json.loads(line)
+                    entries[e['dir']] = e
+                except (ValueError, KeyError, TypeError):
+                    continue
+        self.logger.debug("loaded {n} directories from index {p}".format(n=len(entries), p=self.path))
+        return entries
+
+    def lookup(self, path, mtime):
+        """
+        return the cached entry for ``path`` if it is still valid for ``mtime``
+
+        :param path: directory path
+        :type path: string
+        :param mtime: current mtime of the directory
+        :type mtime: float
+        :returns: entry dict, or None
+        """
+        e = self._entries.get(path)
+        if e is None or e.get('mtime') != mtime:
+            return None
+        if e.get('scanned', 0) - mtime < RACY_WINDOW:
+            return None
+        self._visited[path] = e
+        return e
+
+    def store(self, path, mtime, subdirs, repo=None):
+        """
+        record a freshly listed directory
+
+        :param path: directory path
+        :type path: string
+        :param mtime: mtime of the directory when it was listed
+        :type mtime: float
+        :param subdirs: names of (non-symlink) subdirectories
+        :type subdirs: list
+        :param repo: None, or (kind, common_dir) if the directory is a repository
+        :type repo: tuple
+        """
+        self._visited[path] = {
+            'dir': path,
+            'mtime': mtime,
+            'scanned': time.time(),
+            'subdirs': sorted(subdirs),
+            'repo': list(repo) if repo is not None else None,
+        }
+
+    def begin(self, root):
+        """ note that ``root`` is being walked; entries under it not visited are dropped on save """
+        self._roots.add(os.path.normpath(root))
+
+    def _under_walked_root(self, path):
+        """ return True if ``path`` is one of, or below one of, the walked roots """
+        for root in self._roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return True
+        return False
+
+    def save(self):
+        """ write the index, replacing entries under the walked roots with those visited """
+        entries = dict((k, v) for k, v in self._entries.items() if not self._under_walked_root(k))
+        entries.update(self._visited)
+        tmp = '{p}.{pid}.tmp'.format(p=self.path, pid=os.getpid())
+        with open(tmp, 'w') as fh:
+            for key in sorted(entries):
+                fh.write(json.dumps(entries[key], sort_keys=True) + '\n')
+        os.rename(tmp, self.path)
+        self._entries = entries
+        self._visited = {}
+        self._roots = set()
+        self.logger.debug("wrote {n} directories to index {p}".format(n=len(entries), p=self.path))
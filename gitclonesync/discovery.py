@@ -0,0 +1,243 @@
+"""
+gitclonesync repository discovery - finds git clones under a directory
+"""
+
+import fnmatch
+import logging
+import os
+
+try:
+    from os import scandir
+except ImportError:
+    # python2; prefer the scandir backport if it's installed
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+CLONE = 'clone'
+WORKTREE = 'worktree'
+SUBMODULE = 'submodule'
+BARE = 'bare'
+
+# kinds of repository that CloneSyncer operates on
+SYNC_KINDS = (CLONE, WORKTREE)
+
+# directory names (fnmatch patterns) never descended into
+DEFAULT_PRUNE = ('node_modules', '.tox', '.venv', 'venv', '__pycache__', '.cache')
+
+# entries that make a directory a bare repository
+BARE_MARKERS = frozenset(['HEAD', 'objects', 'refs'])
+
+
+class DiscoveredRepo:
+    """
+    A git repository found by RepoFinder
+    """
+
+    def __init__(self, path, kind, common_dir):
+        """
+        init
+
+        :param path: path to the repository (work tree, or git dir for bare repos)
+        :type path: string
+        :param kind: one of CLONE, WORKTREE, SUBMODULE or BARE
+        :type kind: string
+        :param common_dir: real path of the git directory holding the objects and remotes
+        :type common_dir: string
+        """
+        self.path = path
+        self.kind = kind
+        self.common_dir = common_dir
+
+    def __repr__(self):
+        return "<DiscoveredRepo {k} {p}>".format(k=self.kind, p=self.path)
+
+
+class _DirEntry:
+    """ minimal stand-in for os.DirEntry, for pythons without scandir """
+
+    def __init__(self, parent, name):
+        self.name = name
+        self.path = os.path.join(parent, name)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and self.is_symlink():
+            return False
+        return os.path.isdir(self.path)
+
+    def is_file(self, follow_symlinks=True):
+        if not follow_symlinks and self.is_symlink():
+            return False
+        return os.path.isfile(self.path)
+
+
+def _scandir(path):
+    """ list a directory as DirEntry-like objects """
+    if scandir is not None:
+        return list(scandir(path))
+    return [_DirEntry(path, name) for name in os.listdir(path)]
+
+
+def _read_gitfile(path):
+    """
+    resolve a ``.git`` file (``gitdir: <path>``) to the absolute git dir it points to
+
+    :param path: path to the .git file
+    :type path: string
+    :returns: absolute path, or None if the file isn't a valid gitfile
+    """
+    try:
+        with open(path) as fh:
+            content = fh.read().strip()
+    except IOError:
+        return None
+    if not content.startswith('gitdir:'):
+        return None
+    gitdir = content[len('gitdir:'):].strip()
+    return os.path.normpath(os.path.join(os.path.dirname(path), gitdir))
+
+
+class RepoFinder:
+    """
+    Recursively finds git repositories under a directory with one scandir per
+    directory, without descending into repositories themselves.
+    """
+
+    def __init__(self, max_depth=1, prune=DEFAULT_PRUNE, kinds=SYNC_KINDS, index=None):
+        """
+        init
+
+        :param max_depth: how many directory levels below the root to search; None for unlimited
+        :type max_depth: int
+        :param prune: fnmatch patterns of directory names not to descend into
+        :type prune: tuple
+        :param kinds: kinds of repository to yield (see SYNC_KINDS)
+        :type kinds: tuple
+        :param index: index of previously walked directories, to skip re-listing unchanged ones
+        :type index: gitclonesync.dirindex.DirIndex
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.max_depth = max_depth
+        self.prune = tuple(prune)
+        self.kinds = tuple(kinds)
+        self.index = index
+        self.dirs_scanned = 0
+        self.dirs_cached = 0
+
+    def find(self, root):
+        """
+        generator of DiscoveredRepo for each repository under ``root``, yielded
+        as soon as it is found; repositories sharing a git directory (i.e. a
+        clone and its worktrees) are only yielded once
+
+        :param root: directory to search
+        :type root: string
+        """
+        root = os.path.abspath(root)
+        seen = set()
+        if self.index is not None:
+            self.index.begin(root)
+        stack = [(root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            listing = self._list(path)
+            if listing is None:
+                continue
+            repo, subdirs = listing
+            if repo is not None:
+                for r in self._filter(repo, seen):
+                    yield r
+                continue
+            if self.max_depth is not None and depth >= self.max_depth:
+                continue
+            # reversed, so that the stack pops them in sorted order
+            for name in sorted((n for n in subdirs if not self._pruned(n)), reverse=True):
+                stack.append((os.path.join(path, name), depth + 1))
+
+    def _list(self, path):
+        """
+        determine whether ``path`` is a repository and what subdirectories it
+        has, from the index if its entry is still valid, else by listing it
+
+        :param path: directory path
+        :type path: string
+        :returns: (DiscoveredRepo or None, list of subdirectory names), or None if path can't be read
+        :rtype: tuple
+        """
+        mtime = None
+        try:
+            if self.index is not None:
+                mtime = os.stat(path).st_mtime
+                e = self.index.lookup(path, mtime)
+                if e is not None:
+                    self.dirs_cached += 1
+                    repo = DiscoveredRepo(path, *e['repo']) if e['repo'] else None
+                    return repo, e['subdirs']
+            entries = _scandir(path)
+        except OSError as ex:
+            self.logger.warning("Unable to list {p}: {e}".format(p=path, e=ex))
+            return None
+        self.dirs_scanned += 1
+        repo = self._classify(path, entries)
+        subdirs = []
+        if repo is None:
+            subdirs = [e.name for e in entries if e.is_dir(follow_symlinks=False)]
+        if self.index is not None:
+            self.index.store(path, mtime, subdirs, (repo.kind, repo.common_dir) if repo else None)
+        return repo, subdirs
+
+    def _filter(self, repo, seen):
+        """ yield ``repo`` unless its kind is excluded or its git dir was already seen """
+        if repo.kind not in self.kinds:
+            self.logger.debug("skipping {k} repository {p}".format(k=repo.kind, p=repo.path))
+            return
+        if repo.common_dir in seen:
+            self.logger.debug("skipping {p}; its git dir {g} was already found".format(
+                p=repo.path, g=repo.common_dir))
+            return
+        seen.add(repo.common_dir)
+        yield repo
+
+    def _pruned(self, name):
+        """ return True if a directory called ``name`` should not be descended into """
+        if name == '.git':
+            return True
+        for pattern in self.prune:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def _classify(self, path, entries):
+        """
+        determine whether ``path`` is a git repository, from its directory entries
+
+        :param path: directory path
+        :type path: string
+        :param entries: DirEntry objects for the contents of ``path``
+        :type entries: list
+        :returns: DiscoveredRepo, or None if path is not a repository
+        """
+        by_name = dict((e.name, e) for e in entries)
+        dotgit = by_name.get('.git')
+        if dotgit is not None:
+            if dotgit.is_dir():
+                return DiscoveredRepo(path, CLONE, os.path.realpath(dotgit.path))
+            gitdir = _read_gitfile(dotgit.path)
+            if gitdir is None:
+                return None
+            commondir_file = os.path.join(gitdir, 'commondir')
+            if os.path.isfile(commondir_file):
+                with open(commondir_file) as fh:
+                    common = os.path.join(gitdir, fh.read().strip())
+                return DiscoveredRepo(path, WORKTREE, os.path.realpath(common))
+            if '{s}modules{s}'.format(s=os.sep) in gitdir:
+                return DiscoveredRepo(path, SUBMODULE, os.path.realpath(gitdir))
+            # clone with a separate git dir
+            return DiscoveredRepo(path, CLONE, os.path.realpath(gitdir))
+        if BARE_MARKERS.issubset(by_name) and by_name['objects'].is_dir() and by_name['HEAD'].is_file():
+            return DiscoveredRepo(path, BARE, os.path.realpath(path))
+        return None
@@ -0,0 +1,242 @@
+"""
+Fetch profiles: named sets of fetch options - a partial clone filter, a
+depth limit, restricted refspecs - for remotes whose full history is too big
+to fetch on every sync. Profiles are defined and selected with git config,
+so they can be set globally (``~/.gitconfig``) or per clone::
+
+    [gitclonesync-profile "huge"]
+        filter = blob:none
+        depth = 50
+        refspec = +refs/heads/master:refs/remotes/{remote}/master
+        tags = true
+        match = git@github.com:big-org/*
+        match = */src/vendor/*
+
+    [gitclonesync]
+        profile = huge                  # every remote of this clone
+
+    [remote "origin"]
+        gitclonesyncProfile = huge      # just this remote
+
+A remote's profile is the one named by its ``remote.<name>.gitclonesyncProfile``,
+else by the clone's ``gitclonesync.profile``, else the first profile (by
+name) with a ``match`` glob matching the remote URL or the clone's path.
+"""
+
+import logging
+from fnmatch import fnmatch
+
+logger = logging.getLogger(__name__)
+
+# the profile definitions and selections, and each remote's partial clone settings
+PROFILE_CONFIG_KEYS = (r'gitclonesync\.profile|gitclonesync-profile\..*|'
+                       r'remote\..*\.(gitclonesyncprofile|promisor|partialclonefilter)')
+PROFILE_CONFIG_ARGS = ['config', '-z', '--get-regexp', '^({k})$'.format(k=PROFILE_CONFIG_KEYS)]
+
+REMOTE_SETTINGS = ('gitclonesyncprofile', 'promisor', 'partialclonefilter')
+
+PROFILE_SECTION = 'gitclonesync-profile'
+
+# first git version with multiple promisor remotes, needed to convert a remote of an existing clone
+PARTIAL_CLONE_GIT_VERSION = (2, 24)
+
+
+class FetchProfile:
+    """
+    Options for fetching one remote
+    """
+
+    def __init__(self, name, filter=None, depth=None, refspecs=None, tags=None, matches=None):
+        """
+        init
+
+        :param name: profile name
+        :type name: string
+        :param filter: partial clone filter spec, i.e. ``blob:none``; the remote is converted
+          to a promisor remote the first time it is fetched with it
+        :type filter: string
+        :param depth: fetch with ``--depth``, making the clone shallow
+        :type depth: int
+        :param refspecs: fetch only these refspecs; ``{remote}`` is replaced with the remote name
+        :type refspecs: list
+        :param tags: True to fetch all tags (``--tags``), False for none (``--no-tags``), None for git's default
+        :type tags: boolean
+        :param matches: fnmatch globs of remote URLs and clone paths to apply the profile to
+        :type matches: list
+        """
+        self.name = name
+        self.filter = filter
+        self.depth = depth
+        self.refspecs = list(refspecs or [])
+        self.tags = tags
+        self.matches = list(matches or [])
+
+    def __repr__(self):
+        return "<FetchProfile {n}>".format(n=self.name)
+
+    def fetch_args(self, remote):
+        """
+        arguments to add to ``git fetch`` - options, then the remote name and
+        refspecs - in place of the remote name alone
+
+        :param remote: remote name
+        :type remote: string
+        :rtype: list
+        """
+        args = []
+        if self.filter is not None:
+            args.append('--filter={f}'.format(f=self.filter))
+        if self.depth is not None:
+            args.append('--depth={d}'.format(d=self.depth))
+        if self.tags is True:
+            args.append('--tags')
+        elif self.tags is False:
+            args.append('--no-tags')
+        return args + [remote] + self.refspecs_for(remote)
+
+    def refspecs_for(self, remote):
+        """ this profile's refspecs for ``remote`` """
+        return [r.replace('{remote}', remote) for r in self.refspecs]
+
+    def conversion_args(self, remote, settings):
+        """
+        ``git config`` commands that make ``remote`` a promisor remote with
+        this profile's filter, converting the clone to a partial clone in
+        place. Objects already in the clone are kept; only later fetches are
+        filtered.
+
+        :param remote: remote name
+        :type remote: string
+        :param settings: the remote's current ``promisor`` and ``partialclonefilter`` settings, from
+          parse_profile_config()
+        :type settings: dict
+        :returns: list of git argument lists; empty if the remote is already converted
+        :rtype: list
+        """
+        if self.filter is None:
+            return []
+        cmds = []
+        if settings.get('promisor', '').lower() not in ('true', 'yes', 'on', '1'):
+            cmds.append(['config', 'remote.{r}.promisor'.format(r=remote), 'true'])
+        if settings.get('partialclonefilter') != self.filter:
+            cmds.append(['config', 'remote.{r}.partialclonefilter'.format(r=remote), self.filter])
+        return cmds
+
+
+def _bool(value):
+    return value.lower() in ('true', 'yes', 'on', '1')
+
+
+def parse_profile_config(output):
+    """
+    parse ``git config -z --get-regexp`` output of PROFILE_CONFIG_ARGS; other
+    settings in the output, such as remote URLs, are ignored
+
+    :param output: the command's stdout
+    :type output: string
+    :returns: see profile_config()
+    :rtype: tuple
+    """
+    return profile_config(entry.partition('\n')[::2] for entry in output.split('\0') if entry)
+
+
+def reader_config_items(reader):
+    """
+    the settings in a GitPython config reader - the one ``Repo.remotes``
+    reads the clone's remotes with - as ``git config --get-regexp`` style
+    (key, value) pairs for profile_config(), without running git. Readers
+    before GitPython 2.1 keep only the last value of a multi-valued key
+    (``refspec``, ``match``), so they can't be used.
+
+    :param reader: ``Repo.config_reader()``
+    :type reader: git.config.GitConfigParser
+    :returns: list of (key, value) tuples, or None if the reader doesn't return multi-valued keys
+    :rtype: list
+    """
+    if not hasattr(reader, 'items_all'):
+        return None
+    items = []
+    for section in reader.sections():
+        name, _, sub = section.partition(' ')
+        prefix = name.lower() + '.'
+        if sub:
+            prefix += sub.strip().strip('"') + '.'
+        for option, values in reader.items_all(section):
+            items.extend((prefix + option.lower(), value) for value in values)
+    return items
+
+
+def profile_config(items):
+    """
+    the fetch profiles a clone's config defines, and the selections it makes.
+    A ``depth`` that isn't a number is ignored, with a warning.
+
+    :param items: (key, value) pairs of config settings, lowercase but for subsection names
+    :type items: iterable
+    :returns: (dict of profile name to FetchProfile, the clone's ``gitclonesync.profile`` or None,
+      dict of remote name to that remote's config - ``gitclonesyncprofile``, ``promisor`` and
+      ``partialclonefilter``, where set)
+    :rtype: tuple
+    """
+    profiles = {}
+    repo_profile = None
+    remotes = {}
+    for key, value in items:
+        if key == 'gitclonesync.profile':
+            repo_profile = value
+            continue
+        section, _, rest = key.partition('.')
+        name, _, var = rest.rpartition('.')
+        if not name:
+            continue
+        if section == 'remote':
+            if var in REMOTE_SETTINGS:
+                remotes.setdefault(name, {})[var] = value
+            continue
+        if section != PROFILE_SECTION:
+            continue
+        profile = profiles.setdefault(name, FetchProfile(name))
+        if var == 'filter':
+            profile.filter = value
+        elif var == 'depth':
+            try:
+                profile.depth = int(value)
+            except ValueError:
+                logger.warning("Ignoring {k}: '{v}' is not a number".format(k=key, v=value))
+        elif var == 'refspec':
+            profile.refspecs.append(value)
+        elif var == 'tags':
+            profile.tags = _bool(value)
+        elif var == 'match':
+            profile.matches.append(value)
+    return profiles, repo_profile, remotes
+
+
+def select_profile(profiles, repo_profile, remotes, remote, url, path):
+    """
+    the profile to fetch a remote with
+
+    :param profiles: parse_profile_config() profiles
+    :type profiles: dict
+    :param repo_profile: parse_profile_config() clone-wide profile name
+    :type repo_profile: string
+    :param remotes: parse_profile_config() per-remote settings
+    :type remotes: dict
+    :param remote: remote name
+    :type remote: string
+    :param url: remote URL
+    :type url: string
+    :param path: path to the clone
+    :type path: string
+    :returns: FetchProfile, or None to fetch the remote normally
+    :raises: ValueError if the remote or clone names a profile that isn't defined
+    """
+    name = remotes.get(remote, {}).get('gitclonesyncprofile') or repo_profile
+    if name is not None:
+        if name not in profiles:
+            raise ValueError("fetch profile '{n}' is not defined".format(n=name))
+        return profiles[name]
+    for name in sorted(profiles):
+        if any(fnmatch(url, m) or fnmatch(path, m) for m in profiles[name].matches):
+            return profiles[name]
+    return None
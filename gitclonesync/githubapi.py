@@ -0,0 +1,369 @@
+"""
+Minimal GitHub API client: a pooled HTTP session, conditional REST requests
+backed by a persistent ETag / Last-Modified cache, batched GraphQL
+repository lookups, and backoff that respects the API rate limits
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_URL = 'https://api.github.com'
+DEFAULT_HTTP_CACHE = '~/.gitclonesync_github_cache.json'
+
+# repositories looked up per GraphQL request; each alias costs one point of the query's complexity
+DEFAULT_BATCH_SIZE = 50
+
+# never sleep longer than this (seconds) waiting for a rate limit to reset
+MAX_RATE_LIMIT_WAIT = 900
+
+# matches the owner/name of github.com SSH, HTTPS and git:// remote URLs
+_URL_RE = r'^(?:(?:https?|git|ssh)://(?:[^@/]+@)?{host}(?::\d+)?/|(?:[^@/]+@)?{host}:)([^/]+)/(.+?)(?:\.git)?/?$'
+
+_REPO_FIELDS = 'nameWithOwner isFork url sshUrl parent { nameWithOwner url sshUrl }'
+
+
+class GitHubAPIError(Exception):
+    """
+    Exception for GitHub API requests that failed after any retries
+    """
+    pass
+
+
+def parse_github_url(url, host='github.com'):
+    """
+    get the ``owner/name`` of a GitHub remote URL
+
+    :param url: remote URL, i.e. ``git@github.com:owner/name.git``
+    :type url: string
+    :param host: GitHub hostname
+    :type host: string
+    :returns: ``owner/name``, or None if url is not a GitHub repository
+    :rtype: string
+    """
+    m = re.match(_URL_RE.format(host=re.escape(host)), url.strip(), re.IGNORECASE)
+    if m is None or '/' in m.group(2):
+        return None
+    return '{o}/{n}'.format(o=m.group(1), n=m.group(2))
+
+
+class HTTPCache:
+    """
+    On-disk cache of GitHub REST responses and their validators, keyed by URL
+    """
+
+    def __init__(self, path):
+        """
+        init
+
+        :param path: path to the JSON cache file
+        :type path: string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data = self._load()
+
+    def _load(self):
+        """ read the cache file, returning an empty cache if missing or corrupt """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except (IOError, ValueError) as ex:
+            self.logger.warning("Ignoring unreadable GitHub cache {p}: {e}".format(p=self.path, e=ex))
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def get(self, url):
+        """ cached entry for ``url`` (dict with etag, last_modified and body), or None """
+        with self._lock:
+            return self._data.get(url)
+
+    def put(self, url, etag, last_modified, body):
+        """ store a response body and its validators """
+        if etag is None and last_modified is None:
+            return
+        with self._lock:
+            self._data[url] = {'etag': etag, 'last_modified': last_modified, 'body': body, 'saved': time.time()}
+            self._dirty = True
+
+    def save(self):
+        """ write the cache to disk, atomically, if it changed """
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = '{p}.{pid}.tmp'.format(p=self.path, pid=os.getpid())
+            with open(tmp, 'w') as fh:
+                json.dump(self._data, fh)
+            os.rename(tmp, self.path)
+            self._dirty = False
+
+
+class GitHubAPI:
+    """
+    GitHub REST and GraphQL client sharing one pooled, authenticated session
+    """
+
+    def __init__(self, token, base_url=DEFAULT_API_URL, graphql_url=None, cache_path=None,
+                 batch_size=DEFAULT_BATCH_SIZE, max_retries=5, pool_size=10):
+        """
+        init
+
+        :param token: GitHub API token
+        :type token: string
+        :param base_url: REST API root, i.e. ``https://github.example.com/api/v3`` for GitHub Enterprise
+        :type base_url: string
+        :param graphql_url: GraphQL endpoint; derived from base_url if None
+        :type graphql_url: string
+        :param cache_path: path to the ETag / Last-Modified cache; None to disable
+        :type cache_path: string
+        :param batch_size: repositories looked up per GraphQL request
+        :type batch_size: int
+        :param max_retries: attempts per request on rate limiting or server errors
+        :type max_retries: int
+        :param pool_size: maximum pooled connections
+        :type pool_size: int
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.base_url = base_url.rstrip('/')
+        if graphql_url is None:
+            if self.base_url.endswith('/api/v3'):
+                graphql_url = self.base_url[:-len('/v3')] + '/graphql'
+            else:
+                graphql_url = self.base_url + '/graphql'
+        self.graphql_url = graphql_url
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.cache = HTTPCache(cache_path) if cache_path is not None else None
+        # counters and rate limit state, updated by every thread sharing the client
+        self._lock = threading.Lock()
+        self.requests_made = 0
+        self.not_modified = 0
+        self.rate_remaining = None
+        self.rate_reset = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': 'token {t}'.format(t=token),
+            'Accept': 'application/vnd.github.v3+json',
+            'User-Agent': 'gitclonesync',
+        })
+
+    def _url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return self.base_url + '/' + path.lstrip('/')
+
+    def _rate_limit_wait(self, resp, attempt):
+        """
+        seconds to wait before retrying ``resp``, or None if it shouldn't be retried
+
+        :param resp: the response
+        :type resp: requests.Response
+        :param attempt: number of attempts made so far
+        :type attempt: int
+        """
+        if resp.status_code >= 500:
+            return 2 ** attempt
+        if resp.status_code not in (403, 429):
+            return None
+        if 'Retry-After' in resp.headers:
+            # secondary (abuse) rate limit
+            return int(resp.headers['Retry-After'])
+        if resp.headers.get('X-RateLimit-Remaining') == '0':
+            reset = int(resp.headers.get('X-RateLimit-Reset', 0))
+            return max(1, reset - int(time.time()))
+        return None
+
+    def _request(self, method, path, **kwargs):
+        """
+        make a request, retrying with backoff on rate limiting and server errors
+
+        :rtype: requests.Response
+        """
+        url = self._url(path)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.RequestException as ex:
+                if attempt >= self.max_retries:
+                    raise GitHubAPIError("{m} {u} failed: {e}".format(m=method, u=url, e=ex))
+                time.sleep(2 ** attempt)
+                continue
+            with self._lock:
+                self.requests_made += 1
+                if 'X-RateLimit-Remaining' in resp.headers:
+                    self.rate_remaining = int(resp.headers['X-RateLimit-Remaining'])
+                    self.rate_reset = int(resp.headers.get('X-RateLimit-Reset', 0))
+            wait = self._rate_limit_wait(resp, attempt)
+            if wait is None or attempt >= self.max_retries:
+                return resp
+            if wait > MAX_RATE_LIMIT_WAIT:
+                raise GitHubAPIError("{m} {u} is rate limited for {w}s; giving up".format(m=method, u=url, w=wait))
+            self.logger.warning("GitHub API returned {s} for {u}; retrying in {w}s".format(
+                s=resp.status_code, u=url, w=wait))
+            time.sleep(wait)
+
+    def get(self, path, params=None):
+        """
+        GET a REST resource, as a conditional request if it's cached; 304
+        responses are served from the cache and don't count against the rate limit
+
+        :param path: path relative to base_url, or a full URL
+        :type path: string
+        :param params: query parameters
+        :type params: dict
+        :returns: decoded JSON body
+        """
+        url = self._url(path)
+        if params:
+            url = requests.Request('GET', url, params=params).prepare().url
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        resp = self._request('GET', url, headers=headers)
+        if resp.status_code == 304 and cached is not None:
+            with self._lock:
+                self.not_modified += 1
+            return cached['body']
+        if resp.status_code != 200:
+            raise GitHubAPIError("GET {u} returned {s}: {b}".format(u=url, s=resp.status_code, b=resp.text[:200]))
+        body = resp.json()
+        if self.cache is not None:
+            self.cache.put(url, resp.headers.get('ETag'), resp.headers.get('Last-Modified'), body)
+        return body
+
+    def graphql(self, query, variables=None):
+        """
+        run a GraphQL query
+
+        :param query: the query
+        :type query: string
+        :param variables: query variables
+        :type variables: dict
+        :returns: (data, list of errors)
+        :rtype: tuple
+        """
+        payload = json.dumps({'query': query, 'variables': variables or {}})
+        for attempt in range(1, self.max_retries + 1):
+            resp = self._request('POST', self.graphql_url, data=payload)
+            if resp.status_code != 200:
+                raise GitHubAPIError("GraphQL query returned {s}: {b}".format(s=resp.status_code, b=resp.text[:200]))
+            body = resp.json()
+            errors = body.get('errors') or []
+            # GraphQL reports exhausting its rate limit in the body of a 200 response
+            if attempt == self.max_retries or not any(e.get('type') == 'RATE_LIMITED' for e in errors):
+                break
+            wait = max(1, (self.rate_reset or 0) - int(time.time()))
+            if wait > MAX_RATE_LIMIT_WAIT:
+                raise GitHubAPIError("GraphQL API is rate limited for {w}s; giving up".format(w=wait))
+            self.logger.warning("GitHub GraphQL API rate limit exhausted; retrying in {w}s".format(w=wait))
+            time.sleep(wait)
+        if body.get('data') is None:
+            raise GitHubAPIError("GraphQL query failed: {e}".format(
+                e='; '.join(e.get('message', '') for e in errors)))
+        return body['data'], errors
+
+    def get_repositories(self, full_names):
+        """
+        look up many repositories, ``batch_size`` per GraphQL request
+
+        :param full_names: ``owner/name`` strings
+        :type full_names: iterable
+        :returns: dict of lowercased ``owner/name`` to a dict with keys nameWithOwner,
+          isFork, url, sshUrl and parent (None, or a dict with nameWithOwner, url and sshUrl);
+          repositories that don't exist or aren't visible map to None
+        :rtype: dict
+        """
+        names = sorted(set(n.lower() for n in full_names))
+        result = {}
+        for i in range(0, len(names), self.batch_size):
+            batch = names[i:i + self.batch_size]
+            params = []
+            fields = []
+            variables = {}
+            for j, full_name in enumerate(batch):
+                owner, name = full_name.split('/', 1)
+                params.append('$o{j}: String!, $n{j}: String!'.format(j=j))
+                fields.append('r{j}: repository(owner: $o{j}, name: $n{j}) {{ {f} }}'.format(j=j, f=_REPO_FIELDS))
+                variables['o{j}'.format(j=j)] = owner
+                variables['n{j}'.format(j=j)] = name
+            query = 'query({p}) {{ {f} rateLimit {{ cost remaining resetAt }} }}'.format(
+                p=', '.join(params), f=' '.join(fields))
+            data, errors = self.graphql(query, variables)
+            for e in errors:
+                if e.get('type') != 'NOT_FOUND':
+                    self.logger.warning("GitHub GraphQL error: {m}".format(m=e.get('message')))
+            for j, full_name in enumerate(batch):
+                result[full_name] = data.get('r{j}'.format(j=j))
+            rl = data.get('rateLimit') or {}
+            if 'remaining' in rl:
+                self.logger.debug("GraphQL batch of {n} cost {c}; {r} points remaining".format(
+                    n=len(batch), c=rl.get('cost'), r=rl['remaining']))
+        return result
+
+    def get_repository(self, full_name):
+        """
+        look up one repository with a (cacheable) REST request
+
+        :param full_name: ``owner/name``
+        :type full_name: string
+        :rtype: dict
+        """
+        return self.get('repos/{n}'.format(n=full_name))
+
+    def get_pulls(self, full_name, since=None, per_page=100):
+        """
+        list a repository's pull requests - every open one, or (with ``since``)
+        every one, open or closed, updated at or after ``since``. Each page is a
+        conditional request, so an unchanged repository costs no rate limit.
+
+        :param full_name: ``owner/name``
+        :type full_name: string
+        :param since: ISO 8601 timestamp, i.e. ``2015-01-02T03:04:05Z``
+        :type since: string
+        :param per_page: pull requests per page
+        :type per_page: int
+        :returns: list of pull request dicts, most recently updated first when ``since`` is given
+        :rtype: list
+        """
+        if since is None:
+            params = {'state': 'open', 'per_page': per_page}
+        else:
+            params = {'state': 'all', 'sort': 'updated', 'direction': 'desc', 'per_page': per_page}
+        pulls = []
+        page = 1
+        while True:
+            params['page'] = page
+            batch = self.get('repos/{n}/pulls'.format(n=full_name), params=params)
+            for pr in batch:
+                if since is not None and pr['updated_at'] < since:
+                    return pulls
+                pulls.append(pr)
+            if len(batch) < per_page:
+                return pulls
+            page += 1
+
+    def save(self):
+        """ persist the HTTP cache """
+        if self.cache is not None:
+            self.cache.save()
@@ -3,6 +3,16 @@ Class for dealing with GitHub API,
 w/r/t clones
 """
 
+import logging
+import subprocess
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+from gitclonesync.githubapi import GitHubAPI, DEFAULT_API_URL, DEFAULT_HTTP_CACHE, parse_github_url
+
 
 class GitHubKeyError(Exception):
     """
@@ -11,31 +21,99 @@ class GitHubKeyError(Exception):
     pass
 
 
+def get_token(cwd=None):
+    """
+    read the GitHub API token from ``git config github.token``
+
+    :param cwd: directory to run git config in, so that repository config applies
+    :type cwd: string
+    :rtype: string
+    """
+    try:
+        token = subprocess.check_output(['git', 'config', '--get', 'github.token'], cwd=cwd)
+    except (subprocess.CalledProcessError, OSError):
+        token = b''
+    token = token.decode('utf-8').strip()
+    if not token:
+        raise GitHubKeyError("No GitHub API token found; set one with "
+                             "'git config --global github.token <token>'")
+    return token
+
+
+def parent_url(parent, origin_url):
+    """
+    URL to add the parent of a fork as a remote with, using the same
+    transport (SSH or HTTPS) as the fork's origin remote
+
+    :param parent: ``parent`` of a repository returned by GitHubAPI.get_repositories
+    :type parent: dict
+    :param origin_url: URL of the fork's origin remote
+    :type origin_url: string
+    :rtype: string
+    """
+    if origin_url.startswith('https://') or origin_url.startswith('http://'):
+        return parent['url'] + '.git'
+    return parent['sshUrl']
+
+
 class GitHubClone:
     """
     Class for dealing with GitHub clones
     """
 
-    def __init__(self):
-        # try to get credentials, raise exception with helpful message if we can't
-        pass
+    def __init__(self, api_url=DEFAULT_API_URL, cache_path=DEFAULT_HTTP_CACHE):
+        """
+        init - raises GitHubKeyError if no API token is configured
+
+        :param api_url: GitHub REST API root (for GitHub Enterprise, ``https://<host>/api/v3``)
+        :type api_url: string
+        :param cache_path: path to the persistent ETag / Last-Modified cache; None to disable
+        :type cache_path: string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.host = 'github.com' if api_url == DEFAULT_API_URL else urlparse(api_url).hostname
+        self.client = self.get_github_client(api_url, cache_path)
+
+    def find_upstreams(self, origins):
+        """
+        find the parent repository of every clone whose origin is a GitHub
+        fork, looking them all up in as few (batched) API requests as possible
 
-    def do_github_repo(self, repo, config, gh_client, dryrun=False):
+        :param origins: dict of clone path to the URL of its origin remote
+        :type origins: dict
+        :returns: dict of clone path to the URL of origin's parent, for clones whose origin is a fork
+        :rtype: dict
         """
-        operate on a single git directory/clone of a GitHub repo
-        :param repo: a GitPython Repository object, passed in from do_git_dir
-        :type path: Repository
-        :param config: config dict
-        :type config: dict
-        :param gh_client: TODO
-        :param dryrun: if true, do not change anything; log actions that would be taken
-        :type dryrun: boolean
+        names = {}
+        for path, url in origins.items():
+            full_name = parse_github_url(url, host=self.host)
+            if full_name is None:
+                self.logger.debug("origin of {p} is not on {h}".format(p=path, h=self.host))
+                continue
+            names[path] = full_name
+        if not names:
+            return {}
+        repos = self.client.get_repositories(names.values())
+        self.logger.debug("Looked up {n} GitHub repositories in {r} request(s)".format(
+            n=len(repos), r=self.client.requests_made))
+        upstreams = {}
+        for path, full_name in names.items():
+            info = repos.get(full_name.lower())
+            if info is None:
+                self.logger.warning("GitHub repository {n} (origin of {p}) not found".format(n=full_name, p=path))
+                continue
+            if info.get('isFork') and info.get('parent'):
+                upstreams[path] = parent_url(info['parent'], origins[path])
+        return upstreams
+
+    def get_github_client(self, api_url=DEFAULT_API_URL, cache_path=DEFAULT_HTTP_CACHE):
+        """
+        read the API token from git config and return a GitHubAPI client
+
+        :param api_url: GitHub REST API root
+        :type api_url: string
+        :param cache_path: path to the persistent ETag / Last-Modified cache; None to disable
+        :type cache_path: string
+        :rtype: gitclonesync.githubapi.GitHubAPI
         """
-        raise SystemExit("Do GitHub stuff here")
-
-    def get_github_client(self, config, dryrun=False):
-        """ read API key from git config and return a <TODO> github client instance """
-        # `git config --global github.token` and trim that, make sure it's 40 characters
-        # try to instantiate API client, and connect
-        # return client object
-        return None
+        return GitHubAPI(get_token(), base_url=api_url, cache_path=cache_path)
@@ -0,0 +1,163 @@
+"""
+Small helpers for working with git output, shared by the sync engines
+"""
+
+import re
+
+# first git version with ``fetch --no-write-fetch-head``, needed to fetch
+# several remotes of one clone at the same time
+CONCURRENT_FETCH_GIT_VERSION = (2, 29)
+
+# lists the URL and fetch refspecs of every remote of a clone
+REMOTE_CONFIG_ARGS = ['config', '-z', '--get-regexp', r'^remote\..*\.(url|fetch)$']
+
+
+def parse_git_version(output):
+    """
+    parse ``git version`` output into a tuple of ints
+
+    :param output: i.e. ``git version 2.39.5`` or ``git version 2.39.5.windows.1``
+    :type output: string
+    :rtype: tuple
+    """
+    version = []
+    for part in output.strip().split()[-1].split('.'):
+        if not part.isdigit():
+            break
+        version.append(int(part))
+    return tuple(version)
+
+
+def is_ref_lock_error(stderr):
+    """
+    return True if a failed git command's stderr shows it lost a ref lock to another process
+
+    :param stderr: stderr of the failed command
+    :type stderr: string
+    """
+    stderr = stderr or ''
+    return 'cannot lock ref' in stderr or ('Unable to create' in stderr and '.lock' in stderr)
+
+
+def ls_remote_patterns(refspecs):
+    """
+    return the ``git ls-remote`` patterns covering a remote's fetch refspecs, plus tags
+
+    :param refspecs: values of ``remote.<name>.fetch``
+    :type refspecs: list
+    :rtype: list
+    """
+    patterns = [r.strip().lstrip('+').split(':', 1)[0] for r in refspecs if r.strip()]
+    patterns.append('refs/tags/*')
+    return patterns
+
+
+_PROGRESS_RE = re.compile(r'(?:Receiving|Unpacking) objects:\s+100% \((\d+)/\d+\)(?:, ([\d.]+) (bytes|KiB|MiB|GiB))?')
+
+# sent by the remote for every pack; the only count shown when progress is too quick to display
+_TOTAL_RE = re.compile(r'^remote: Total (\d+)')
+
+_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+
+def parse_fetch_progress(stderr):
+    """
+    get the number of objects and bytes a fetch received from its ``--progress`` output
+
+    :param stderr: stderr of ``git fetch --progress``
+    :type stderr: string
+    :returns: (objects, bytes); (0, 0) if nothing was transferred
+    :rtype: tuple
+    """
+    objects = nbytes = 0
+    for line in re.split(r'[\r\n]', stderr or ''):
+        m = _TOTAL_RE.search(line)
+        if m is not None and not objects:
+            objects = int(m.group(1))
+        m = _PROGRESS_RE.search(line)
+        if m is None:
+            continue
+        objects = int(m.group(1))
+        if m.group(2):
+            nbytes = int(float(m.group(2)) * _UNITS[m.group(3)])
+    return objects, nbytes
+
+
+def parse_remote_config(output):
+    """
+    parse the output of ``git`` + REMOTE_CONFIG_ARGS, or of a wider
+    ``git config -z --get-regexp`` whose other settings are ignored
+
+    :returns: (dict of remote name to URL, dict of remote name to list of fetch refspecs)
+    :rtype: tuple
+    """
+    urls = {}
+    refspecs = {}
+    for item in output.split('\0'):
+        if not item:
+            continue
+        key, _, value = item.partition('\n')
+        if not key.startswith('remote.'):
+            continue
+        name, _, var = key[len('remote.'):].rpartition('.')
+        if var == 'url':
+            urls[name] = value
+        elif var == 'fetch':
+            refspecs.setdefault(name, []).append(value)
+    return urls, refspecs
+
+
+# GitPython features this relies on first appeared in this version: Git.execute()'s
+# kill_after_timeout (1.0.2), with Git.version_info and the FETCH_INFO fix of 0.3.2.1
+GITPYTHON_MIN_VERSION = (1, 0, 2)
+
+_gitpython = None
+
+
+def distribution_version(name):
+    """
+    return the installed version of a distribution, read from its metadata
+    with ``importlib.metadata`` (or its ``importlib_metadata`` backport);
+    ``pkg_resources``, which scans every installed distribution, is only a
+    last resort
+
+    :param name: distribution name, i.e. ``GitPython``
+    :type name: string
+    :returns: version string, or None if not installed
+    :rtype: string
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        try:
+            from importlib_metadata import version, PackageNotFoundError
+        except ImportError:
+            version = None
+    if version is not None:
+        try:
+            return version(name)
+        except PackageNotFoundError:
+            return None
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution(name).version
+    except pkg_resources.DistributionNotFound:
+        return None
+
+
+def gitpython():
+    """
+    import GitPython on first use, rather than when gitclonesync is imported,
+    checking once per process that it is new enough
+
+    :returns: the ``git`` module
+    """
+    global _gitpython
+    if _gitpython is None:
+        found = distribution_version('GitPython')
+        if found is not None and parse_git_version(found) < GITPYTHON_MIN_VERSION:
+            raise SystemExit("ERROR: gitclonesync requires GitPython>={v}, found {f}".format(
+                v='.'.join(str(x) for x in GITPYTHON_MIN_VERSION), f=found))
+        import git
+        _gitpython = git
+    return _gitpython
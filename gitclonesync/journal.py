@@ -0,0 +1,158 @@
+"""
+Append-only journal of per-clone sync outcomes, so that a run that was
+killed partway through can be resumed, and the clones that failed last time
+retried on their own
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from gitclonesync.scheduler import SyncResult
+
+DEFAULT_JOURNAL = '~/.gitclonesync_journal.jsonl'
+
+# with resume, skip clones synced (or skipped) less than this many seconds ago
+DEFAULT_RESUME_WINDOW = 6 * 3600
+
+# rewrite the journal with only each clone's latest entry once it has this
+# many times as many lines as clones
+COMPACT_FACTOR = 4
+
+
+class RunJournal:
+    """
+    JSON-lines file with one entry appended as each clone finishes:
+    ``{"path": path, "status": status, "time": time, "elapsed": seconds, "phase": last phase or null,
+    "error": error or null, "run": run start time}``
+
+    Entries are flushed as they are written, so a run that is killed leaves
+    behind the outcome of every clone it finished. Only a clone's latest
+    entry matters; the file is compacted when it is opened.
+
+    A read-only journal, as used by dry runs, can select clones to resume or
+    retry, but never writes the file: a dry run syncs nothing, so recording
+    it would make later runs skip clones that were never synced.
+    """
+
+    def __init__(self, path, resume_window=DEFAULT_RESUME_WINDOW, readonly=False):
+        """
+        init
+
+        :param path: path to the journal file
+        :type path: string
+        :param resume_window: with resume, skip clones whose latest entry is a success this recent, in seconds
+        :type resume_window: int
+        :param readonly: if True, neither record outcomes nor compact the file
+        :type readonly: boolean
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.expanduser(path)
+        self.resume_window = resume_window
+        self.readonly = readonly
+        self.run_start = time.time()
+        self._lock = threading.Lock()
+        self._fh = None
+        self._latest = self._load()
+
+    def _load(self):
+        """ read the journal, keeping each clone's latest entry; unparseable lines are ignored """
+        latest = {}
+        if not os.path.exists(self.path):
+            return latest
+        lines = 0
+        with open(self.path) as fh:
+            for line in fh:
+                lines += 1
+                try:
+                    e = json.loads(line)
+                    latest[e['path']] = e
+                except (ValueError, KeyError, TypeError):
+                    continue
+        if not self.readonly and lines > COMPACT_FACTOR * max(1, len(latest)):
+            self._compact(latest)
+        return latest
+
+    def _compact(self, latest):
+        """ rewrite the journal with one entry per clone """
+        tmp = '{p}.{pid}.tmp'.format(p=self.path, pid=os.getpid())
+        with open(tmp, 'w') as fh:
+            for key in sorted(latest):
+                fh.write(json.dumps(latest[key], sort_keys=True) + '\n')
+        os.rename(tmp, self.path)
+        self.logger.debug("compacted journal {p} to {n} entries".format(p=self.path, n=len(latest)))
+
+    def latest(self, path):
+        """
+        the latest entry for a clone
+
+        :param path: path to the clone
+        :type path: string
+        :returns: entry dict, or None
+        """
+        return self._latest.get(path)
+
+    def finished_recently(self, path, now=None):
+        """
+        return True if the clone's latest entry is a success (synced or
+        skipped) within resume_window of ``now``
+
+        :param path: path to the clone
+        :type path: string
+        :rtype: boolean
+        """
+        e = self._latest.get(path)
+        if e is None or e.get('status') == SyncResult.FAILED:
+            return False
+        return (now or time.time()) - e.get('time', 0) < self.resume_window
+
+    def failed(self, path):
+        """
+        return True if the clone failed the last time it was synced
+
+        :param path: path to the clone
+        :type path: string
+        :rtype: boolean
+        """
+        e = self._latest.get(path)
+        return e is not None and e.get('status') == SyncResult.FAILED
+
+    def record(self, result):
+        """
+        append a finished clone's outcome to the journal
+
+        :param result: the clone's result
+        :type result: gitclonesync.scheduler.SyncResult
+        """
+        if self.readonly:
+            return
+        phase = None
+        if result.timer is not None and result.timer.phases:
+            phase = result.timer.phases[-1]['phase']
+        e = {
+            'path': result.path,
+            'status': result.status,
+            'time': time.time(),
+            'elapsed': result.elapsed,
+            'phase': phase,
+            'error': result.error,
+            'run': self.run_start,
+        }
+        with self._lock:
+            if self._fh is None:
+                d = os.path.dirname(self.path)
+                if d and not os.path.isdir(d):
+                    os.makedirs(d)
+                self._fh = open(self.path, 'a')
+            self._fh.write(json.dumps(e, sort_keys=True) + '\n')
+            self._fh.flush()
+            self._latest[result.path] = e
+
+    def close(self):
+        """ close the journal file, if open """
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
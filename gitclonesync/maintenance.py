@@ -0,0 +1,180 @@
+"""
+Post-sync object store maintenance: fetches leave loose objects and small
+packs behind, which slow down later fetches and status checks. A clone is
+only maintained once ``git count-objects`` shows it has crossed a pack-count
+or loose-object threshold; then its packs are rolled up geometrically, and
+its multi-pack-index and commit-graph are rewritten.
+
+A geometric repack can leave more than ``max_packs`` packs behind, so packs
+the multi-pack-index written by the last maintenance already covers don't
+count towards the threshold - only the packs fetched since then do.
+"""
+
+import os
+import struct
+
+# first git version with ``repack --geometric``
+MAINTENANCE_GIT_VERSION = (2, 32)
+
+# maintain a clone with more than this many packs, or loose objects
+DEFAULT_MAX_PACKS = 10
+DEFAULT_MAX_LOOSE = 1000
+
+COUNT_OBJECTS_ARGS = ['count-objects', '-v']
+
+MIDX_SIGNATURE = b'MIDX'
+MIDX_PACK_NAMES = b'PNAM'
+
+
+def parse_count_objects(output):
+    """
+    parse ``git count-objects -v`` output
+
+    :param output: the command's stdout
+    :type output: string
+    :returns: dict of field name (``count``, ``packs``, ``prune-packable``, etc.) to int
+    :rtype: dict
+    """
+    counts = {}
+    for line in output.splitlines():
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        try:
+            counts[key.strip()] = int(value.strip())
+        except ValueError:
+            continue
+    return counts
+
+
+def midx_pack_names(git_dir):
+    """
+    the packs a clone's multi-pack-index covers, read from the file's header
+    and pack-name chunk rather than by running git
+
+    :param git_dir: the clone's git directory
+    :type git_dir: string
+    :returns: set of pack index file names (``pack-<hash>.idx``); empty if there
+      is no multi-pack-index or it can't be read
+    :rtype: set
+    """
+    path = os.path.join(_objects_dir(git_dir), 'pack', 'multi-pack-index')
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+    except (IOError, OSError):
+        return set()
+    if len(data) < 12 or data[:4] != MIDX_SIGNATURE:
+        return set()
+    chunks = struct.unpack('>B', data[6:7])[0]
+    packs = struct.unpack('>I', data[8:12])[0]
+    # chunk table of (id, offset) rows, terminated by a row with a zero id
+    for i in range(chunks):
+        row = 12 + i * 12
+        chunk_id, offset = struct.unpack('>4sQ', data[row:row + 12])
+        if chunk_id == MIDX_PACK_NAMES:
+            names = data[offset:].split(b'\0', packs)[:packs]
+            return set(n.decode('utf-8', 'replace') for n in names)
+    return set()
+
+
+def count_packs(counts, git_dir):
+    """
+    add how many of a clone's packs its multi-pack-index covers to its
+    parse_count_objects() output, as ``midx-packs``
+
+    :param counts: parse_count_objects() output
+    :type counts: dict
+    :param git_dir: the clone's git directory
+    :type git_dir: string
+    :returns: counts
+    :rtype: dict
+    """
+    covered = midx_pack_names(git_dir)
+    if covered:
+        try:
+            idx = set(n for n in os.listdir(os.path.join(_objects_dir(git_dir), 'pack')) if n.endswith('.idx'))
+        except OSError:
+            idx = set()
+        counts['midx-packs'] = len(covered & idx)
+    return counts
+
+
+def _objects_dir(git_dir):
+    """ a git directory's object store; linked worktrees share their main clone's """
+    try:
+        with open(os.path.join(git_dir, 'commondir')) as fh:
+            git_dir = os.path.join(git_dir, fh.read().strip())
+    except (IOError, OSError):
+        pass
+    return os.path.join(git_dir, 'objects')
+
+
+def maintenance_reason(counts, max_packs=DEFAULT_MAX_PACKS, max_loose=DEFAULT_MAX_LOOSE):
+    """
+    why a clone needs maintenance, if it does
+
+    :param counts: parse_count_objects() output, passed through count_packs()
+      to leave out the packs the last maintenance's multi-pack-index covers
+    :type counts: dict
+    :param max_packs: threshold for packs not in the multi-pack-index
+    :type max_packs: int
+    :param max_loose: loose object threshold
+    :type max_loose: int
+    :returns: a description of the threshold(s) exceeded, or None
+    :rtype: string
+    """
+    reasons = []
+    covered = counts.get('midx-packs', 0)
+    packs = counts.get('packs', 0) - covered
+    if packs > max_packs:
+        if covered:
+            reasons.append('{n} packs not in the multi-pack-index'.format(n=packs))
+        else:
+            reasons.append('{n} packs'.format(n=packs))
+    if counts.get('count', 0) > max_loose:
+        reasons.append('{n} loose objects'.format(n=counts['count']))
+    return ', '.join(reasons) or None
+
+
+def maintenance_steps(counts, max_packs=DEFAULT_MAX_PACKS, max_loose=DEFAULT_MAX_LOOSE):
+    """
+    the git commands to maintain a clone, as (timer phase name, git arguments)
+    tuples to be run in order. A clone over a threshold is repacked
+    incrementally - ``--geometric`` only merges the smallest packs, plus the
+    loose objects, and ``-d`` then deletes the merged packs and the loose
+    objects now packed - and its multi-pack-index and commit-graph (as a new
+    split layer) are written. A clone under the thresholds only has loose
+    objects that are already packed removed, which is cheap.
+
+    :param counts: parse_count_objects() output
+    :type counts: dict
+    :rtype: list
+    """
+    if maintenance_reason(counts, max_packs=max_packs, max_loose=max_loose) is not None:
+        return [
+            ('repack', ['repack', '-d', '-l', '-q', '--geometric=2']),
+            ('multi-pack-index', ['multi-pack-index', 'write', '--no-progress']),
+            ('commit-graph', ['commit-graph', 'write', '--reachable', '--split', '--no-progress']),
+        ]
+    if counts.get('prune-packable', 0) > 0:
+        return [('prune-packed', ['prune-packed', '-q'])]
+    return []
+
+
+def maintenance_summary(before, after):
+    """
+    what maintenance changed, for the clone's RepoTimer and the log
+
+    :param before: parse_count_objects() output from before maintenance
+    :type before: dict
+    :param after: parse_count_objects() output from after it
+    :type after: dict
+    :rtype: dict
+    """
+    return {
+        'packs_before': before.get('packs', 0),
+        'packs_after': after.get('packs', 0),
+        'loose_before': before.get('count', 0),
+        'loose_after': after.get('count', 0),
+    }
@@ -0,0 +1,304 @@
+"""
+Process-pool runner: shards clones across forked worker processes, so that
+the CPU-bound parts of syncing (GitPython object parsing, status diffing)
+aren't serialized by the GIL. Workers send back one compact result record
+per clone; a worker that crashes or exceeds the per-clone timeout is killed
+(along with its git children) and replaced.
+"""
+
+import errno
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import time
+
+from gitclonesync.scheduler import SharedHostLimiter, SyncResult, log_summary
+from gitclonesync.timing import RepoTimer
+
+# how often (seconds) the parent checks for dead and timed-out workers while waiting for results
+POLL_INTERVAL = 0.5
+
+
+class _WarningHandler(logging.Handler):
+    """
+    logging handler that keeps (logger name, level, message) of the warnings
+    and errors for the worker's current clone, in place of the handlers
+    inherited from the parent; everything below WARNING is dropped
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self, level=logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.name, record.levelno, record.getMessage()))
+
+
+def sync_record(syncer, path, handler):
+    """
+    sync one clone in a worker process
+
+    :returns: compact, picklable result record
+    :rtype: dict
+    """
+    start = time.time()
+    timer = RepoTimer(path)
+    handler.records = []
+    error = None
+    try:
+        synced = syncer._do_git_dir(path, timer=timer)
+        status = SyncResult.SYNCED if synced else SyncResult.SKIPPED
+    except Exception as ex:
+        syncer.logger.error("Error syncing {p}: {e}".format(p=path, e=ex))
+        status = SyncResult.FAILED
+        error = str(ex)
+    record = {
+        'path': path,
+        'status': status,
+        'elapsed': time.time() - start,
+        'error': error,
+        'timer': timer.as_dict(),
+        'warnings': handler.records,
+    }
+    if syncer.ref_cache is not None:
+        record['ref_cache'] = syncer.ref_cache.pop_changes()
+        record['avoided'] = syncer.ref_cache.avoided
+        syncer.ref_cache.avoided = 0
+    return record
+
+
+def _worker_main(syncer, conn, held):
+    """
+    worker process body: sync the clones received on ``conn``, as (path, pull
+    request plan or None) pairs, until a None sentinel
+    """
+    # own process group, so a timed-out worker can be killed together with its git children
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root = logging.getLogger()
+    handler = _WarningHandler()
+    root.handlers = [handler]
+    root.setLevel(logging.WARNING)
+    if held is not None:
+        syncer.host_limiter.held = held
+    if syncer.ref_cache is not None:
+        syncer.ref_cache.pop_changes()
+        syncer.ref_cache.avoided = 0
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        path, plan = msg
+        # planned by the parent's pre-pass after this worker was forked
+        syncer.pr_plans.pop(path, None)
+        if plan is not None:
+            syncer.pr_plans[path] = plan
+        conn.send(sync_record(syncer, path, handler))
+
+
+class _Worker:
+    """
+    A worker process and the clone it is syncing
+    """
+
+    def __init__(self, syncer, index):
+        self.index = index
+        self.held = None
+        if isinstance(syncer.host_limiter, SharedHostLimiter):
+            self.held = syncer.host_limiter.holdings()
+        self.conn, child = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(target=_worker_main, args=(syncer, child, self.held),
+                                            name='sync-process-{i}'.format(i=index))
+        self.proc.daemon = True
+        self.proc.start()
+        child.close()
+        self.path = None
+        self.started = None
+
+    def assign(self, path, plan=None):
+        self.path = path
+        self.started = time.time()
+        self.conn.send((path, plan))
+
+    def kill(self):
+        """ kill the worker and everything in its process group; the caller reclaims its host slots """
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                raise
+        self.proc.join()
+        self.conn.close()
+
+
+class ProcessPoolRunner:
+    """
+    Runs CloneSyncer._do_git_dir over many clones in a pool of worker processes
+    """
+
+    def __init__(self, syncer, processes=2, timeout=None):
+        """
+        init
+
+        :param syncer: the CloneSyncer; each worker gets a forked copy
+        :type syncer: CloneSyncer
+        :param processes: number of worker processes
+        :type processes: int
+        :param timeout: kill a worker that spends longer than this many seconds on one clone; None for no limit
+        :type timeout: int
+        """
+        self.syncer = syncer
+        self.processes = max(1, processes)
+        self.timeout = timeout
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.results = []
+        self.elapsed = 0.0
+        self.respawned = 0
+        self._spawned = 0
+
+    def _spawn(self):
+        worker = _Worker(self.syncer, self._spawned)
+        self._spawned += 1
+        return worker
+
+    def run(self, paths):
+        """
+        sync every clone in ``paths``
+
+        :param paths: iterable of paths to git clones
+        :type paths: iterable
+        :returns: list of SyncResult
+        :rtype: list
+        """
+        start = time.time()
+        paths = iter(paths)
+        # one per-host cap across all workers, rather than one per worker
+        limiter = self.syncer.host_limiter
+        if limiter.max_per_host and not isinstance(limiter, SharedHostLimiter):
+            self.syncer.host_limiter = SharedHostLimiter(limiter.max_per_host)
+        workers = [self._spawn() for _ in range(self.processes)]
+        idle = list(workers)
+        busy = []
+        exhausted = False
+        try:
+            while True:
+                while idle and not exhausted:
+                    try:
+                        path = next(paths)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    worker = idle.pop()
+                    worker.assign(path, self.syncer.pr_plans.get(path))
+                    busy.append(worker)
+                if not busy:
+                    break
+                for worker in self._wait(busy):
+                    busy.remove(worker)
+                    if worker.path is None:
+                        idle.append(worker)
+                        continue
+                    # crashed or timed out: record the failure and replace the worker
+                    replacement = self._spawn()
+                    self.respawned += 1
+                    workers[workers.index(worker)] = replacement
+                    idle.append(replacement)
+        finally:
+            for worker in workers:
+                if worker.proc.is_alive():
+                    try:
+                        worker.conn.send(None)
+                    except (IOError, OSError):
+                        pass
+            for worker in workers:
+                worker.proc.join(5)
+                if worker.proc.is_alive():
+                    worker.kill()
+            self.syncer.host_limiter = limiter
+        self.elapsed = time.time() - start
+        return self.results
+
+    def _wait(self, busy):
+        """
+        wait for at least one busy worker to finish, crash or time out
+
+        :returns: the workers that are no longer busy; a crashed or killed worker keeps its ``path``
+        :rtype: list
+        """
+        while True:
+            done = []
+            timeout = POLL_INTERVAL
+            if self.timeout is not None:
+                timeout = min(timeout, max(0, min(w.started + self.timeout for w in busy) - time.time()))
+            try:
+                readable, _, _ = select.select([w.conn for w in busy], [], [], timeout)
+            except select.error as ex:
+                if ex.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            for worker in busy:
+                if worker.conn in readable:
+                    try:
+                        record = worker.conn.recv()
+                    except (EOFError, IOError):
+                        self._crashed(worker)
+                        done.append(worker)
+                        continue
+                    self._record(record)
+                    worker.path = None
+                    done.append(worker)
+                elif not worker.proc.is_alive():
+                    self._crashed(worker)
+                    done.append(worker)
+                elif self.timeout is not None and time.time() - worker.started > self.timeout:
+                    worker.kill()
+                    self._reclaim(worker)
+                    self._lost(worker, "timed out after {t}s".format(t=self.timeout))
+                    done.append(worker)
+            if done:
+                return done
+
+    def _crashed(self, worker):
+        """ record the clone of a worker that died, and kill anything it left running """
+        worker.proc.join(1)
+        code = worker.proc.exitcode
+        worker.kill()
+        self._reclaim(worker)
+        self._lost(worker, "worker process exited with code {c}".format(c=code))
+
+    def _reclaim(self, worker):
+        """ give back the per-host slots a killed or crashed worker held """
+        if worker.held is not None:
+            self.syncer.host_limiter.reclaim(worker.held)
+
+    def _lost(self, worker, error):
+        """ record a clone whose worker crashed or was killed """
+        self.syncer.logger.error("Error syncing {p}: {e}".format(p=worker.path, e=error))
+        self._add(SyncResult(worker.path, SyncResult.FAILED, time.time() - worker.started, error=error,
+                             timer=RepoTimer(worker.path)))
+
+    def _record(self, record):
+        """ turn a worker's result record into a SyncResult, re-emitting its warnings and errors """
+        for name, level, msg in record['warnings']:
+            logging.getLogger(name).log(level, msg)
+        if self.syncer.ref_cache is not None and 'ref_cache' in record:
+            self.syncer.ref_cache.apply_changes(record['ref_cache'], avoided=record['avoided'])
+        self._add(SyncResult(record['path'], record['status'], record['elapsed'],
+                             error=record['error'], timer=RepoTimer.from_dict(record['timer'])))
+
+    def _add(self, result):
+        """ add a SyncResult to self.results, and to the syncer's run journal """
+        self.results.append(result)
+        if self.syncer.journal is not None:
+            self.syncer.journal.record(result)
+
+    def log_summary(self):
+        """ log a summary of all results, after run() has completed """
+        if self.respawned:
+            self.logger.warning("Replaced {n} crashed or timed-out worker process(es)".format(n=self.respawned))
+        log_summary(self.logger, self.results, self.elapsed)
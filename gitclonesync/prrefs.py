@@ -0,0 +1,175 @@
+"""
+Incremental fetching of GitHub pull request heads: the API says which pull
+requests were opened, updated or closed since the last run, and only those
+are fetched (or pruned) with explicit refspecs, rather than fetching every
+``refs/pull/*`` ref of the repository
+"""
+
+import json
+import logging
+import os
+import time
+
+# per-clone state file, kept in the clone's git directory
+PR_STATE_FILE = 'gitclonesync-prs.json'
+
+# re-list pull requests updated this many seconds before the last run started, to allow for clock skew
+SINCE_OVERLAP = 300
+
+# GitHub's timestamp format; compares correctly as a string
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def pr_branch(remote, number):
+    """
+    remote-tracking branch (as given to ``git branch -r``) that pull request
+    ``number`` is fetched to; it lives outside ``refs/remotes/<remote>/`` so
+    that fetching the remote with ``--prune`` doesn't delete it
+    """
+    return '{r}-pr/{n}'.format(r=remote, n=number)
+
+
+def pr_fetch_args(remote, numbers):
+    """
+    arguments for a ``git fetch`` of the heads of the given pull requests
+
+    :rtype: list
+    """
+    return (['fetch', '--no-tags', remote] +
+            ['+refs/pull/{n}/head:refs/remotes/{b}'.format(n=n, b=pr_branch(remote, n)) for n in numbers])
+
+
+def pr_delete_args(remote, numbers):
+    """
+    arguments for deleting the refs of the given (closed) pull requests
+
+    :rtype: list
+    """
+    return ['branch', '--quiet', '-D', '-r'] + [pr_branch(remote, n) for n in numbers]
+
+
+class PRState:
+    """
+    The pull requests fetched into one clone, and when each remote's were last listed
+    """
+
+    def __init__(self, git_dir):
+        """
+        init
+
+        :param git_dir: the clone's git directory
+        :type git_dir: string
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.join(git_dir, PR_STATE_FILE)
+        self.remotes = self._load()
+
+    def _load(self):
+        """ read the state file, returning empty state if missing or corrupt """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except (IOError, ValueError) as ex:
+            self.logger.warning("Ignoring unreadable pull request state {p}: {e}".format(p=self.path, e=ex))
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def __getstate__(self):
+        # picklable, to be sent to a ProcessPoolRunner worker; loggers aren't on python 2
+        state = dict(self.__dict__)
+        del state['logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get(self, remote):
+        """ state of one remote (dict with repo, since and prs), or None """
+        return self.remotes.get(remote)
+
+    def update(self, plan):
+        """ record that ``plan`` has been applied """
+        self.remotes[plan.remote] = {'repo': plan.full_name, 'since': plan.since, 'prs': sorted(plan.open)}
+
+    def save(self):
+        """ write the state file, atomically """
+        tmp = '{p}.{pid}.tmp'.format(p=self.path, pid=os.getpid())
+        with open(tmp, 'w') as fh:
+            json.dump(self.remotes, fh, sort_keys=True)
+        os.rename(tmp, self.path)
+
+
+class PRPlan:
+    """
+    The pull request refs to fetch and prune for one remote of a clone
+    """
+
+    def __init__(self, remote, full_name, since, open_prs, fetch, prune):
+        """
+        init
+
+        :param remote: remote name
+        :type remote: string
+        :param full_name: GitHub ``owner/name`` of the remote
+        :type full_name: string
+        :param since: timestamp to list updated pull requests from on the next run
+        :type since: string
+        :param open_prs: numbers of every open pull request, once this plan is applied
+        :type open_prs: set
+        :param fetch: numbers of the pull requests to fetch
+        :type fetch: list
+        :param prune: numbers of the closed pull requests to delete
+        :type prune: list
+        """
+        self.remote = remote
+        self.full_name = full_name
+        self.since = since
+        self.open = open_prs
+        self.fetch = fetch
+        self.prune = prune
+
+    def __repr__(self):
+        return "<PRPlan {r} ({n}) fetch={f} prune={p}>".format(
+            r=self.remote, n=self.full_name, f=len(self.fetch), p=len(self.prune))
+
+
+def plan_pr_refs(client, remote, full_name, entry, now=None):
+    """
+    work out which pull request refs of one remote to fetch and prune; the
+    first run (or a remote that now points at a different repository) lists
+    every open pull request, later runs only those updated since the last
+
+    :param client: GitHub API client
+    :type client: gitclonesync.githubapi.GitHubAPI
+    :param remote: remote name
+    :type remote: string
+    :param full_name: GitHub ``owner/name`` of the remote
+    :type full_name: string
+    :param entry: the remote's PRState entry, or None
+    :type entry: dict
+    :param now: time the listing starts at (epoch seconds); defaults to now
+    :type now: float
+    :rtype: PRPlan
+    """
+    if now is None:
+        now = time.time()
+    since = time.strftime(TIMESTAMP_FORMAT, time.gmtime(now - SINCE_OVERLAP))
+    known = set(entry['prs']) if entry is not None else set()
+    if entry is None or entry.get('repo', '').lower() != full_name.lower():
+        pulls = client.get_pulls(full_name)
+        open_prs = set(p['number'] for p in pulls)
+        return PRPlan(remote, full_name, since, open_prs, sorted(open_prs), sorted(known - open_prs))
+    fetch = set()
+    closed = set()
+    for p in client.get_pulls(full_name, since=entry['since']):
+        if p['state'] == 'open':
+            fetch.add(p['number'])
+        else:
+            closed.add(p['number'])
+    closed -= fetch
+    return PRPlan(remote, full_name, since, (known - closed) | fetch, sorted(fetch), sorted(known & closed))
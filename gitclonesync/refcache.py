@@ -0,0 +1,167 @@
+"""
+Persistent cache of the refs each remote URL advertised when it was last
+fetched, used to skip fetches of remotes that haven't changed
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+DEFAULT_REF_CACHE = '~/.gitclonesync_refcache.json'
+
+# re-fetch a remote at least this often (seconds), even if its refs look unchanged
+DEFAULT_MAX_AGE = 86400
+
+
+def ref_fingerprint(ls_remote_output):
+    """
+    return a stable hash of ``git ls-remote`` output
+
+    :param ls_remote_output: stdout of ``git ls-remote``
+    :type ls_remote_output: string
+    :rtype: string
+    """
+    lines = sorted(l.strip() for l in ls_remote_output.splitlines() if l.strip())
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+class RefCache:
+    """
+    On-disk cache of advertised-ref fingerprints, keyed by remote URL
+
+    Each URL entry holds the fingerprint last seen for that URL, plus the
+    fingerprint each clone (keyed by its git directory) last fetched at; a
+    clone only skips a fetch if the remote still advertises exactly what that
+    clone already fetched.
+    """
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        """
+        init
+
+        :param path: path to the JSON cache file
+        :type path: string
+        :param max_age: maximum age in seconds of a clone's last fetch before it is re-fetched regardless
+        :type max_age: int
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.avoided = 0
+        # updates and invalidations since the last pop_changes(), for process-pool workers to send back
+        self._changes = []
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data = self._load()
+
+    def _load(self):
+        """ read the cache file, returning an empty cache if missing or corrupt """
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except (IOError, ValueError) as ex:
+            self.logger.warning("Ignoring unreadable ref cache {p}: {e}".format(p=self.path, e=ex))
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def is_current(self, url, clone, fingerprint):
+        """
+        return True if ``clone`` last fetched ``url`` when it advertised ``fingerprint``,
+        and that fetch is newer than max_age
+
+        :param url: remote URL
+        :type url: string
+        :param clone: git directory of the clone
+        :type clone: string
+        :param fingerprint: fingerprint of the refs the remote advertises now
+        :type fingerprint: string
+        :rtype: boolean
+        """
+        with self._lock:
+            entry = self._data.get(url, {}).get('clones', {}).get(clone)
+        if entry is None or entry.get('hash') != fingerprint:
+            return False
+        return (time.time() - entry.get('fetched', 0)) < self.max_age
+
+    def update(self, url, clone, fingerprint):
+        """
+        record that ``clone`` has fetched ``url`` while it advertised ``fingerprint``
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.setdefault(url, {'clones': {}})
+            entry['hash'] = fingerprint
+            entry['checked'] = now
+            entry.setdefault('clones', {})[clone] = {'hash': fingerprint, 'fetched': now}
+            self._dirty = True
+            self._changes.append(('update', url, clone, fingerprint))
+
+    def invalidate(self, url, clone=None):
+        """
+        forget cached state for ``url``, or only for one clone of it
+
+        :param url: remote URL
+        :type url: string
+        :param clone: git directory of the clone; None to drop the whole URL
+        :type clone: string
+        """
+        with self._lock:
+            self._changes.append(('invalidate', url, clone))
+            if url not in self._data:
+                return
+            if clone is None:
+                del self._data[url]
+            else:
+                self._data[url].get('clones', {}).pop(clone, None)
+            self._dirty = True
+
+    def record_avoided(self):
+        """ count one fetch skipped because the remote was unchanged """
+        with self._lock:
+            self.avoided += 1
+
+    def pop_changes(self):
+        """
+        return, and forget, the updates and invalidations made since the last call
+
+        :rtype: list
+        """
+        with self._lock:
+            changes = self._changes
+            self._changes = []
+        return changes
+
+    def apply_changes(self, changes, avoided=0):
+        """
+        replay changes made to another process's copy of the cache, as returned by its pop_changes()
+
+        :param changes: the changes
+        :type changes: list
+        :param avoided: fetches the other process avoided
+        :type avoided: int
+        """
+        for change in changes:
+            getattr(self, change[0])(*change[1:])
+        with self._lock:
+            self.avoided += avoided
+            # nothing reads this process's own journal; don't let it grow for the life of a daemon
+            self._changes = []
+
+    def save(self):
+        """ write the cache back to disk (atomically), if it changed """
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = '{p}.{pid}.tmp'.format(p=self.path, pid=os.getpid())
+            with open(tmp, 'w') as fh:
+                json.dump(self._data, fh, sort_keys=True)
+            os.rename(tmp, self.path)
+            self._dirty = False
+        self.logger.debug("wrote ref cache to {p}".format(p=self.path))
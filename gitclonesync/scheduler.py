@@ -0,0 +1,366 @@
+"""
+gitclonesync scheduler - runs CloneSyncer._do_git_dir over many clones,
+optionally in parallel, and collects per-clone results
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from gitclonesync.timing import RepoTimer
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+# number of shared per-host semaphores a SharedHostLimiter hashes hosts onto
+HOST_STRIPES = 64
+
+
+def remote_host(url):
+    """
+    return the hostname of a git remote URL, or None for local remotes
+
+    handles URL-style remotes (``ssh://``, ``https://``, ``git://``) as well as
+    scp-style ``user@host:path`` remotes.
+
+    :param url: remote URL
+    :type url: string
+    :rtype: string or None
+    """
+    if '://' in url:
+        if url.startswith('file://'):
+            return None
+        return urlparse(url).hostname
+    # scp-style: [user@]host:path - but a '/' before the ':' means a local path
+    if ':' in url and '/' not in url.split(':', 1)[0]:
+        return url.split(':', 1)[0].split('@')[-1]
+    return None
+
+
+def log_summary(logger, results, elapsed):
+    """
+    log a summary of per-clone results
+
+    :param logger: logger to log to
+    :type logger: logging.Logger
+    :param results: list of SyncResult
+    :type results: list
+    :param elapsed: wall time of the whole run, in seconds
+    :type elapsed: float
+    """
+    counts = dict((s, 0) for s in (SyncResult.SYNCED, SyncResult.SKIPPED, SyncResult.FAILED))
+    for r in results:
+        counts[r.status] += 1
+    logger.info("Finished {n} clones in {t:.1f}s: {s} synced, {k} skipped, {f} failed".format(
+        n=len(results), t=elapsed, s=counts[SyncResult.SYNCED],
+        k=counts[SyncResult.SKIPPED], f=counts[SyncResult.FAILED]))
+    for r in sorted(results, key=lambda x: x.path):
+        if r.status == SyncResult.FAILED:
+            logger.warning("FAILED {p}: {e}".format(p=r.path, e=r.error))
+        elif r.status == SyncResult.SKIPPED:
+            logger.info("skipped {p}".format(p=r.path))
+
+
+class HostLimiter:
+    """
+    Bounds the number of concurrent operations against any one remote host
+    """
+
+    def __init__(self, max_per_host=None):
+        """
+        init
+
+        :param max_per_host: maximum concurrent operations per remote host; None for unlimited
+        :type max_per_host: int
+        """
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _semaphore(self, host):
+        """ get (creating if needed) the semaphore for a host """
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    @contextmanager
+    def limit(self, url):
+        """
+        context manager that holds a slot for the host of ``url`` for its duration
+
+        :param url: remote URL that is about to be accessed
+        :type url: string
+        """
+        host = remote_host(url)
+        if host is None or not self.max_per_host:
+            yield
+            return
+        sem = self._semaphore(host)
+        sem.acquire()
+        try:
+            yield
+        finally:
+            sem.release()
+
+
+class SharedHostLimiter(HostLimiter):
+    """
+    HostLimiter whose slots are shared by forked worker processes. Hosts are
+    hashed onto a fixed set of semaphores, created before the workers are
+    forked, so max_per_host holds across all of them; hosts that hash onto
+    the same semaphore share one cap, which can only make it stricter.
+    Each worker records the slots it holds in its own ``held`` array, so that
+    those of a worker that is killed can be given back with reclaim().
+
+    There is deliberately no shared lock or condition: a worker killed while
+    it waits for, or holds, a slot can't leave one behind that blocks the
+    other workers.
+    """
+
+    def __init__(self, max_per_host=None, stripes=HOST_STRIPES):
+        """
+        init
+
+        :param max_per_host: maximum concurrent operations per remote host; None for unlimited
+        :type max_per_host: int
+        :param stripes: number of shared semaphores to hash hosts onto
+        :type stripes: int
+        """
+        HostLimiter.__init__(self, max_per_host)
+        self._stripes = [multiprocessing.BoundedSemaphore(max_per_host or 1) for _ in range(stripes)]
+        self.held = self.holdings()
+
+    def holdings(self):
+        """
+        a new array to record the slots one worker process holds; create it
+        before forking the worker, and assign it to ``held`` in the worker
+
+        :rtype: multiprocessing.RawArray
+        """
+        return multiprocessing.RawArray('i', len(self._stripes))
+
+    def _stripe(self, host):
+        return (zlib.crc32(host.encode('utf-8')) & 0xffffffff) % len(self._stripes)
+
+    @contextmanager
+    def limit(self, url):
+        """
+        context manager that holds a slot for the host of ``url`` for its duration
+
+        :param url: remote URL that is about to be accessed
+        :type url: string
+        """
+        host = remote_host(url)
+        if host is None or not self.max_per_host:
+            yield
+            return
+        i = self._stripe(host)
+        self._stripes[i].acquire()
+        self.held[i] += 1
+        try:
+            yield
+        finally:
+            # released first: a worker killed in between has its slot released again by reclaim(),
+            # which at worst briefly lets one more operation at the host, rather than losing the slot
+            self._stripes[i].release()
+            self.held[i] -= 1
+
+    def reclaim(self, held):
+        """
+        give back the slots a dead worker process held
+
+        :param held: the worker's holdings() array
+        :type held: multiprocessing.RawArray
+        """
+        for i in range(len(held)):
+            for _ in range(held[i]):
+                try:
+                    self._stripes[i].release()
+                except ValueError:
+                    # the worker was killed between releasing its slot and recording that it had,
+                    # and every slot of the stripe is free
+                    break
+            held[i] = 0
+
+
+class SyncResult:
+    """
+    Outcome of syncing a single clone
+    """
+
+    SYNCED = 'synced'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+    def __init__(self, path, status, elapsed=0.0, error=None, timer=None):
+        """
+        init
+
+        :param path: path to the clone
+        :type path: string
+        :param status: one of SYNCED, SKIPPED or FAILED
+        :type status: string
+        :param elapsed: wall time spent on this clone, in seconds
+        :type elapsed: float
+        :param error: error message, if status is FAILED
+        :type error: string
+        :param timer: per-phase timings for this clone
+        :type timer: gitclonesync.timing.RepoTimer
+        """
+        self.path = path
+        self.status = status
+        self.elapsed = elapsed
+        self.error = error
+        self.timer = timer
+
+    def __repr__(self):
+        return "<SyncResult {p} {s}>".format(p=self.path, s=self.status)
+
+
+class _ThreadLogBuffer(logging.Filter):
+    """
+    logging filter that diverts records emitted by registered worker threads
+    into per-thread buffers, so that each clone's log output can be emitted
+    as one contiguous block once that clone is finished
+    """
+
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self._buffers = {}
+
+    def start(self):
+        """ begin buffering records from the current thread """
+        self._buffers[threading.current_thread().ident] = []
+
+    def stop(self):
+        """ stop buffering for the current thread and return its records """
+        return self._buffers.pop(threading.current_thread().ident, [])
+
+    def filter(self, record):
+        buf = self._buffers.get(record.thread)
+        if buf is None:
+            return True
+        buf.append(record)
+        return False
+
+
+class SyncScheduler:
+    """
+    Runs a CloneSyncer over many clones with a bounded pool of worker threads
+    """
+
+    def __init__(self, syncer, jobs=1):
+        """
+        init
+
+        :param syncer: the CloneSyncer to run ``_do_git_dir`` on
+        :type syncer: CloneSyncer
+        :param jobs: number of clones to sync concurrently
+        :type jobs: int
+        """
+        self.syncer = syncer
+        self.jobs = max(1, jobs)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.results = []
+        self.elapsed = 0.0
+        self._results_lock = threading.Lock()
+        self._output_lock = threading.Lock()
+        self._logbuf = None
+
+    def run(self, paths):
+        """
+        sync every clone in ``paths``
+
+        :param paths: iterable of paths to git clones
+        :type paths: iterable
+        :returns: list of SyncResult
+        :rtype: list
+        """
+        start = time.time()
+        if self.jobs == 1:
+            for path in paths:
+                self._record(self._sync_one(path))
+        else:
+            self._run_parallel(paths)
+        self.elapsed = time.time() - start
+        return self.results
+
+    def _run_parallel(self, paths):
+        """ feed ``paths`` to a pool of ``self.jobs`` worker threads """
+        self._logbuf = _ThreadLogBuffer()
+        self.syncer.logger.addFilter(self._logbuf)
+        work = Queue()
+        workers = []
+        for i in range(self.jobs):
+            t = threading.Thread(target=self._worker, args=(work,),
+                                 name='sync-worker-{i}'.format(i=i))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        try:
+            for path in paths:
+                work.put(path)
+        finally:
+            for _ in workers:
+                work.put(None)
+            for t in workers:
+                t.join()
+            self.syncer.logger.removeFilter(self._logbuf)
+            self._logbuf = None
+
+    def _worker(self, work):
+        """ worker thread body; sync paths from ``work`` until a None sentinel """
+        while True:
+            path = work.get()
+            if path is None:
+                return
+            self._logbuf.start()
+            try:
+                result = self._sync_one(path)
+            finally:
+                records = self._logbuf.stop()
+            with self._output_lock:
+                for rec in records:
+                    self.syncer.logger.handle(rec)
+            self._record(result)
+
+    def _sync_one(self, path):
+        """
+        sync one clone, catching any exception
+
+        :param path: path to the clone
+        :type path: string
+        :rtype: SyncResult
+        """
+        start = time.time()
+        timer = RepoTimer(path)
+        try:
+            synced = self.syncer._do_git_dir(path, timer=timer)
+        except Exception as ex:
+            self.syncer.logger.error("Error syncing {p}: {e}".format(p=path, e=ex))
+            self.syncer.logger.debug("Traceback for {p}".format(p=path), exc_info=True)
+            return SyncResult(path, SyncResult.FAILED, time.time() - start, error=str(ex), timer=timer)
+        status = SyncResult.SYNCED if synced else SyncResult.SKIPPED
+        return SyncResult(path, status, time.time() - start, timer=timer)
+
+    def _record(self, result):
+        """ add a SyncResult to self.results, and to the syncer's run journal """
+        with self._results_lock:
+            self.results.append(result)
+        if self.syncer.journal is not None:
+            self.syncer.journal.record(result)
+
+    def log_summary(self):
+        """ log a summary of all results, after run() has completed """
+        log_summary(self.logger, self.results, self.elapsed)
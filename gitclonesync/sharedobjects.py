@@ -0,0 +1,143 @@
+"""
+Shared object store: clones of the same remote borrow its objects from one
+bare reference repository per remote URL, via git alternates
+(``objects/info/alternates``). The reference repository is fetched once per
+run; each clone's own fetch then finds the new objects already available and
+only transfers what the reference doesn't have.
+
+Objects in a reference repository must never be deleted while clones borrow
+them, so reference repositories never prune refs and have gc disabled.
+"""
+
+import hashlib
+import os
+import re
+
+from gitclonesync.scheduler import remote_host
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+# share a remote's objects once at least this many clones have it
+DEFAULT_MIN_CLONES = 2
+
+# config set on every reference repository, so that its objects are never deleted
+REFERENCE_CONFIG = (
+    ('gc.auto', '0'),
+    ('gc.pruneExpire', 'never'),
+    ('core.logAllRefUpdates', 'false'),
+)
+
+
+def url_key(url):
+    """
+    identify the repository a remote URL points to, so that i.e.
+    ``git@github.com:owner/name.git`` and ``https://github.com/owner/name``
+    are recognised as the same remote
+
+    :param url: remote URL
+    :type url: string
+    :returns: ``host/path`` for network remotes, else the absolute path
+    :rtype: string
+    """
+    url = url.strip()
+    host = remote_host(url)
+    if host is None:
+        path = urlparse(url).path if url.startswith('file://') else url
+        return os.path.abspath(path).rstrip('/')
+    if '://' in url:
+        path = urlparse(url).path
+    else:
+        path = url.split(':', 1)[1]
+    path = path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return '{h}/{p}'.format(h=host.lower(), p=path)
+
+
+def group_clones(remotes, min_clones=DEFAULT_MIN_CLONES):
+    """
+    find the remotes shared by several clones
+
+    :param remotes: dict of clone path to a dict of its remote names to URLs
+    :type remotes: dict
+    :param min_clones: only return remotes at least this many clones have
+    :type min_clones: int
+    :returns: dict of url_key() to (URL to fetch the reference from, sorted list of clone paths)
+    :rtype: dict
+    """
+    groups = {}
+    for path, urls in remotes.items():
+        for url in urls.values():
+            groups.setdefault(url_key(url), {})[path] = url
+    shared = {}
+    for key, clones in groups.items():
+        if len(clones) < min_clones:
+            continue
+        shared[key] = (sorted(clones.values())[0], sorted(clones))
+    return shared
+
+
+def reference_path(directory, key):
+    """
+    path of the bare reference repository for a remote
+
+    :param directory: directory holding the reference repositories
+    :type directory: string
+    :param key: the remote's url_key()
+    :type key: string
+    :rtype: string
+    """
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', key).strip('_')[-80:]
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(directory, '{n}-{d}.git'.format(n=name, d=digest))
+
+
+def reference_fetch_args(url):
+    """
+    arguments for fetching every branch and tag of ``url`` into a reference
+    repository; refs deleted upstream are kept, as clones may borrow their objects
+
+    :rtype: list
+    """
+    return ['fetch', '--quiet', '--no-prune', '--no-auto-gc', url,
+            '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*']
+
+
+def read_alternates(git_dir):
+    """
+    the object directories a repository borrows objects from
+
+    :param git_dir: the repository's git directory
+    :type git_dir: string
+    :rtype: list
+    """
+    path = os.path.join(git_dir, 'objects', 'info', 'alternates')
+    if not os.path.exists(path):
+        return []
+    with open(path) as fh:
+        return [line.strip() for line in fh if line.strip() and not line.startswith('#')]
+
+
+def add_alternate(git_dir, objects_dir):
+    """
+    make a repository borrow objects from ``objects_dir``, if it doesn't already
+
+    :param git_dir: the repository's git directory
+    :type git_dir: string
+    :param objects_dir: absolute path of the other repository's ``objects`` directory
+    :type objects_dir: string
+    :returns: True if the alternate was added
+    :rtype: boolean
+    """
+    existing = [os.path.realpath(os.path.join(git_dir, 'objects', a)) for a in read_alternates(git_dir)]
+    if os.path.realpath(objects_dir) in existing:
+        return False
+    info = os.path.join(git_dir, 'objects', 'info')
+    if not os.path.isdir(info):
+        os.makedirs(info)
+    with open(os.path.join(info, 'alternates'), 'a') as fh:
+        fh.write(objects_dir + '\n')
+    return True
@@ -0,0 +1,172 @@
+"""
+SSH connection multiplexing: every git command run during a sync goes
+through one OpenSSH master connection per remote host (``ControlMaster`` /
+``ControlPersist``, via ``GIT_SSH_COMMAND``), so each clone's fetches and
+pushes reuse an authenticated session instead of doing their own handshake.
+The control sockets live in a private temporary directory, and the masters
+are shut down (``ssh -O exit``) when the run finishes.
+"""
+
+import logging
+import multiprocessing
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+try:
+    from pipes import quote
+except ImportError:
+    from shlex import quote
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+# seconds a master stays up once its last git command finishes; also how long
+# masters outlive a run that is killed before it can shut them down
+DEFAULT_PERSIST = 120
+
+# seconds to wait for a master to connect and authenticate
+CONNECT_TIMEOUT = 30
+
+
+def ssh_target(url):
+    """
+    the host a git remote is reached over SSH at, as ``ssh`` arguments
+
+    :param url: remote URL
+    :type url: string
+    :returns: i.e. ``['git@github.com']`` or ``['-p', '2222', 'git@host']``, or None if
+      the remote isn't accessed over SSH
+    :rtype: list
+    """
+    url = url.strip()
+    if '://' in url:
+        parsed = urlparse(url)
+        if parsed.scheme not in ('ssh', 'git+ssh', 'ssh+git') or not parsed.hostname:
+            return None
+        host = parsed.hostname
+        if parsed.username:
+            host = '{u}@{h}'.format(u=parsed.username, h=host)
+        if parsed.port:
+            return ['-p', str(parsed.port), host]
+        return [host]
+    # scp-style: [user@]host:path - but a '/' before the ':' means a local path
+    if ':' in url and '/' not in url.split(':', 1)[0]:
+        return [url.split(':', 1)[0]]
+    return None
+
+
+class SSHMultiplexer:
+    """
+    Manages one SSH master connection per remote host for the duration of a
+    run. start() points ``GIT_SSH_COMMAND`` at the shared control sockets;
+    connect() opens a remote's master before the first git command that
+    uses it; close() shuts the masters down and restores the environment.
+
+    Masters are opened under a lock created with the multiplexer, so that
+    forked worker processes don't race to open the same one.
+    """
+
+    def __init__(self, persist=DEFAULT_PERSIST):
+        """
+        init
+
+        :param persist: seconds a master stays up after its last git command (``ControlPersist``)
+        :type persist: int
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.persist = persist
+        self.control_dir = None
+        self._lock = multiprocessing.Lock()
+        self._connected = set()
+        self._saved_env = None
+        # the user's own ssh command, which the multiplexing options are added to
+        self._ssh = shlex.split(os.environ.get('GIT_SSH_COMMAND') or os.environ.get('GIT_SSH') or 'ssh')
+
+    def _options(self):
+        """ ssh options that route a connection through this run's masters """
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath={d}'.format(d=os.path.join(self.control_dir, '%C')),
+                '-o', 'ControlPersist={p}'.format(p=self.persist)]
+
+    def git_ssh_command(self):
+        """
+        the ``GIT_SSH_COMMAND`` that makes git use this run's masters
+
+        :rtype: string
+        """
+        return ' '.join(quote(a) for a in self._ssh + self._options())
+
+    def start(self):
+        """ create the control socket directory and set ``GIT_SSH_COMMAND`` """
+        # kept short, as unix socket paths are limited to ~100 bytes
+        self.control_dir = tempfile.mkdtemp(prefix='gcs-ssh-')
+        self._connected = set()
+        self._saved_env = os.environ.get('GIT_SSH_COMMAND')
+        os.environ['GIT_SSH_COMMAND'] = self.git_ssh_command()
+        self.logger.debug("Multiplexing SSH connections through {d}".format(d=self.control_dir))
+
+    def _ssh_call(self, args):
+        """ run ssh with ``args``; return its exit code and stderr """
+        # not pipes: a master that backgrounds itself may hold them open until it exits
+        with open(os.devnull, 'r+') as devnull:
+            err = tempfile.TemporaryFile()
+            try:
+                code = subprocess.call(self._ssh + args, stdin=devnull, stdout=devnull, stderr=err)
+                err.seek(0)
+                return code, err.read().decode('utf-8', 'replace').strip()
+            finally:
+                err.close()
+
+    def connect(self, url):
+        """
+        open the master connection for the host of ``url``, unless one is
+        already up; a master that can't be opened is logged, and git then
+        connects without it
+
+        :param url: remote URL about to be fetched from or pushed to
+        :type url: string
+        """
+        target = ssh_target(url)
+        if target is None or self.control_dir is None:
+            return
+        key = tuple(target)
+        if key in self._connected:
+            return
+        with self._lock:
+            if key in self._connected:
+                return
+            self._connected.add(key)
+            if self._ssh_call(self._options() + ['-O', 'check'] + target)[0] == 0:
+                return
+            self.logger.debug("Opening SSH master connection to {h}".format(h=' '.join(target)))
+            code, err = self._ssh_call(self._options() + ['-M', '-N', '-f', '-o',
+                                                          'ConnectTimeout={t}'.format(t=CONNECT_TIMEOUT)] + target)
+            if code != 0:
+                self.logger.warning("Unable to open SSH master connection to {h}: {e}".format(
+                    h=' '.join(target), e=err))
+
+    def close(self):
+        """
+        shut down every master of the run - including those opened by forked
+        workers, or by git itself - and restore ``GIT_SSH_COMMAND``
+        """
+        if self.control_dir is None:
+            return
+        closed = 0
+        for name in sorted(os.listdir(self.control_dir)):
+            # the host argument is required, but unused once ControlPath names the socket
+            if self._ssh_call(['-o', 'ControlPath={s}'.format(s=os.path.join(self.control_dir, name)),
+                               '-O', 'exit', 'gitclonesync-mux'])[0] == 0:
+                closed += 1
+        if self._saved_env is None:
+            os.environ.pop('GIT_SSH_COMMAND', None)
+        else:
+            os.environ['GIT_SSH_COMMAND'] = self._saved_env
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+        self.logger.debug("Closed {n} SSH master connection(s)".format(n=closed))
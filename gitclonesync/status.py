@@ -0,0 +1,149 @@
+"""
+Single-pass working tree status for a clone, from ``git status --porcelain=v2``
+"""
+
+import time
+
+# status passes slower than this (seconds) get a hint about untracked cache / fsmonitor
+SLOW_STATUS = 2.0
+
+
+class RepoStatus:
+    """
+    Status of a clone's working tree, branch and upstream, from one
+    ``git status --porcelain=v2 --branch`` pass. Requires git 2.11+.
+    """
+
+    def __init__(self, branch=None, head=None, upstream=None, ahead=0, behind=0,
+                 changed=0, untracked=0, elapsed=0.0, untracked_cache=False, fsmonitor=False):
+        """
+        init
+
+        :param branch: name of the checked-out branch; None if HEAD is detached
+        :type branch: string
+        :param head: commit sha of HEAD; None for an unborn branch
+        :type head: string
+        :param upstream: upstream (tracking) branch of ``branch``, i.e. ``origin/master``
+        :type upstream: string
+        :param ahead: commits on branch not on upstream
+        :type ahead: int
+        :param behind: commits on upstream not on branch
+        :type behind: int
+        :param changed: number of changed (staged, unstaged or unmerged) tracked paths
+        :type changed: int
+        :param untracked: number of untracked paths
+        :type untracked: int
+        :param elapsed: seconds the status pass took
+        :type elapsed: float
+        :param untracked_cache: whether core.untrackedCache is enabled for the clone
+        :type untracked_cache: boolean
+        :param fsmonitor: whether core.fsmonitor is enabled for the clone
+        :type fsmonitor: boolean
+        """
+        self.branch = branch
+        self.head = head
+        self.upstream = upstream
+        self.ahead = ahead
+        self.behind = behind
+        self.changed = changed
+        self.untracked = untracked
+        self.elapsed = elapsed
+        self.untracked_cache = untracked_cache
+        self.fsmonitor = fsmonitor
+
+    def is_dirty(self, untracked_files=False):
+        """
+        same semantics as ``git.Repo.is_dirty()``: True if any tracked path
+        differs from HEAD, or if ``untracked_files`` and there are untracked paths
+        """
+        if self.changed:
+            return True
+        return bool(untracked_files and self.untracked)
+
+    @classmethod
+    def parse(cls, output):
+        """
+        parse the output of ``git status --porcelain=v2 --branch -z``
+
+        :param output: command output
+        :type output: string
+        :rtype: RepoStatus
+        """
+        st = cls()
+        fields = output.split('\0')
+        i = 0
+        while i < len(fields):
+            f = fields[i]
+            i += 1
+            if f.startswith('# branch.oid '):
+                oid = f.split(' ', 2)[2]
+                st.head = None if oid == '(initial)' else oid
+            elif f.startswith('# branch.head '):
+                head = f.split(' ', 2)[2]
+                st.branch = None if head == '(detached)' else head
+            elif f.startswith('# branch.upstream '):
+                st.upstream = f.split(' ', 2)[2]
+            elif f.startswith('# branch.ab '):
+                a, b = f.split(' ')[2:4]
+                st.ahead = int(a.lstrip('+'))
+                st.behind = int(b.lstrip('-'))
+            elif f.startswith('1 ') or f.startswith('u '):
+                st.changed += 1
+            elif f.startswith('2 '):
+                st.changed += 1
+                # renames and copies are followed by the original path
+                i += 1
+            elif f.startswith('? '):
+                st.untracked += 1
+        return st
+
+
+# reads the settings that speed up status, for the hint given when it is slow
+SPEEDUP_CONFIG_ARGS = ['config', '-z', '--get-regexp', r'^core\.(untrackedcache|fsmonitor)$']
+
+
+def _enabled(value):
+    """ return True if a git config value is set to something other than false """
+    return value.strip().lower() not in ('', 'false', 'no', 'off', '0')
+
+
+def parse_speedup_config(output):
+    """
+    parse ``git config -z --get-regexp`` output of SPEEDUP_CONFIG_ARGS
+
+    :returns: (untracked cache enabled, fsmonitor enabled)
+    :rtype: tuple
+    """
+    values = {}
+    for entry in output.split('\0'):
+        key, _, value = entry.partition('\n')
+        if key:
+            values[key] = value
+    return _enabled(values.get('core.untrackedcache', '')), _enabled(values.get('core.fsmonitor', ''))
+
+
+def get_repo_status(repo, optional_locks=True):
+    """
+    run a single status pass over a clone
+
+    git status transparently uses the untracked cache and fsmonitor if the
+    clone has them configured; when ``optional_locks`` is True it may also
+    refresh the index so that later passes are faster. Whether those are
+    configured is only read when the pass took longer than SLOW_STATUS.
+
+    :param repo: the clone
+    :type repo: git.Repo
+    :param optional_locks: if False, run with ``--no-optional-locks`` so the index is never written
+    :type optional_locks: boolean
+    :rtype: RepoStatus
+    """
+    args = ['git'] if optional_locks else ['git', '--no-optional-locks']
+    start = time.time()
+    out = repo.git.execute(args + ['status', '--porcelain=v2', '--branch', '--untracked-files=normal', '-z'])
+    elapsed = time.time() - start
+    st = RepoStatus.parse(out)
+    st.elapsed = elapsed
+    if elapsed > SLOW_STATUS:
+        output = repo.git.execute(['git'] + SPEEDUP_CONFIG_ARGS, with_exceptions=False)
+        st.untracked_cache, st.fsmonitor = parse_speedup_config(output)
+    return st
@@ -0,0 +1,605 @@
+"""
+gitclonesync subprocess engine - syncs many clones from a single thread by
+driving ``git`` child processes directly, instead of GitPython objects
+
+Each clone's sync is a generator: it yields a GitCommand (or a list of them,
+to run concurrently) and is resumed with the CommandResult (or list of
+results) once the command(s) finish. The engine multiplexes the output of
+all running commands with ``select.poll()``, so thousands of clones can be in
+flight with only a bounded number of git processes running at once.
+"""
+
+import errno
+import logging
+import os
+import select
+import signal
+import subprocess
+import time
+from collections import deque
+
+from gitclonesync.branchsync import (UPSTREAM_NAMES, remote_refs_args, parse_remote_refs, mirror_candidates,
+                                     push_args, apply_push_output, LOCAL_REFS_ARGS, WORKTREE_LIST_ARGS,
+                                     checked_out_branches, ff_candidates, update_ref_args, merge_ff_args)
+from gitclonesync.prrefs import pr_fetch_args, pr_delete_args
+from gitclonesync.maintenance import (MAINTENANCE_GIT_VERSION, COUNT_OBJECTS_ARGS, parse_count_objects,
+                                      count_packs, maintenance_reason, maintenance_steps, maintenance_summary)
+from gitclonesync.gitutils import (CONCURRENT_FETCH_GIT_VERSION, is_ref_lock_error,
+                                   ls_remote_patterns, parse_git_version, parse_fetch_progress,
+                                   parse_remote_config)
+from gitclonesync.fetchprofile import (PROFILE_CONFIG_KEYS, PARTIAL_CLONE_GIT_VERSION, parse_profile_config,
+                                       select_profile)
+from gitclonesync.refcache import ref_fingerprint
+from gitclonesync.scheduler import SyncResult, remote_host, log_summary
+from gitclonesync.status import RepoStatus
+from gitclonesync.timing import RepoTimer
+from gitclonesync.watcher import clone_git_dir
+
+# each clone's remotes, and its fetch profile settings, in one read
+CLONE_CONFIG_ARGS = ['config', '-z', '--get-regexp',
+                     r'^(remote\..*\.(url|fetch)|{k})$'.format(k=PROFILE_CONFIG_KEYS)]
+
+
+class GitCommand:
+    """
+    A git command for the engine to run in a clone
+    """
+
+    def __init__(self, cwd, args, timeout=None, env=None, url=None, phase=None, remote=None):
+        """
+        init
+
+        :param cwd: directory to run git in
+        :type cwd: string
+        :param args: git arguments (without the leading ``git``)
+        :type args: list
+        :param timeout: kill the command after this many seconds; None for no limit
+        :type timeout: int
+        :param env: extra environment variables
+        :type env: dict
+        :param url: remote URL the command talks to, for the per-host limit
+        :type url: string
+        :param phase: if set, the command's run time is recorded as this phase in the clone's RepoTimer
+        :type phase: string
+        :param remote: remote name the command is for, if any
+        :type remote: string
+        """
+        self.cwd = cwd
+        self.args = list(args)
+        self.timeout = timeout
+        self.env = env
+        self.host = remote_host(url) if url else None
+        self.phase = phase
+        self.remote = remote
+
+
+class CommandResult:
+    """
+    Outcome of a GitCommand
+    """
+
+    def __init__(self, returncode, stdout, stderr, timed_out=False):
+        self.returncode = returncode
+        self.ok = returncode == 0
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+class _Task:
+    """ one clone being synced: its generator, buffered log lines and outcome """
+
+    def __init__(self, path, gen_func):
+        self.path = path
+        self.start = time.time()
+        self.timer = RepoTimer(path)
+        self.records = []
+        self.status = SyncResult.SYNCED
+        self.error = None
+        self.pending = 0
+        self.results = None
+        self.multi = False
+        self.gen = gen_func(self)
+
+    def log(self, level, msg):
+        self.records.append((level, msg))
+
+
+class _Proc:
+    """ a running GitCommand """
+
+    def __init__(self, task, index, cmd, popen):
+        self.task = task
+        self.index = index
+        self.cmd = cmd
+        self.popen = popen
+        self.start = time.time()
+        self.deadline = time.time() + cmd.timeout if cmd.timeout else None
+        self.out = []
+        self.err = []
+        self.open_fds = 2
+        self.timed_out = False
+
+
+class SubprocessEngine:
+    """
+    Syncs clones with git subprocesses multiplexed on one thread
+    """
+
+    def __init__(self, syncer, max_procs=16):
+        """
+        init
+
+        :param syncer: the CloneSyncer whose options (dryrun, origin_only, ref cache, etc.) to use
+        :type syncer: CloneSyncer
+        :param max_procs: maximum number of git processes to run at once
+        :type max_procs: int
+        """
+        self.syncer = syncer
+        self.max_procs = max(1, max_procs)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.results = []
+        self.elapsed = 0.0
+        self.git_version = parse_git_version(subprocess.check_output(['git', 'version']).decode('utf-8'))
+        self._ready = deque()
+        self._queued = deque()
+        self._procs = {}
+        self._running = 0
+        self._hosts = {}
+        self._poller = None
+        self._devnull = None
+
+    def run(self, paths):
+        """
+        sync every clone in ``paths``
+
+        :param paths: iterable of paths to git clones
+        :type paths: iterable
+        :returns: list of SyncResult
+        :rtype: list
+        """
+        start = time.time()
+        self._poller = select.poll()
+        self._devnull = open(os.devnull)
+        try:
+            self._run(iter(paths))
+        finally:
+            self._devnull.close()
+        self.elapsed = time.time() - start
+        return self.results
+
+    def _run(self, paths):
+        """ the engine's main loop """
+        exhausted = False
+        active = 0
+        while True:
+            # admit new clones while there's spare process capacity
+            while not exhausted and active < self.max_procs and len(self._queued) < self.max_procs:
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self._ready.append((_Task(path, self._sync_clone), None))
+                active += 1
+            while self._ready:
+                task, value = self._ready.popleft()
+                if self._step(task, value):
+                    active -= 1
+            self._start_queued()
+            if self._procs:
+                self._poll()
+            elif exhausted and not self._ready and not self._queued:
+                break
+
+    def log_summary(self):
+        """ log a summary of all results, after run() has completed """
+        log_summary(self.logger, self.results, self.elapsed)
+
+    def _step(self, task, value):
+        """
+        resume a task's generator with ``value`` and queue the command(s) it yields
+
+        :returns: True if the task finished
+        """
+        try:
+            cmd = task.gen.send(value)
+        except StopIteration:
+            self._finish(task)
+            return True
+        except Exception as ex:
+            task.log(logging.ERROR, "Error syncing {p}: {e}".format(p=task.path, e=ex))
+            task.status = SyncResult.FAILED
+            task.error = str(ex)
+            self._finish(task)
+            return True
+        task.multi = isinstance(cmd, list)
+        cmds = cmd if task.multi else [cmd]
+        task.pending = len(cmds)
+        task.results = [None] * len(cmds)
+        if not cmds:
+            self._ready.append((task, []))
+        for i, c in enumerate(cmds):
+            self._queued.append((task, i, c))
+        return False
+
+    def _finish(self, task):
+        """ emit a finished task's buffered log lines and record its result """
+        for level, msg in task.records:
+            self.syncer.logger.log(level, msg)
+        result = SyncResult(task.path, task.status, time.time() - task.start, error=task.error, timer=task.timer)
+        self.results.append(result)
+        if self.syncer.journal is not None:
+            self.syncer.journal.record(result)
+
+    def _start_queued(self):
+        """ start queued commands, within the process and per-host limits """
+        max_per_host = self.syncer.host_limiter.max_per_host
+        blocked = deque()
+        while self._queued and self._running < self.max_procs:
+            task, index, cmd = self._queued.popleft()
+            if cmd.host is not None and max_per_host and self._hosts.get(cmd.host, 0) >= max_per_host:
+                blocked.append((task, index, cmd))
+                continue
+            self._spawn(task, index, cmd)
+        blocked.extend(self._queued)
+        self._queued = blocked
+
+    def _spawn(self, task, index, cmd):
+        """ start one command """
+        env = None
+        if cmd.env:
+            env = dict(os.environ)
+            env.update(cmd.env)
+        # each command gets its own process group, so that a timeout also kills
+        # helpers like ssh or git-remote-https that hold its output pipes open
+        popen = subprocess.Popen(['git'] + cmd.args, cwd=cmd.cwd, env=env, stdin=self._devnull,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True,
+                                 preexec_fn=os.setsid)
+        proc = _Proc(task, index, cmd, popen)
+        self._running += 1
+        for fh in (popen.stdout, popen.stderr):
+            self._procs[fh.fileno()] = proc
+            self._poller.register(fh.fileno(), select.POLLIN | select.POLLHUP | select.POLLERR)
+        if cmd.host is not None:
+            self._hosts[cmd.host] = self._hosts.get(cmd.host, 0) + 1
+
+    def _poll(self):
+        """ wait for output from running commands, and handle completions and timeouts """
+        deadlines = [p.deadline for p in self._procs.values() if p.deadline and not p.timed_out]
+        timeout_ms = 1000
+        if deadlines:
+            timeout_ms = max(0, min(timeout_ms, int((min(deadlines) - time.time()) * 1000) + 1))
+        try:
+            events = self._poller.poll(timeout_ms)
+        except select.error as ex:
+            if ex.args[0] == errno.EINTR:
+                return
+            raise
+        for fd, _ in events:
+            proc = self._procs.get(fd)
+            if proc is None:
+                continue
+            data = os.read(fd, 65536)
+            if data:
+                (proc.out if fd == proc.popen.stdout.fileno() else proc.err).append(data)
+                continue
+            self._poller.unregister(fd)
+            del self._procs[fd]
+            proc.open_fds -= 1
+            if proc.open_fds == 0:
+                self._complete(proc)
+        now = time.time()
+        for proc in set(self._procs.values()):
+            if proc.deadline and not proc.timed_out and now > proc.deadline:
+                proc.timed_out = True
+                try:
+                    os.killpg(proc.popen.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def _complete(self, proc):
+        """ reap a finished command and resume its task if all its commands are done """
+        proc.popen.stdout.close()
+        proc.popen.stderr.close()
+        returncode = proc.popen.wait()
+        self._running -= 1
+        if proc.cmd.host is not None:
+            self._hosts[proc.cmd.host] -= 1
+        stderr = b''.join(proc.err).decode('utf-8', 'replace')
+        if proc.timed_out:
+            stderr += '\nTimeout: git {c} did not complete in {t} seconds'.format(
+                c=proc.cmd.args[0], t=proc.cmd.timeout)
+        task = proc.task
+        if proc.cmd.phase is not None:
+            task.timer.add(proc.cmd.phase, time.time() - proc.start, remote=proc.cmd.remote)
+            if proc.cmd.phase == 'fetch' and returncode == 0:
+                task.timer.add_fetch(proc.cmd.remote, *parse_fetch_progress(stderr))
+        task.results[proc.index] = CommandResult(
+            returncode, b''.join(proc.out).decode('utf-8', 'replace'), stderr, timed_out=proc.timed_out)
+        task.pending -= 1
+        if task.pending == 0:
+            self._ready.append((task, task.results if task.multi else task.results[0]))
+
+    def _sync_clone(self, task):
+        """
+        generator that syncs one clone - the subprocess equivalent of
+        CloneSyncer._do_git_dir
+        """
+        s = self.syncer
+        path = task.path
+        task.log(logging.INFO, "Syncing {p}".format(p=path))
+        env = {'GIT_OPTIONAL_LOCKS': '0'} if s.dryrun else None
+        res = yield GitCommand(path, ['status', '--porcelain=v2', '--branch', '-z',
+                                      '--untracked-files=normal'], env=env, phase='status')
+        if not res.ok:
+            raise RuntimeError("git status failed: {e}".format(e=res.stderr.strip()))
+        status = RepoStatus.parse(res.stdout)
+        if status.is_dirty():
+            if s.sync_dirty:
+                # as CloneSyncer._do_git_dir
+                raise NotImplementedError("TODO: implement what to do with dirty repos")
+            task.log(logging.WARNING, "Skipping dirty repo: %s" % path)
+            task.status = SyncResult.SKIPPED
+            return
+        if status.branch is None:
+            task.log(logging.WARNING, "Skipping repo with detached HEAD: %s" % path)
+            task.status = SyncResult.SKIPPED
+            return
+        task.log(logging.DEBUG, "current branch is %s" % status.branch)
+
+        config = yield GitCommand(path, CLONE_CONFIG_ARGS)
+        urls, refspecs = parse_remote_config(config.stdout)
+        names = sorted(urls)
+        if s.origin_only:
+            for name in names:
+                if name != 'origin':
+                    task.log(logging.DEBUG, "skipping non-origin remote '{r}'".format(r=name))
+            names = [n for n in names if n == 'origin']
+        selected = list(names)
+        profiles = {}
+        if names:
+            defined, repo_profile, settings = parse_profile_config(config.stdout)
+            for name in names:
+                try:
+                    profile = select_profile(defined, repo_profile, settings, name, urls[name], path)
+                except ValueError as ex:
+                    task.log(logging.WARNING, "Fetching remote '{r}' without a profile: {e}".format(r=name, e=ex))
+                    continue
+                if profile is None:
+                    continue
+                conversion = profile.conversion_args(name, settings.get(name, {}))
+                if conversion and self.git_version[:2] < PARTIAL_CLONE_GIT_VERSION:
+                    task.log(logging.WARNING, "git {v} is too old to convert remote '{r}' to a partial clone; "
+                             "fetching it without profile '{n}'".format(
+                                 v='.'.join(str(x) for x in self.git_version), r=name, n=profile.name))
+                    continue
+                if conversion and s.dryrun:
+                    task.log(logging.INFO, "DRYRUN - would convert remote '{r}' to a partial clone with filter "
+                             "{f}".format(r=name, f=profile.filter))
+                elif conversion:
+                    # one at a time: each locks the clone's config file
+                    for args in conversion:
+                        r = yield GitCommand(path, args)
+                        if not r.ok:
+                            raise RuntimeError("Unable to convert remote '{r}' to a partial clone: {e}".format(
+                                r=name, e=r.stderr.strip()))
+                    task.log(logging.INFO, "Converted remote '{r}' to a partial clone with filter {f}".format(
+                        r=name, f=profile.filter))
+                task.log(logging.DEBUG, "fetching remote '{r}' with profile '{n}'".format(r=name, n=profile.name))
+                profiles[name] = profile
+
+        def fetch_args(name):
+            """ the remote name and its profile's options and refspecs, for ``git fetch`` """
+            if name in profiles:
+                return profiles[name].fetch_args(name)
+            return [name]
+
+        def fetch_refspecs(name):
+            if name in profiles and profiles[name].refspecs:
+                return profiles[name].refspecs_for(name)
+            return refspecs.get(name, [])
+
+        if s.dryrun:
+            for name in names:
+                task.log(logging.INFO, "DRYRUN - would fetch rmt '%s'" % name)
+            names = []
+        if s.ssh_mux is not None:
+            # blocks the engine, but only for the first clone to use each host
+            for name in names:
+                s.ssh_mux.connect(urls[name])
+        fingerprints = {}
+        if s.ref_cache is not None and names:
+            res = yield GitCommand(path, ['rev-parse', '--absolute-git-dir'])
+            git_dir = res.stdout.strip()
+            listed = yield [GitCommand(path, ['ls-remote', n] + ls_remote_patterns(fetch_refspecs(n)),
+                                       timeout=s.fetch_timeout, url=urls[n], phase='ls-remote', remote=n)
+                            for n in names]
+            for name, r in zip(list(names), listed):
+                if not r.ok:
+                    task.log(logging.DEBUG, "ls-remote of '{r}' failed; fetching anyway".format(r=name))
+                    continue
+                fingerprints[name] = ref_fingerprint(r.stdout)
+                if not s.force_fetch and s.ref_cache.is_current(urls[name], git_dir, fingerprints[name]):
+                    task.log(logging.DEBUG, "remote '%s' is unchanged since last fetch; skipping" % name)
+                    s.ref_cache.record_avoided()
+                    names.remove(name)
+        concurrent = (s.remote_jobs > 1 and len(names) > 1 and
+                      self.git_version[:2] >= CONCURRENT_FETCH_GIT_VERSION)
+        failed = []
+        if concurrent:
+            fetched = []
+            for i in range(0, len(names), s.remote_jobs):
+                fetched += yield [GitCommand(path, ['fetch', '--progress', '--no-write-fetch-head',
+                                                    '--no-auto-gc'] + fetch_args(n),
+                                             timeout=s.fetch_timeout, url=urls[n], phase='fetch', remote=n)
+                                  for n in names[i:i + s.remote_jobs]]
+            retry = []
+            for name, r in zip(names, fetched):
+                if not r.ok and is_ref_lock_error(r.stderr):
+                    task.log(logging.DEBUG, "ref lock conflict fetching remote '{r}'; retrying serially".format(r=name))
+                    retry.append(name)
+                elif not r.ok:
+                    failed.append((name, r))
+            for name in retry:
+                r = yield GitCommand(path, ['fetch', '--progress'] + fetch_args(name), timeout=s.fetch_timeout,
+                                     url=urls[name], phase='fetch', remote=name)
+                if not r.ok:
+                    failed.append((name, r))
+        else:
+            for name in names:
+                task.log(logging.DEBUG, "fetching remote '%s'" % name)
+                r = yield GitCommand(path, ['fetch', '--progress'] + fetch_args(name), timeout=s.fetch_timeout,
+                                     url=urls[name], phase='fetch', remote=name)
+                if not r.ok:
+                    failed.append((name, r))
+        failed_names = set(n for n, _ in failed)
+        for name, r in failed:
+            task.log(logging.ERROR, "Error fetching remote '{r}': {e}".format(r=name, e=r.stderr.strip()))
+        if s.ref_cache is not None:
+            for name in names:
+                if name in failed_names:
+                    s.ref_cache.invalidate(urls[name], git_dir)
+                elif name in fingerprints:
+                    s.ref_cache.update(urls[name], git_dir, fingerprints[name])
+        state, plans = s.pr_plans.get(path, (None, []))
+        plans = [p for p in plans if p.remote not in failed_names]
+        if s.dryrun:
+            for plan in plans:
+                task.log(logging.INFO, "DRYRUN - would fetch {f} and prune {p} pull request ref(s) of '{r}'".format(
+                    f=len(plan.fetch), p=len(plan.prune), r=plan.remote))
+            plans = []
+        for plan in [p for p in plans if p.fetch]:
+            r = yield GitCommand(path, pr_fetch_args(plan.remote, plan.fetch), timeout=s.fetch_timeout,
+                                 url=urls[plan.remote], phase='pr-fetch', remote=plan.remote)
+            if not r.ok:
+                task.log(logging.ERROR, "Error fetching pull requests of remote '{r}': {e}".format(
+                    r=plan.remote, e=r.stderr.strip()))
+                plans.remove(plan)
+        # one at a time: each rewrites the clone's packed-refs
+        for plan in [p for p in plans if p.prune]:
+            r = yield GitCommand(path, pr_delete_args(plan.remote, plan.prune))
+            if not r.ok:
+                task.log(logging.DEBUG, "Deleting closed pull requests of remote '{r}': {e}".format(
+                    r=plan.remote, e=r.stderr.strip()))
+        for plan in plans:
+            state.update(plan)
+        if plans:
+            state.save()
+        upstream = None
+        if not s.no_upstream:
+            for name in selected:
+                if name in UPSTREAM_NAMES:
+                    upstream = name
+        if upstream in failed_names:
+            task.log(logging.WARNING, "Fetch of upstream remote '{r}' failed; not syncing it to origin".format(
+                r=upstream))
+        elif upstream is not None and 'origin' in selected and 'origin' not in failed_names:
+            res = yield GitCommand(path, remote_refs_args(upstream, 'origin'))
+            updates = mirror_candidates(parse_remote_refs(res.stdout, upstream),
+                                        parse_remote_refs(res.stdout, 'origin'),
+                                        include_new=s.mirror_new_branches)
+            existing = [u for u in updates if u.old is not None]
+            if existing:
+                checks = yield [GitCommand(path, ['merge-base', '--is-ancestor', u.old, u.new]) for u in existing]
+                for u, r in zip(existing, checks):
+                    if not r.ok:
+                        task.log(logging.DEBUG, "origin/{b} is not an ancestor of {u}/{b}; not mirroring it".format(
+                            u=upstream, b=u.branch))
+                        updates.remove(u)
+            if not updates:
+                task.log(logging.DEBUG, "origin is up to date with upstream")
+            elif s.dryrun:
+                for u in updates:
+                    task.log(logging.INFO, "DRYRUN - would push {u}/{b} to origin/{b}".format(u=upstream, b=u.branch))
+            else:
+                r = yield GitCommand(path, push_args('origin', upstream, updates), timeout=s.fetch_timeout,
+                                     url=urls['origin'], phase='push', remote='origin')
+                apply_push_output(updates, r.stdout)
+                for u in updates:
+                    if u.pushed:
+                        task.log(logging.INFO, "Mirrored {u}/{b} to origin ({old}..{new})".format(
+                            u=upstream, b=u.branch, old=(u.old or '')[:7], new=u.new[:7]))
+                    else:
+                        task.log(logging.WARNING, "Unable to mirror {u}/{b} to origin: {e}".format(
+                            u=upstream, b=u.branch, e=u.error))
+        listed = yield [GitCommand(path, WORKTREE_LIST_ARGS), GitCommand(path, LOCAL_REFS_ARGS)]
+        checked_out = checked_out_branches(listed[0].stdout)
+        candidates = ff_candidates(listed[1].stdout)
+        checks = []
+        if candidates:
+            checks = yield [GitCommand(path, ['merge-base', '--is-ancestor', u.old, u.new]) for u in candidates]
+        updates = []
+        current = None
+        for u, r in zip(candidates, checks):
+            if not r.ok:
+                task.log(logging.DEBUG, "branch '{b}' has diverged from its upstream; not fast-forwarding it".format(
+                    b=u.branch))
+            elif u.branch == status.branch:
+                if status.is_dirty(untracked_files=True):
+                    task.log(logging.WARNING, "Repo has untracked files, not fast-forwarding checked-out "
+                             "branch '{b}'".format(b=u.branch))
+                else:
+                    current = u
+            elif u.branch in checked_out:
+                task.log(logging.DEBUG, "branch '{b}' is checked out in another worktree; not fast-forwarding "
+                         "it".format(b=u.branch))
+            else:
+                updates.append(u)
+        if current is not None:
+            updates.append(current)
+        if s.dryrun:
+            for u in updates:
+                task.log(logging.INFO, "DRYRUN - would fast-forward branch '{b}' to {n}".format(b=u.branch, n=u.new[:7]))
+        else:
+            cmds = [GitCommand(path, update_ref_args(u), phase='fast-forward') for u in updates if u is not current]
+            results = (yield cmds) if cmds else []
+            if current is not None:
+                results.append((yield GitCommand(path, merge_ff_args(current), phase='fast-forward')))
+            for u, r in zip(updates, results):
+                if r.ok:
+                    task.log(logging.INFO, "Fast-forwarded branch '{b}' ({o}..{n})".format(
+                        b=u.branch, o=u.old[:7], n=u.new[:7]))
+                else:
+                    task.log(logging.WARNING, "Unable to fast-forward branch '{b}': {e}".format(
+                        b=u.branch, e=r.stderr.strip()))
+        if s.maintenance and self.git_version[:2] >= MAINTENANCE_GIT_VERSION:
+            # delegate to the _maintain generator, passing each command's result back in
+            steps = self._maintain(task)
+            value = None
+            while True:
+                try:
+                    cmd = steps.send(value)
+                except StopIteration:
+                    break
+                value = yield cmd
+
+    def _maintain(self, task):
+        """
+        generator that runs the maintenance steps a clone needs, if any - the
+        subprocess equivalent of CloneSyncer._maintain
+        """
+        s = self.syncer
+        path = task.path
+        res = yield GitCommand(path, COUNT_OBJECTS_ARGS, phase='count-objects')
+        before = count_packs(parse_count_objects(res.stdout), clone_git_dir(path))
+        steps = maintenance_steps(before, max_packs=s.max_packs, max_loose=s.max_loose)
+        if not steps:
+            return
+        reason = maintenance_reason(before, max_packs=s.max_packs, max_loose=s.max_loose)
+        if s.dryrun:
+            task.log(logging.INFO, "DRYRUN - would run {n} ({r})".format(
+                n=', '.join(name for name, _ in steps), r=reason or 'packed loose objects'))
+            return
+        for name, args in steps:
+            r = yield GitCommand(path, args, phase=name)
+            if not r.ok:
+                task.log(logging.WARNING, "Maintenance step '{n}' failed: {e}".format(n=name, e=r.stderr.strip()))
+                return
+        res = yield GitCommand(path, COUNT_OBJECTS_ARGS)
+        after = parse_count_objects(res.stdout)
+        task.timer.maintenance = maintenance_summary(before, after)
+        if reason is not None:
+            task.log(logging.INFO, "Maintained {p} ({r}): {a} -> {b} packs, {c} -> {d} loose objects".format(
+                p=path, r=reason, a=before.get('packs', 0), b=after.get('packs', 0),
+                c=before.get('count', 0), d=after.get('count', 0)))
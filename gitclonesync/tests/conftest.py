@@ -0,0 +1,69 @@
+import os
+import subprocess
+
+import pytest
+
+
+def run_git(cwd, *args):
+    """ run a git command in ``cwd`` and return its stripped stdout """
+    env = dict(os.environ)
+    env.update({
+        'GIT_AUTHOR_NAME': 'test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+        'GIT_COMMITTER_NAME': 'test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+        'GIT_CONFIG_NOSYSTEM': '1', 'HOME': cwd,
+    })
+    out = subprocess.check_output(('git',) + args, cwd=cwd, env=env, stderr=subprocess.STDOUT)
+    return out.decode('utf-8').strip()
+
+
+class GitFactory:
+    """ creates bare "remote" repositories and clones of them under a tmpdir """
+
+    def __init__(self, root):
+        self.root = root
+
+    def bare(self, name, commits=1, branches=('master',)):
+        """ create a bare repo at <root>/remotes/<name>.git with some history """
+        path = os.path.join(self.root, 'remotes', name + '.git')
+        work = os.path.join(self.root, 'work', name)
+        os.makedirs(work)
+        run_git(work, 'init', '-q')
+        run_git(work, 'checkout', '-q', '-b', 'master')
+        for i in range(commits):
+            self.commit(work, 'file{i}'.format(i=i))
+        for b in branches:
+            if b != 'master':
+                run_git(work, 'branch', b)
+        run_git(self.root, 'clone', '-q', '--bare', work, path)
+        return path
+
+    def commit(self, work, fname, content='x'):
+        """ commit a change to ``fname`` in a non-bare repo """
+        with open(os.path.join(work, fname), 'a') as fh:
+            fh.write(content + '\n')
+        run_git(work, 'add', fname)
+        run_git(work, 'commit', '-q', '-m', 'change ' + fname)
+        return run_git(work, 'rev-parse', 'HEAD')
+
+    def push_commit(self, bare, branch='master', fname='pushed'):
+        """ add a commit to ``branch`` of a bare repo; return the new sha """
+        work = bare + '-push'
+        if not os.path.exists(work):
+            run_git(self.root, 'clone', '-q', bare, work)
+        run_git(work, 'fetch', '-q', 'origin')
+        run_git(work, 'checkout', '-q', '-B', branch, 'origin/' + branch)
+        sha = self.commit(work, fname)
+        run_git(work, 'push', '-q', 'origin', branch)
+        return sha
+
+    def clone(self, bare, dest, remotes=None):
+        """ clone ``bare`` to ``dest`` and add extra ``remotes`` (name -> url) """
+        run_git(self.root, 'clone', '-q', bare, dest)
+        for name, url in sorted((remotes or {}).items()):
+            run_git(dest, 'remote', 'add', name, url)
+        return dest
+
+
+@pytest.fixture
+def gitfactory(tmpdir):
+    return GitFactory(str(tmpdir))
@@ -0,0 +1,202 @@
+from gitclonesync.branchsync import (BranchUpdate, remote_refs_args, parse_remote_refs, mirror_candidates,
+                                     push_args, apply_push_output, checked_out_branches, ff_candidates,
+                                     update_ref_args, merge_ff_args, FF_REFLOG_MESSAGE)
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.tests.conftest import run_git
+
+import os
+import pytest
+
+REFS = """aaa refs/remotes/upstream/HEAD
+aaa refs/remotes/upstream/master
+bbb refs/remotes/upstream/feature
+ccc refs/remotes/upstream/new
+ddd refs/remotes/origin/master
+bbb refs/remotes/origin/feature
+"""
+
+
+def test_remote_refs_args():
+    assert remote_refs_args('upstream', 'origin') == [
+        'for-each-ref', '--format=%(objectname) %(refname)', 'refs/remotes/upstream/', 'refs/remotes/origin/']
+
+
+def test_parse_remote_refs():
+    assert parse_remote_refs(REFS, 'upstream') == {'master': 'aaa', 'feature': 'bbb', 'new': 'ccc'}
+    assert parse_remote_refs(REFS, 'origin') == {'master': 'ddd', 'feature': 'bbb'}
+
+
+def test_mirror_candidates():
+    src = parse_remote_refs(REFS, 'upstream')
+    dst = parse_remote_refs(REFS, 'origin')
+    assert [(u.branch, u.old, u.new) for u in mirror_candidates(src, dst)] == [('master', 'ddd', 'aaa')]
+    assert [(u.branch, u.old, u.new) for u in mirror_candidates(src, dst, include_new=True)] == [
+        ('master', 'ddd', 'aaa'), ('new', None, 'ccc')]
+
+
+def test_push_args_and_output():
+    updates = [BranchUpdate('master', 'ddd', 'aaa'), BranchUpdate('new', None, 'ccc'),
+               BranchUpdate('raced', 'eee', 'fff'), BranchUpdate('missing', 'ggg', 'hhh')]
+    assert push_args('origin', 'upstream', updates[:2]) == [
+        'push', '--porcelain', 'origin',
+        'refs/remotes/upstream/master:refs/heads/master', 'refs/remotes/upstream/new:refs/heads/new']
+    out = ("To /srv/origin.git\n"
+           " \trefs/remotes/upstream/master:refs/heads/master\tddd..aaa\n"
+           "*\trefs/remotes/upstream/new:refs/heads/new\t[new branch]\n"
+           "!\trefs/remotes/upstream/raced:refs/heads/raced\t[rejected] (fetch first)\n"
+           "Done\n")
+    apply_push_output(updates, out)
+    assert [(u.pushed, u.error) for u in updates] == [
+        (True, None), (True, None), (False, '[rejected] (fetch first)'), (False, 'not reported by git push')]
+
+
+@pytest.fixture
+def forked(gitfactory):
+    """
+    a clone with origin and upstream remotes, where upstream has moved
+    master and feature ahead, diverged from origin on 'diverged', and
+    has a branch 'new' that origin doesn't
+    """
+    upstream = gitfactory.bare('upstream', branches=('master', 'feature', 'diverged'))
+    origin = os.path.join(gitfactory.root, 'remotes', 'origin.git')
+    run_git(gitfactory.root, 'clone', '-q', '--bare', upstream, origin)
+    path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'), remotes={'upstream': upstream})
+    for branch in ('master', 'feature', 'diverged'):
+        gitfactory.push_commit(upstream, branch=branch, fname=branch)
+    gitfactory.push_commit(origin, branch='diverged', fname='mine')
+    run_git(upstream, 'branch', 'new', 'master')
+    return path, origin, upstream
+
+
+def branch_shas(bare):
+    out = run_git(bare, 'for-each-ref', '--format=%(refname:short) %(objectname)', 'refs/heads/')
+    return dict(line.split(' ') for line in out.splitlines())
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_mirror(forked, engine):
+    path, origin, upstream = forked
+    before = branch_shas(origin)
+    cs = CloneSyncer(path, disable_github=True, engine=engine)
+    cs.run()
+    up = branch_shas(upstream)
+    after = branch_shas(origin)
+    assert after['master'] == up['master']
+    assert after['feature'] == up['feature']
+    assert after['diverged'] == before['diverged']
+    assert 'new' not in after
+    # the push updated the clone's tracking refs too
+    assert run_git(path, 'rev-parse', 'origin/master') == up['master']
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_mirror_new_branches_single_push(forked, engine):
+    path, origin, upstream = forked
+    cs = CloneSyncer(path, disable_github=True, engine=engine, mirror_new_branches=True)
+    if engine == 'gitpython':
+        timer_phases = []
+        orig = cs._mirror_upstream
+
+        def mirror(*args, **kwargs):
+            res = orig(*args, **kwargs)
+            timer_phases.extend(p['phase'] for p in kwargs['timer'].phases)
+            return res
+
+        cs._mirror_upstream = mirror
+        cs.run()
+    else:
+        res = cs.run()
+        assert [r.status for r in res] == [SyncResult.SYNCED]
+        timer_phases = [p['phase'] for p in res[0].timer.phases]
+    assert timer_phases.count('push') == 1
+    assert branch_shas(origin)['new'] == branch_shas(upstream)['new']
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_mirror_dryrun(forked, engine):
+    path, origin, upstream = forked
+    before = branch_shas(origin)
+    cs = CloneSyncer(path, disable_github=True, engine=engine, dryrun=True)
+    cs.run()
+    assert branch_shas(origin) == before
+
+
+def test_mirror_no_upstream(forked):
+    path, origin, upstream = forked
+    before = branch_shas(origin)
+    cs = CloneSyncer(path, disable_github=True, no_upstream=True)
+    cs._do_git_dir(path)
+    assert branch_shas(origin) == before
+    # upstream is still fetched
+    assert run_git(path, 'rev-parse', 'upstream/master') == branch_shas(upstream)['master']
+
+
+def test_checked_out_branches():
+    out = ("worktree /src/a\nHEAD abc\nbranch refs/heads/master\n\n"
+           "worktree /src/a-wt\nHEAD def\nbranch refs/heads/wt\n\n"
+           "worktree /src/a-detached\nHEAD 123\ndetached\n\n")
+    assert checked_out_branches(out) == set(['master', 'wt'])
+
+
+def test_ff_candidates():
+    out = ("aaa refs/heads/master refs/remotes/origin/master\n"
+           "bbb refs/heads/same refs/remotes/origin/same\n"
+           "ccc refs/heads/local \n"
+           "ddd refs/heads/gone refs/remotes/origin/gone\n"
+           "eee refs/remotes/origin/master \n"
+           "bbb refs/remotes/origin/same \n")
+    assert [(u.branch, u.old, u.new) for u in ff_candidates(out)] == [('master', 'aaa', 'eee')]
+    u = ff_candidates(out)[0]
+    assert update_ref_args(u) == ['update-ref', '-m', FF_REFLOG_MESSAGE, 'refs/heads/master', 'eee', 'aaa']
+    assert merge_ff_args(u) == ['merge', '--ff-only', '--quiet', 'eee']
+
+
+@pytest.fixture
+def branchy(gitfactory):
+    """
+    a clone on master with local branches 'feature' (not checked out), 'wt'
+    (checked out in a second worktree) and 'diverged' (has a local commit),
+    all of which are behind origin
+    """
+    origin = gitfactory.bare('origin', branches=('master', 'feature', 'wt', 'diverged'))
+    path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+    for b in ('feature', 'wt', 'diverged'):
+        run_git(path, 'branch', '-q', '--track', b, 'origin/' + b)
+    run_git(path, 'worktree', 'add', '-q', os.path.join(gitfactory.root, 'clone-wt'), 'wt')
+    run_git(path, 'checkout', '-q', 'diverged')
+    gitfactory.commit(path, 'local')
+    run_git(path, 'checkout', '-q', 'master')
+    before = dict((b, run_git(path, 'rev-parse', b)) for b in ('master', 'feature', 'wt', 'diverged'))
+    remote = dict((b, gitfactory.push_commit(origin, branch=b, fname='new-' + b))
+                  for b in ('master', 'feature', 'wt', 'diverged'))
+    return path, before, remote
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_fast_forward(branchy, engine):
+    path, before, remote = branchy
+    # age a tracked file that the fast-forward doesn't change, to show the working tree isn't rewritten
+    untouched = os.path.join(path, 'file0')
+    os.utime(untouched, (1000000000, 1000000000))
+    cs = CloneSyncer(path, disable_github=True, engine=engine)
+    cs.run()
+    assert run_git(path, 'rev-parse', 'master') == remote['master']
+    assert run_git(path, 'rev-parse', 'feature') == remote['feature']
+    assert run_git(path, 'rev-parse', 'wt') == before['wt']
+    assert run_git(path, 'rev-parse', 'diverged') == before['diverged']
+    assert run_git(path, 'symbolic-ref', '--short', 'HEAD') == 'master'
+    assert os.path.exists(os.path.join(path, 'new-master'))
+    assert not os.path.exists(os.path.join(path, 'new-feature'))
+    assert os.stat(untouched).st_mtime == 1000000000
+    assert run_git(path, 'status', '--porcelain') == ''
+    assert FF_REFLOG_MESSAGE in run_git(path, 'reflog', '-1', 'feature')
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_fast_forward_dryrun(branchy, engine):
+    path, before, remote = branchy
+    cs = CloneSyncer(path, disable_github=True, engine=engine, dryrun=True)
+    cs.run()
+    for b, sha in before.items():
+        assert run_git(path, 'rev-parse', b) == sha
@@ -1,11 +1,22 @@
 from gitclonesync.clonesyncer import CloneSyncer, UPSTREAM_NAMES, parse_args, cli_entry
 from gitclonesync.githubclone import GitHubKeyError
+from gitclonesync.githubapi import GitHubAPIError
+from gitclonesync.gitutils import gitpython
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.status import RepoStatus, get_repo_status
+from gitclonesync.timing import RepoTimer, TimedIterator
+from gitclonesync.watcher import InotifyError
+from gitclonesync.tests.conftest import run_git
 
 from contextlib import nested
-from mock import patch, call, MagicMock
+from mock import patch, call, MagicMock, ANY
 import pytest
 import logging
+import json
+import os
+import subprocess
 import sys
+import git
 
 
 class Container:
@@ -25,20 +36,23 @@ class TestCloneSyncer:
         mock_ghc = MagicMock(spec_set='gitclonesync.githubclone.GitHubClone')
         with nested(
                 patch('logging.getLogger', autospec=True),
-                patch('gitclonesync.clonesyncer.CloneSyncer._check_versions', autospec=True),
-                patch('gitclonesync.clonesyncer.GitHubClone', autospec=True),
-        ) as (mock_getlogger, mock_checkver, mock_ghc_init):
+                patch('gitclonesync.githubclone.GitHubClone', autospec=True),
+        ) as (mock_getlogger, mock_ghc_init):
             mock_getlogger.return_value = mocklogger
             mock_ghc_init.return_value = mock_ghc
             cs = CloneSyncer('/foo/bar')
             assert cs.path == '/foo/bar'
             assert cs.dryrun == False
             assert cs.logger == mocklogger
-            assert mock_checkver.call_count == 1
             assert mocklogger.call_count == 0
             assert cs.sync_dirty == False
             assert cs.origin_only == False
             assert cs.no_upstream == False
+            assert cs.jobs == 1
+            assert cs.host_limiter.max_per_host == 4
+            assert cs.ref_cache is None
+            assert cs.force_fetch == False
+            assert cs.finder.max_depth == 1
             assert mock_ghc_init.mock_calls == [call()]
             assert mock_ghc.mock_calls == []
 
@@ -47,14 +61,12 @@ class TestCloneSyncer:
         mock_ghc = MagicMock(spec_set='gitclonesync.githubclone.GitHubClone')
         with nested(
                 patch('logging.getLogger', autospec=True),
-                patch('gitclonesync.clonesyncer.CloneSyncer._check_versions', autospec=True),
-                patch('gitclonesync.clonesyncer.GitHubClone', autospec=True),
-        ) as (mock_getlogger, mock_checkver, mock_ghc_init):
+                patch('gitclonesync.githubclone.GitHubClone', autospec=True),
+        ) as (mock_getlogger, mock_ghc_init):
             mock_getlogger.return_value = mocklogger
             mock_ghc_init.side_effect = GitHubKeyError
             cs = CloneSyncer('/foo/bar')
             assert cs.path == '/foo/bar'
-            assert mock_checkver.call_count == 1
             assert cs.gh is None
             assert mocklogger.error.call_args_list == [
                 call("ERROR: Unable to find GitHub API Key, disabling GitHub API integration.")
@@ -62,10 +74,7 @@ class TestCloneSyncer:
 
     def test_init_dryrun(self, mocklogger):
         """ test init with defaults """
-        with nested(
-                patch('logging.getLogger', autospec=True),
-                patch('gitclonesync.clonesyncer.CloneSyncer._check_versions', autospec=True),
-        ) as (mock_getlogger, mock_checkver):
+        with patch('logging.getLogger', autospec=True) as mock_getlogger:
             mock_getlogger.return_value = mocklogger
             cs = CloneSyncer('/foo/bar', dryrun=True)
             assert cs.path == '/foo/bar'
@@ -76,10 +85,7 @@ class TestCloneSyncer:
 
     def test_init_disable_github(self, mocklogger):
         """ test init with github disabled """
-        with nested(
-                patch('logging.getLogger', autospec=True),
-                patch('gitclonesync.clonesyncer.CloneSyncer._check_versions', autospec=True),
-        ) as (mock_getlogger, mock_checkver):
+        with patch('logging.getLogger', autospec=True) as mock_getlogger:
             mock_getlogger.return_value = mocklogger
             cs = CloneSyncer('/foo/bar', disable_github=True)
             assert cs.path == '/foo/bar'
@@ -88,6 +94,420 @@ class TestCloneSyncer:
                 call("Disabling all GitHub API integration per disable_github option")
             ]
 
+    def test_init_lazy_imports(self):
+        """ GitPython, the GitHub client and pkg_resources aren't imported until needed """
+        code = ("import sys; from gitclonesync.clonesyncer import CloneSyncer; "
+                "CloneSyncer('/foo/bar', disable_github=True, engine='subprocess'); "
+                "print(' '.join(m for m in ('git', 'requests', 'pkg_resources', 'gitclonesync.githubclone') "
+                "if m in sys.modules))")
+        out = subprocess.check_output([sys.executable, '-c', code])
+        assert out.decode('utf-8').strip() == ''
+
+    def test_gitpython_version_check(self):
+        """ GitPython's version is checked once, when it is first imported """
+        with nested(
+                patch('gitclonesync.gitutils._gitpython', None),
+                patch('gitclonesync.gitutils.distribution_version', autospec=True),
+        ) as (_, mock_version):
+            mock_version.return_value = '0.3.1'
+            with pytest.raises(SystemExit):
+                gitpython()
+            mock_version.return_value = '1.0.1'
+            with pytest.raises(SystemExit):
+                gitpython()
+            mock_version.return_value = '2.1.15'
+            assert gitpython() is git
+            assert gitpython() is git
+            assert mock_version.call_count == 3
+
+    def test_init_bad_engine(self):
+        """ test init with an unknown engine """
+        with pytest.raises(ValueError):
+            CloneSyncer('/foo/bar', disable_github=True, engine='asyncio')
+
+
+class TestCloneSyncerRun:
+
+    @pytest.fixture
+    def syncer(self, mocklogger):
+        with patch('logging.getLogger', autospec=True) as mock_getlogger:
+            mock_getlogger.return_value = mocklogger
+            cs = CloneSyncer('/foo', disable_github=True, jobs=3)
+        return cs
+
+    def test_run_single_clone(self, syncer):
+        with nested(
+                patch('gitclonesync.clonesyncer.os.path.isdir', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer._do_git_dir', autospec=True),
+                patch('gitclonesync.clonesyncer.SyncScheduler', autospec=True),
+        ) as (mock_isdir, mock_do, mock_sched):
+            mock_isdir.return_value = True
+            mock_do.return_value = True
+            assert syncer.run() is None
+            assert mock_do.mock_calls == [call(syncer, '/foo', timer=ANY)]
+            assert mock_sched.mock_calls == []
+
+    def test_run_directory(self, syncer):
+        with nested(
+                patch('gitclonesync.clonesyncer.os.path.isdir', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer._iter_git_dirs', autospec=True),
+                patch('gitclonesync.clonesyncer.SyncScheduler', autospec=True),
+        ) as (mock_isdir, mock_iter, mock_sched):
+            mock_isdir.return_value = False
+            mock_sched.return_value.elapsed = 1.0
+            res = syncer.run()
+            assert mock_iter.mock_calls[0] == call(syncer, '/foo')
+            assert mock_sched.mock_calls == [
+                call(syncer, jobs=3),
+                call().run(ANY),
+                call().log_summary(),
+            ]
+            paths = mock_sched.return_value.run.call_args[0][0]
+            assert isinstance(paths, TimedIterator)
+            assert res == mock_sched.return_value.run.return_value
+
+    def test_run_report(self, syncer, tmpdir):
+        syncer.report_path = str(tmpdir.join('report.json'))
+        results = [
+            SyncResult('/foo/a', SyncResult.SYNCED, 2.0, timer=RepoTimer('/foo/a')),
+            SyncResult('/foo/b', SyncResult.FAILED, 1.0, error='boom'),
+        ]
+        results[0].timer.add('fetch', 1.5, remote='origin')
+        with nested(
+                patch('gitclonesync.clonesyncer.os.path.isdir', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer._iter_git_dirs', autospec=True),
+                patch('gitclonesync.clonesyncer.SyncScheduler', autospec=True),
+        ) as (mock_isdir, mock_iter, mock_sched):
+            mock_isdir.return_value = False
+            mock_sched.return_value.run.return_value = results
+            mock_sched.return_value.elapsed = 3.0
+            syncer.run()
+        with open(syncer.report_path) as fh:
+            report = json.load(fh)
+        assert report['elapsed'] == 3.0
+        assert report['phase_totals'] == {'fetch': 1.5}
+        assert [r['path'] for r in report['slowest']] == ['/foo/a', '/foo/b']
+        assert report['repos'][1]['error'] == 'boom'
+
+
+class TestCloneSyncerIndex:
+
+    def test_run_uses_and_saves_index(self, gitfactory, tmpdir):
+        origin = gitfactory.bare('origin')
+        root = os.path.join(gitfactory.root, 'root')
+        os.makedirs(os.path.join(root, 'org'))
+        gitfactory.clone(origin, os.path.join(root, 'org', 'a'))
+        index = str(tmpdir.join('index.jsonl'))
+        cs = CloneSyncer(root, disable_github=True, max_depth=None, index_path=index)
+        assert cs.rebuild_index() == 1
+        assert cs.finder.dirs_scanned == 3
+        # make the fresh entries look old enough to trust
+        with open(index) as fh:
+            lines = [json.loads(l) for l in fh]
+        with open(index, 'w') as fh:
+            for l in lines:
+                l['scanned'] += 10
+                fh.write(json.dumps(l) + '\n')
+        cs2 = CloneSyncer(root, disable_github=True, max_depth=None, index_path=index)
+        with patch('gitclonesync.clonesyncer.CloneSyncer._do_git_dir', autospec=True) as mock_do:
+            mock_do.return_value = True
+            cs2.run()
+        assert mock_do.mock_calls == [call(cs2, os.path.join(root, 'org', 'a'), timer=ANY)]
+        assert cs2.finder.dirs_scanned == 0
+        assert cs2.finder.dirs_cached == 3
+
+    def test_rebuild_no_index(self):
+        cs = CloneSyncer('/foo', disable_github=True)
+        with pytest.raises(SystemExit):
+            cs.rebuild_index()
+
+
+class TestCloneSyncerUpstreams:
+
+    @pytest.fixture
+    def forks(self, gitfactory):
+        """ clones whose origin is a fork, is not a fork, already has upstream, and has no origin """
+        bare = gitfactory.bare('origin')
+        paths = {}
+        for name, url in (('fork', 'git@github.com:me/fork.git'), ('notfork', 'https://github.com/me/mine'),
+                          ('hasup', 'git@github.com:me/hasup.git')):
+            paths[name] = gitfactory.clone(bare, os.path.join(gitfactory.root, name))
+            run_git(paths[name], 'remote', 'set-url', 'origin', url)
+        run_git(paths['hasup'], 'remote', 'add', 'upstream', 'git@github.com:them/hasup.git')
+        paths['noorigin'] = os.path.join(gitfactory.root, 'noorigin')
+        os.makedirs(paths['noorigin'])
+        run_git(paths['noorigin'], 'init', '-q')
+        return paths
+
+    def syncer(self, **kwargs):
+        kwargs.setdefault('add_upstreams', True)
+        with patch('gitclonesync.githubclone.GitHubClone', autospec=True) as mock_ghc:
+            cs = CloneSyncer('/foo', **kwargs)
+        cs.gh.client = MagicMock()
+        return cs, cs.gh
+
+    def test_add_upstreams(self, forks):
+        cs, gh = self.syncer()
+        gh.find_upstreams.return_value = {forks['fork']: 'git@github.com:them/fork.git'}
+        cs._prepass(sorted(forks.values()))
+        assert gh.find_upstreams.mock_calls == [call({
+            forks['fork']: 'git@github.com:me/fork.git',
+            forks['notfork']: 'https://github.com/me/mine',
+        })]
+        assert gh.client.save.mock_calls == [call()]
+        assert run_git(forks['fork'], 'config', 'remote.upstream.url') == 'git@github.com:them/fork.git'
+        assert 'upstream' not in run_git(forks['notfork'], 'remote')
+
+    def test_add_upstreams_dryrun(self, forks):
+        cs, gh = self.syncer(dryrun=True)
+        gh.find_upstreams.return_value = {forks['fork']: 'git@github.com:them/fork.git'}
+        remotes = {forks['fork']: cs._remote_urls(forks['fork'])}
+        cs._add_upstreams(remotes)
+        assert run_git(forks['fork'], 'remote') == 'origin'
+        assert remotes == {forks['fork']: {'origin': 'git@github.com:me/fork.git'}}
+
+    def test_add_upstreams_api_error(self, forks):
+        cs, gh = self.syncer()
+        gh.find_upstreams.side_effect = GitHubAPIError('rate limited')
+        cs._prepass([forks['fork']])
+        assert gh.client.save.mock_calls == [call()]
+        assert run_git(forks['fork'], 'remote') == 'origin'
+
+    def test_add_upstreams_opt_in(self, forks):
+        cs, gh = self.syncer(add_upstreams=False)
+        cs._prepass([forks['fork']])
+        assert gh.find_upstreams.mock_calls == []
+        assert run_git(forks['fork'], 'remote') == 'origin'
+        assert cs._needs_prepass() is False
+
+    def test_add_upstreams_requires_github(self):
+        cs = CloneSyncer('/foo', disable_github=True, add_upstreams=True)
+        assert cs.add_upstreams is False
+        assert cs._needs_prepass() is False
+
+    def test_add_upstreams_origin_only(self, forks):
+        cs, gh = self.syncer(origin_only=True)
+        cs._add_upstreams({forks['fork']: cs._remote_urls(forks['fork'])})
+        assert gh.find_upstreams.mock_calls == []
+
+    def test_run_prepass_per_batch(self):
+        """ the pre-pass runs over each batch as discovery yields it, not after discovery finishes """
+        cs, gh = self.syncer(jobs=2)
+        events = []
+
+        def discover(self, path):
+            for p in ['/foo/a', '/foo/b', '/foo/c']:
+                events.append(('found', p))
+                yield p
+
+        def run(paths):
+            for p in paths:
+                events.append(('sync', p))
+
+        with nested(
+                patch('gitclonesync.clonesyncer.PREPASS_BATCH', 2),
+                patch('gitclonesync.clonesyncer.os.path.isdir', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer._iter_git_dirs', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer._prepass', autospec=True),
+                patch('gitclonesync.clonesyncer.SyncScheduler', autospec=True),
+        ) as (_, mock_isdir, mock_iter, mock_add, mock_sched):
+            mock_isdir.return_value = False
+            mock_sched.return_value.elapsed = 1.0
+            mock_sched.return_value.run.side_effect = run
+            mock_iter.side_effect = discover
+            mock_add.side_effect = lambda self, paths, seen=None: events.append(('prepass', paths))
+            cs.run()
+        assert events == [
+            ('found', '/foo/a'), ('found', '/foo/b'), ('prepass', ['/foo/a', '/foo/b']),
+            ('sync', '/foo/a'), ('sync', '/foo/b'),
+            ('found', '/foo/c'), ('prepass', ['/foo/c']), ('sync', '/foo/c'),
+        ]
+
+
+class TestCloneSyncerDoGitDir:
+
+    @pytest.fixture
+    def clone(self, gitfactory):
+        origin = gitfactory.bare('origin')
+        return gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+
+    def test_skip_dirty(self, clone):
+        with open(os.path.join(clone, 'file0'), 'a') as fh:
+            fh.write('changed')
+        cs = CloneSyncer(clone, disable_github=True)
+        with patch.object(cs, '_fetch_remotes') as mock_fetch:
+            assert cs._do_git_dir(clone) is False
+        assert mock_fetch.mock_calls == []
+
+    def test_skip_detached(self, clone):
+        run_git(clone, 'checkout', '-q', '--detach')
+        cs = CloneSyncer(clone, disable_github=True)
+        with patch.object(cs, '_fetch_remotes') as mock_fetch:
+            assert cs._do_git_dir(clone) is False
+        assert mock_fetch.mock_calls == []
+
+    def test_untracked_files(self, gitfactory):
+        origin = gitfactory.bare('origin', branches=('master', 'feature'))
+        clone = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+        run_git(clone, 'branch', '-q', '--track', 'feature', 'origin/feature')
+        before = run_git(clone, 'rev-parse', 'master')
+        feature = gitfactory.push_commit(origin, branch='feature')
+        gitfactory.push_commit(origin, branch='master')
+        with open(os.path.join(clone, 'untracked'), 'w') as fh:
+            fh.write('x')
+        cs = CloneSyncer(clone, disable_github=True)
+        with patch('gitclonesync.clonesyncer.get_repo_status', wraps=get_repo_status) as mock_status:
+            assert cs._do_git_dir(clone) is True
+        assert mock_status.call_count == 1
+        # the checked-out branch is left alone, the other one is fast-forwarded
+        assert run_git(clone, 'rev-parse', 'master') == before
+        assert run_git(clone, 'rev-parse', 'feature') == feature
+
+    def test_slow_status_hint(self, clone):
+        cs = CloneSyncer(clone, disable_github=True)
+        cs.logger = MagicMock(spec_set=logging.Logger)
+        with patch('gitclonesync.clonesyncer.get_repo_status') as mock_status:
+            mock_status.return_value = RepoStatus(elapsed=5.0)
+            cs._repo_status(git.Repo(clone))
+        assert mock_status.mock_calls == [call(ANY, optional_locks=True)]
+        assert len(cs.logger.warning.mock_calls) == 1
+
+
+class TestCloneSyncerFetch:
+
+    @pytest.fixture
+    def forked_clone(self, gitfactory):
+        remotes = {}
+        for name in ('upstream', 'alice', 'bob'):
+            remotes[name] = gitfactory.bare(name)
+        origin = gitfactory.bare('origin')
+        path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'), remotes=remotes)
+        remotes['origin'] = origin
+        shas = dict((n, gitfactory.push_commit(url)) for n, url in remotes.items())
+        return path, shas
+
+    def test_fetch_remotes_concurrent(self, forked_clone):
+        path, shas = forked_clone
+        cs = CloneSyncer(path, disable_github=True, remote_jobs=4, fetch_timeout=60)
+        repo = git.Repo(path)
+        with patch.object(cs, '_fetch_remote', wraps=cs._fetch_remote) as mock_fetch:
+            assert cs._fetch_remotes(repo, repo.remotes) == []
+        assert sorted(c[1]['concurrent'] for c in mock_fetch.call_args_list) == [True] * 4
+        for name, sha in shas.items():
+            assert run_git(path, 'rev-parse', 'refs/remotes/{n}/master'.format(n=name)) == sha
+
+    def test_fetch_remotes_serial(self, forked_clone):
+        path, shas = forked_clone
+        cs = CloneSyncer(path, disable_github=True)
+        repo = git.Repo(path)
+        assert cs._fetch_remotes(repo, repo.remotes) == []
+        for name, sha in shas.items():
+            assert run_git(path, 'rev-parse', 'refs/remotes/{n}/master'.format(n=name)) == sha
+
+    def test_fetch_remotes_lock_retry_and_failure(self):
+        cs = CloneSyncer('/foo', disable_github=True, remote_jobs=2)
+        cs.logger = MagicMock(spec_set=logging.Logger)
+        repo = MagicMock()
+        repo.git.version_info = (2, 39, 5)
+        rmts = [MagicMock(), MagicMock(), MagicMock()]
+        for r, name in zip(rmts, ('origin', 'upstream', 'other')):
+            r.name = name
+        lock_err = git.GitCommandError(['git', 'fetch'], 1, stderr="error: cannot lock ref 'refs/tags/v1'")
+        other_err = git.GitCommandError(['git', 'fetch'], 128, stderr='fatal: unreachable')
+
+        def fetch(rmt, concurrent=False, timer=None, profile=None):
+            if rmt.name == 'upstream' and concurrent:
+                raise lock_err
+            if rmt.name == 'other':
+                raise other_err
+
+        with patch.object(cs, '_fetch_remote', side_effect=fetch) as mock_fetch:
+            assert cs._fetch_remotes(repo, rmts) == ['other']
+        assert call(rmts[1], timer=None, profile=None) in mock_fetch.call_args_list
+        assert call(rmts[2], timer=None, profile=None) not in mock_fetch.call_args_list
+        assert len(cs.logger.error.call_args_list) == 1
+
+    def test_fetch_remotes_old_git_serial(self):
+        cs = CloneSyncer('/foo', disable_github=True, remote_jobs=4)
+        repo = MagicMock()
+        repo.git.version_info = (2, 20, 1)
+        rmts = [MagicMock(), MagicMock()]
+        with patch.object(cs, '_fetch_remote') as mock_fetch:
+            assert cs._fetch_remotes(repo, rmts) == []
+        assert mock_fetch.call_args_list == [call(rmts[0], timer=None, profile=None),
+                                             call(rmts[1], timer=None, profile=None)]
+
+    def test_fetch_remote_args(self):
+        cs = CloneSyncer('/foo', disable_github=True, fetch_timeout=30)
+        rmt = MagicMock()
+        rmt.name = 'upstream'
+        rmt.url = 'git@github.com:foo/bar.git'
+        rmt.repo.git.fetch.return_value = (0, '', 'Receiving objects: 100% (12/12), 3.00 KiB | 3.00 MiB/s, done.\n')
+        timer = RepoTimer('/foo')
+        cs._fetch_remote(rmt, concurrent=True, timer=timer)
+        assert rmt.repo.git.fetch.mock_calls == [
+            call('upstream', progress=True, with_extended_output=True, kill_after_timeout=30,
+                 no_write_fetch_head=True, no_auto_gc=True)
+        ]
+        assert [p['phase'] for p in timer.phases] == ['fetch']
+        assert timer.fetches == {'upstream': {'objects': 12, 'bytes': 3072}}
+
+
+class TestCloneSyncerRefCache:
+
+    def test_skip_unchanged(self, gitfactory, tmpdir):
+        origin = gitfactory.bare('origin')
+        path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+        cache = str(tmpdir.join('refcache.json'))
+        cs = CloneSyncer(path, disable_github=True, ref_cache_path=cache)
+        rmt = git.Repo(path).remote('origin')
+        fetches = []
+        orig_call = git.cmd.Git._call_process
+
+        def call_process(self, method, *args, **kwargs):
+            if method == 'fetch':
+                fetches.append(args)
+            return orig_call(self, method, *args, **kwargs)
+
+        with patch('git.cmd.Git._call_process', call_process):
+            cs._fetch_remote(rmt)
+            assert len(fetches) == 1
+            assert cs.ref_cache.avoided == 0
+            # nothing changed upstream
+            cs._fetch_remote(rmt)
+            assert len(fetches) == 1
+            assert cs.ref_cache.avoided == 1
+            # new commit upstream
+            sha = gitfactory.push_commit(origin)
+            cs._fetch_remote(rmt)
+            assert len(fetches) == 2
+            assert run_git(path, 'rev-parse', 'origin/master') == sha
+            # forced
+            cs.force_fetch = True
+            cs._fetch_remote(rmt)
+            assert len(fetches) == 3
+            cs._finish_ref_cache()
+            # a fresh run reuses the saved cache
+            cs2 = CloneSyncer(path, disable_github=True, ref_cache_path=cache)
+            cs2._fetch_remote(rmt)
+            assert len(fetches) == 3
+        assert cs2.ref_cache.avoided == 1
+
+    def test_fetch_failure_invalidates(self, tmpdir):
+        cs = CloneSyncer('/foo', disable_github=True, ref_cache_path=str(tmpdir.join('c.json')))
+        rmt = MagicMock()
+        rmt.name = 'origin'
+        rmt.url = '/srv/foo.git'
+        rmt.repo.git_dir = '/foo/.git'
+        rmt.repo.git.config.return_value = '+refs/heads/*:refs/remotes/origin/*'
+        rmt.repo.git.ls_remote.return_value = 'abc\trefs/heads/master'
+        rmt.repo.git.fetch.side_effect = git.GitCommandError(['git', 'fetch'], 128)
+        cs.ref_cache.update('/srv/foo.git', '/foo/.git', 'stale')
+        with pytest.raises(git.GitCommandError):
+            cs._fetch_remote(rmt)
+        assert rmt.repo.git.ls_remote.mock_calls == [call('origin', 'refs/heads/*', 'refs/tags/*')]
+        assert cs.ref_cache._data['/srv/foo.git']['clones'] == {}
+
 
 class TestCloneSyncerCLI:
 
@@ -102,6 +522,41 @@ class TestCloneSyncerCLI:
         setattr(a, 'disable_github', False)
         setattr(a, 'origin_only', False)
         setattr(a, 'no_upstream', False)
+        setattr(a, 'jobs', 1)
+        setattr(a, 'max_per_host', 4)
+        setattr(a, 'remote_jobs', 1)
+        setattr(a, 'fetch_timeout', None)
+        setattr(a, 'ref_cache_path', '~/.gitclonesync_refcache.json')
+        setattr(a, 'ref_cache_max_age', 86400)
+        setattr(a, 'force_fetch', False)
+        setattr(a, 'max_depth', 1)
+        setattr(a, 'prune', [])
+        setattr(a, 'index_path', '~/.gitclonesync_index.jsonl')
+        setattr(a, 'rebuild_index', False)
+        setattr(a, 'engine', 'gitpython')
+        setattr(a, 'report_path', None)
+        setattr(a, 'report_slowest', 10)
+        setattr(a, 'mirror_new_branches', False)
+        setattr(a, 'pr_refs', False)
+        setattr(a, 'daemon', False)
+        setattr(a, 'min_interval', 300)
+        setattr(a, 'max_interval', 86400)
+        setattr(a, 'daemon_state', '~/.gitclonesync_daemon.json')
+        setattr(a, 'watch', False)
+        setattr(a, 'processes', 0)
+        setattr(a, 'repo_timeout', None)
+        setattr(a, 'maintenance', False)
+        setattr(a, 'max_packs', 10)
+        setattr(a, 'max_loose', 1000)
+        setattr(a, 'shared_objects', None)
+        setattr(a, 'shared_min_clones', 2)
+        setattr(a, 'journal_path', '~/.gitclonesync_journal.jsonl')
+        setattr(a, 'resume', False)
+        setattr(a, 'resume_window', 21600)
+        setattr(a, 'retry_failed', False)
+        setattr(a, 'ssh_multiplex', False)
+        setattr(a, 'ssh_persist', 120)
+        setattr(a, 'add_upstreams', False)
         return a
 
     def test_cli_entry_default(self, mocklogger, defaultargs):
@@ -123,7 +578,36 @@ class TestCloneSyncerCLI:
                      sync_dirty=False,
                      disable_github=False,
                      origin_only=False,
-                     no_upstream=False),
+                     no_upstream=False,
+                     jobs=1,
+                     max_per_host=4,
+                     remote_jobs=1,
+                     fetch_timeout=None,
+                     ref_cache_path='~/.gitclonesync_refcache.json',
+                     ref_cache_max_age=86400,
+                     force_fetch=False,
+                     max_depth=1,
+                     prune=[],
+                     index_path='~/.gitclonesync_index.jsonl',
+                     engine='gitpython',
+                     report_path=None,
+                     report_slowest=10,
+                     mirror_new_branches=False,
+                     pr_refs=False,
+                     processes=0,
+                     repo_timeout=None,
+                     maintenance=False,
+                     max_packs=10,
+                     max_loose=1000,
+                     shared_objects=None,
+                     shared_min_clones=2,
+                     journal_path='~/.gitclonesync_journal.jsonl',
+                     resume=False,
+                     resume_window=21600,
+                     retry_failed=False,
+                     ssh_multiplex=False,
+                     ssh_persist=120,
+                     add_upstreams=False),
                 call().run(),
             ]
 
@@ -147,7 +631,36 @@ class TestCloneSyncerCLI:
                      sync_dirty=False,
                      disable_github=False,
                      origin_only=False,
-                     no_upstream=False),
+                     no_upstream=False,
+                     jobs=1,
+                     max_per_host=4,
+                     remote_jobs=1,
+                     fetch_timeout=None,
+                     ref_cache_path='~/.gitclonesync_refcache.json',
+                     ref_cache_max_age=86400,
+                     force_fetch=False,
+                     max_depth=1,
+                     prune=[],
+                     index_path='~/.gitclonesync_index.jsonl',
+                     engine='gitpython',
+                     report_path=None,
+                     report_slowest=10,
+                     mirror_new_branches=False,
+                     pr_refs=False,
+                     processes=0,
+                     repo_timeout=None,
+                     maintenance=False,
+                     max_packs=10,
+                     max_loose=1000,
+                     shared_objects=None,
+                     shared_min_clones=2,
+                     journal_path='~/.gitclonesync_journal.jsonl',
+                     resume=False,
+                     resume_window=21600,
+                     retry_failed=False,
+                     ssh_multiplex=False,
+                     ssh_persist=120,
+                     add_upstreams=False),
                 call().run(),
             ]
 
@@ -160,6 +673,21 @@ class TestCloneSyncerCLI:
         defaultargs.disable_github = True
         defaultargs.origin_only = True
         defaultargs.no_upstream = True
+        defaultargs.jobs = 8
+        defaultargs.max_per_host = 2
+        defaultargs.remote_jobs = 3
+        defaultargs.fetch_timeout = 60
+        defaultargs.ref_cache_path = None
+        defaultargs.ref_cache_max_age = 600
+        defaultargs.force_fetch = True
+        defaultargs.max_depth = 0
+        defaultargs.prune = ['build']
+        defaultargs.index_path = None
+        defaultargs.engine = 'subprocess'
+        defaultargs.report_path = '/tmp/report.csv'
+        defaultargs.report_slowest = 5
+        defaultargs.mirror_new_branches = True
+        defaultargs.pr_refs = True
         with nested(
                 patch('logging.getLogger', autospec=True),
                 patch('gitclonesync.clonesyncer.parse_args', autospec=True),
@@ -177,10 +705,91 @@ class TestCloneSyncerCLI:
                      sync_dirty=True,
                      disable_github=True,
                      origin_only=True,
-                     no_upstream=True),
+                     no_upstream=True,
+                     jobs=8,
+                     max_per_host=2,
+                     remote_jobs=3,
+                     fetch_timeout=60,
+                     ref_cache_path=None,
+                     ref_cache_max_age=600,
+                     force_fetch=True,
+                     max_depth=None,
+                     prune=['build'],
+                     index_path=None,
+                     engine='subprocess',
+                     report_path='/tmp/report.csv',
+                     report_slowest=5,
+                     mirror_new_branches=True,
+                     pr_refs=True,
+                     processes=0,
+                     repo_timeout=None,
+                     maintenance=False,
+                     max_packs=10,
+                     max_loose=1000,
+                     shared_objects=None,
+                     shared_min_clones=2,
+                     journal_path='~/.gitclonesync_journal.jsonl',
+                     resume=False,
+                     resume_window=21600,
+                     retry_failed=False,
+                     ssh_multiplex=False,
+                     ssh_persist=120,
+                     add_upstreams=False),
+                call().run(),
+            ]
+
+    def test_cli_entry_rebuild_index(self, mocklogger, defaultargs):
+        """ test cli_entry() with --rebuild-index """
+        defaultargs.rebuild_index = True
+        with nested(
+                patch('logging.getLogger', autospec=True),
+                patch('gitclonesync.clonesyncer.parse_args', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer', autospec=True),
+        ) as (mock_getlogger, mock_parse_args, mock_cs):
+            mock_parse_args.return_value = defaultargs
+            mock_getlogger.return_value = mocklogger
+            cli_entry()
+            assert mock_cs.return_value.mock_calls == [call.rebuild_index()]
+
+    def test_cli_entry_daemon(self, mocklogger, defaultargs):
+        """ test cli_entry() with --daemon """
+        defaultargs.daemon = True
+        defaultargs.min_interval = 60
+        with nested(
+                patch('logging.getLogger', autospec=True),
+                patch('gitclonesync.clonesyncer.parse_args', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer', autospec=True),
+                patch('gitclonesync.clonesyncer.SyncDaemon', autospec=True),
+        ) as (mock_getlogger, mock_parse_args, mock_cs, mock_daemon):
+            mock_parse_args.return_value = defaultargs
+            mock_getlogger.return_value = mocklogger
+            cli_entry()
+            assert mock_cs.return_value.mock_calls == []
+            assert mock_daemon.mock_calls == [
+                call(mock_cs.return_value, min_interval=60, max_interval=86400,
+                     state_path='~/.gitclonesync_daemon.json'),
                 call().run(),
             ]
 
+    def test_cli_entry_watch(self, mocklogger, defaultargs):
+        """ test cli_entry() with --watch, where inotify is unavailable """
+        defaultargs.watch = True
+        with nested(
+                patch('logging.getLogger', autospec=True),
+                patch('gitclonesync.clonesyncer.parse_args', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneSyncer', autospec=True),
+                patch('gitclonesync.clonesyncer.SyncDaemon', autospec=True),
+                patch('gitclonesync.clonesyncer.CloneWatcher', autospec=True),
+        ) as (mock_getlogger, mock_parse_args, mock_cs, mock_daemon, mock_watcher):
+            mock_parse_args.return_value = defaultargs
+            mock_getlogger.return_value = mocklogger
+            mock_watcher.side_effect = InotifyError('not on Linux')
+            cli_entry()
+            assert mock_watcher.mock_calls == [call(mock_daemon.return_value)]
+            assert mock_daemon.return_value.run.mock_calls == [call()]
+            assert mocklogger.error.mock_calls == [
+                call("Unable to watch clones for local changes: not on Linux")]
+
     def test_parse_args_specified_dir(self, defaultargs):
         """ test parse_args() with specified directory and verbose """
         defaultargs.directory = '/foo/bar/baz'
@@ -215,13 +824,84 @@ class TestCloneSyncerCLI:
         defaultargs.disable_github = True
         defaultargs.origin_only = True
         defaultargs.no_upstream = True
+        defaultargs.jobs = 8
+        defaultargs.max_per_host = 2
+        defaultargs.remote_jobs = 3
+        defaultargs.fetch_timeout = 60
+        defaultargs.ref_cache_path = None
+        defaultargs.ref_cache_max_age = 600
+        defaultargs.force_fetch = True
+        defaultargs.max_depth = 0
+        defaultargs.prune = ['build', 'dist']
+        defaultargs.index_path = None
+        defaultargs.rebuild_index = True
+        defaultargs.engine = 'subprocess'
+        defaultargs.report_path = '/tmp/report.csv'
+        defaultargs.report_slowest = 5
+        defaultargs.mirror_new_branches = True
+        defaultargs.pr_refs = True
+        defaultargs.daemon = True
+        defaultargs.min_interval = 60
+        defaultargs.max_interval = 3600
+        defaultargs.daemon_state = '/tmp/daemon.json'
+        defaultargs.watch = True
+        defaultargs.processes = 4
+        defaultargs.repo_timeout = 600
+        defaultargs.maintenance = True
+        defaultargs.max_packs = 5
+        defaultargs.max_loose = 200
+        defaultargs.shared_objects = '/srv/git-objects'
+        defaultargs.shared_min_clones = 3
+        defaultargs.journal_path = '/tmp/journal.jsonl'
+        defaultargs.resume = True
+        defaultargs.resume_window = 600
+        defaultargs.retry_failed = True
+        defaultargs.ssh_multiplex = True
+        defaultargs.ssh_persist = 30
+        defaultargs.add_upstreams = True
         argv = ['git_clone_sync',
                 '-d',
                 '-q',
                 '-D',
                 '-G',
                 '-o',
-                '-u']
+                '-u',
+                '-j', '8',
+                '--max-per-host', '2',
+                '--remote-jobs', '3',
+                '--fetch-timeout', '60',
+                '--no-ref-cache',
+                '--ref-cache-max-age', '600',
+                '-f',
+                '-m', '0',
+                '--prune', 'build',
+                '--prune', 'dist',
+                '--no-index',
+                '--rebuild-index',
+                '--engine', 'subprocess',
+                '--report', '/tmp/report.csv',
+                '--report-slowest', '5',
+                '--mirror-new-branches',
+                '--pr-refs',
+                '--daemon',
+                '--min-interval', '60',
+                '--max-interval', '3600',
+                '--daemon-state', '/tmp/daemon.json',
+                '--watch',
+                '-P', '4',
+                '--repo-timeout', '600',
+                '--maintenance',
+                '--max-packs', '5',
+                '--max-loose', '200',
+                '--shared-objects', '/srv/git-objects',
+                '--shared-min-clones', '3',
+                '--journal', '/tmp/journal.jsonl',
+                '--resume',
+                '--resume-window', '600',
+                '--retry-failed',
+                '--ssh-multiplex',
+                '--ssh-persist', '30',
+                '--add-upstreams']
         with nested(
                 patch.object(sys, 'argv', argv),
                 patch('gitclonesync.clonesyncer.os.getcwd', autospec=True),
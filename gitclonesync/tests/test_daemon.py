@@ -0,0 +1,160 @@
+from gitclonesync.daemon import SyncDaemon, result_changed
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.timing import RepoTimer
+
+from mock import MagicMock, call
+import json
+import os
+import pytest
+
+
+def result(path, objects=0, status=SyncResult.SYNCED, error=None):
+    timer = RepoTimer(path)
+    timer.add_fetch('origin', objects, objects * 100)
+    return SyncResult(path, status, 1.0, error=error, timer=timer)
+
+
+@pytest.fixture
+def syncer():
+    s = MagicMock(spec_set=CloneSyncer)
+    s.discover.return_value = ['/src/a', '/src/b', '/src/c']
+    s.sync_paths.side_effect = lambda paths: ([result(p) for p in paths], 1.0)
+    return s
+
+
+def test_result_changed():
+    assert result_changed(result('/a', objects=3)) is True
+    assert result_changed(result('/a')) is False
+    assert result_changed(SyncResult('/a', SyncResult.FAILED, error='x')) is False
+
+
+def test_run_once_and_adapt(syncer):
+    d = SyncDaemon(syncer, min_interval=100, max_interval=1000, state_path=None)
+    assert d.run_once(now=0) == 3
+    assert sorted(syncer.sync_paths.call_args[0][0]) == ['/src/a', '/src/b', '/src/c']
+    # nothing changed, so every interval grew
+    assert set(s.interval for s in d.repos.values()) == set([150])
+    assert d.run_once(now=d.next_due() - 1) == 0
+    syncer.sync_paths.side_effect = lambda paths: ([result(p, objects=5 if p == '/src/a' else 0) for p in paths], 1.0)
+    d.run_once(now=d.next_due())
+    assert d.repos['/src/a'].interval == 100
+    assert d.repos['/src/b'].interval == 225
+    assert d.repos['/src/a'].changes == 1
+    assert d.repos['/src/b'].syncs == 2
+    for _ in range(10):
+        d.reschedule(result('/src/b'), now=0)
+    assert d.repos['/src/b'].interval == 1000
+
+
+def test_discover_adds_and_removes(syncer):
+    d = SyncDaemon(syncer, min_interval=100, state_path=None)
+    d.discover(now=0)
+    syncer.discover.return_value = ['/src/a', '/src/d']
+    d.discover(now=50)
+    assert sorted(d.repos) == ['/src/a', '/src/d']
+    assert d.repos['/src/d'].due == 50
+    assert d.pop_due(now=50) == ['/src/a', '/src/d']
+
+
+def test_trigger(syncer):
+    d = SyncDaemon(syncer, min_interval=100, state_path=None)
+    d.discover(now=0)
+    assert sorted(d.pop_due(now=0)) == ['/src/a', '/src/b', '/src/c']
+    # triggered while running: requeued as soon as the sync finishes
+    assert d.trigger('/src/a', now=10) is True
+    d.reschedule(result('/src/a'), now=20)
+    d.reschedule(result('/src/b'), now=20)
+    assert d.repos['/src/a'].due == 20
+    assert d.trigger('/src/b', now=30) is True
+    assert d.trigger('/src/nope', now=30) is False
+    assert d.pop_due(now=30) == ['/src/a', '/src/b']
+
+
+def test_state_round_trip(syncer, tmpdir):
+    path = str(tmpdir.join('daemon.json'))
+    d = SyncDaemon(syncer, min_interval=100, state_path=path)
+    d.run_once(now=0)
+    with open(path) as fh:
+        state = json.load(fh)
+    assert state['batches'] == 1
+    assert [r['path'] for r in state['repos']] == ['/src/a', '/src/b', '/src/c']
+    d2 = SyncDaemon(syncer, min_interval=100, state_path=path)
+    d2.load_state()
+    d2.discover(now=1)
+    assert d2.repos['/src/a'].interval == 150
+    assert d2.repos['/src/a'].syncs == 1
+    assert d2.pop_due(now=1) == []
+
+
+def test_log_queue(syncer):
+    d = SyncDaemon(syncer, state_path=None)
+    d.logger = MagicMock()
+    d.discover(now=0)
+    d.log_queue()
+    assert len(d.logger.warning.mock_calls) == 4
+
+
+def test_run_stops(syncer, monkeypatch):
+    d = SyncDaemon(syncer, state_path=None)
+    monkeypatch.setattr('gitclonesync.daemon.signal.signal', MagicMock())
+
+    def sync(paths):
+        d.stop()
+        return [result(p) for p in paths], 1.0
+
+    syncer.sync_paths.side_effect = sync
+    d.run()
+    assert syncer.sync_paths.call_count == 1
+    assert syncer.discover.mock_calls == [call()]
+
+
+def test_sigusr1_logs_from_run_loop(syncer, monkeypatch):
+    """ the SIGUSR1 handler doesn't take the lock, which the main thread may hold when it runs """
+    d = SyncDaemon(syncer, state_path=None)
+    monkeypatch.setattr('gitclonesync.daemon.signal.signal', MagicMock())
+    d.log_queue = MagicMock()
+
+    def sync(paths):
+        with d._lock:
+            d.request_queue_log()
+        assert d.log_queue.mock_calls == []
+        d.stop()
+        return [result(p) for p in paths], 1.0
+
+    syncer.sync_paths.side_effect = sync
+    d.run()
+    assert d.log_queue.mock_calls == [call()]
+    assert d._log_requested is False
+
+
+def test_daemon_syncs_clones(gitfactory, tmpdir):
+    origin = gitfactory.bare('origin')
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(root)
+    gitfactory.clone(origin, os.path.join(root, 'a'))
+    cs = CloneSyncer(root, disable_github=True)
+    d = SyncDaemon(cs, min_interval=100, state_path=str(tmpdir.join('d.json')))
+    assert d.run_once() == 1
+    sched = d.repos[os.path.join(root, 'a')]
+    assert sched.last_status == SyncResult.SYNCED
+    gitfactory.push_commit(origin)
+    d.trigger(sched.path)
+    assert d.run_once() == 1
+    assert sched.changes == 1
+    assert sched.interval == 100
+
+
+def test_trigger_local_change(syncer):
+    d = SyncDaemon(syncer, min_interval=100, state_path=None)
+    d.watcher = MagicMock()
+    d.discover(now=0)
+    assert d.watcher.update.mock_calls == [call(set(['/src/a', '/src/b', '/src/c']))]
+    d.pop_due(now=0)
+    # the sync's own ref and index writes are ignored, during it and just after
+    assert d.trigger('/src/a', now=1, local_change=True) is False
+    d.reschedule(result('/src/a'), now=2)
+    assert d.trigger('/src/a', now=3, local_change=True) is False
+    assert d.repos['/src/a'].due == 152
+    assert d.trigger('/src/a', now=60, local_change=True) is True
+    assert d.repos['/src/a'].due == 60
@@ -0,0 +1,90 @@
+from gitclonesync.dirindex import DirIndex
+from gitclonesync.discovery import RepoFinder, CLONE
+
+import json
+import os
+import time
+
+
+def age_index(path, seconds=10):
+    """ push the 'scanned' time of every entry back, so that none are racy """
+    with open(path) as fh:
+        entries = [json.loads(l) for l in fh]
+    with open(path, 'w') as fh:
+        for e in entries:
+            e['scanned'] += seconds
+            fh.write(json.dumps(e) + '\n')
+
+
+class TestDirIndex:
+
+    def test_lookup(self, tmpdir):
+        idx = DirIndex(str(tmpdir.join('i.jsonl')))
+        assert idx.lookup('/a', 100.0) is None
+        idx._entries['/a'] = {'dir': '/a', 'mtime': 100.0, 'scanned': 200.0, 'subdirs': [], 'repo': None}
+        assert idx.lookup('/a', 100.0)['dir'] == '/a'
+        assert idx.lookup('/a', 101.0) is None
+        # racy entry: listed within the same tick it was modified
+        idx._entries['/b'] = {'dir': '/b', 'mtime': 100.0, 'scanned': 100.5, 'subdirs': [], 'repo': None}
+        assert idx.lookup('/b', 100.0) is None
+
+    def test_save_load_and_rebuild(self, tmpdir):
+        p = str(tmpdir.join('i.jsonl'))
+        idx = DirIndex(p)
+        idx.begin('/root')
+        idx.store('/root', 5.0, ['b', 'a'])
+        idx.store('/root/a', 6.0, [], ('clone', '/root/a/.git'))
+        idx.save()
+        with open(p) as fh:
+            lines = [json.loads(l) for l in fh]
+        assert [l['dir'] for l in lines] == ['/root', '/root/a']
+        assert lines[0]['subdirs'] == ['a', 'b']
+        assert lines[1]['repo'] == ['clone', '/root/a/.git']
+        assert sorted(DirIndex(p)._entries) == ['/root', '/root/a']
+        assert DirIndex(p, rebuild=True)._entries == {}
+
+    def test_save_keeps_other_roots(self, tmpdir):
+        p = str(tmpdir.join('i.jsonl'))
+        idx = DirIndex(p)
+        idx.begin('/one')
+        idx.store('/one', 5.0, ['x'])
+        idx.store('/one/x', 5.0, [])
+        idx.begin('/two')
+        idx.store('/two', 5.0, [])
+        idx.save()
+        idx = DirIndex(p)
+        # /one/x is gone now
+        idx.begin('/one')
+        idx.store('/one', 6.0, [])
+        idx.save()
+        assert sorted(DirIndex(p)._entries) == ['/one', '/two']
+
+    def test_corrupt_lines_ignored(self, tmpdir):
+        p = tmpdir.join('i.jsonl')
+        p.write('{"dir": "/a", "mtime": 1}\nnot json\n{"nodir": 1}\n')
+        assert list(DirIndex(str(p))._entries) == ['/a']
+
+
+class TestRepoFinderWithIndex:
+
+    def test_incremental(self, gitfactory, tmpdir):
+        origin = gitfactory.bare('origin')
+        root = os.path.join(gitfactory.root, 'root')
+        for d in ('org1/team', 'org2'):
+            os.makedirs(os.path.join(root, d))
+        gitfactory.clone(origin, os.path.join(root, 'org1', 'team', 'a'))
+        p = str(tmpdir.join('i.jsonl'))
+        rf = RepoFinder(max_depth=None, index=DirIndex(p))
+        assert [r.path for r in rf.find(root)] == [os.path.join(root, 'org1', 'team', 'a')]
+        assert (rf.dirs_scanned, rf.dirs_cached) == (5, 0)
+        rf.index.save()
+        age_index(p)
+        # add a clone under org2 only; org1 and its subtree come from the index
+        gitfactory.clone(origin, os.path.join(root, 'org2', 'b'))
+        os.utime(os.path.join(root, 'org2'), (time.time() - 60, time.time() - 60))
+        rf = RepoFinder(max_depth=None, index=DirIndex(p))
+        found = list(rf.find(root))
+        assert [(os.path.relpath(r.path, root), r.kind) for r in found] == [
+            ('org1/team/a', CLONE), ('org2/b', CLONE)]
+        assert found[0].common_dir == os.path.realpath(os.path.join(root, 'org1', 'team', 'a', '.git'))
+        assert (rf.dirs_scanned, rf.dirs_cached) == (2, 4)
@@ -0,0 +1,127 @@
+from gitclonesync import discovery
+from gitclonesync.discovery import (RepoFinder, CLONE, WORKTREE, SUBMODULE, BARE,
+                                    DEFAULT_PRUNE)
+from gitclonesync.tests.conftest import run_git
+
+from mock import patch
+import os
+import pytest
+
+
+@pytest.fixture
+def farm(gitfactory):
+    """
+    root/
+      a/             clone
+      a-wt/          worktree of a
+      org/team/b/    clone, with a submodule and a nested dir
+      org/c.git      bare repo
+      node_modules/d clone (pruned)
+      plain/         not a repo
+    """
+    origin = gitfactory.bare('origin')
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(os.path.join(root, 'org', 'team'))
+    os.makedirs(os.path.join(root, 'node_modules'))
+    os.makedirs(os.path.join(root, 'plain', 'empty'))
+    a = gitfactory.clone(origin, os.path.join(root, 'a'))
+    run_git(a, 'worktree', 'add', '-q', '-b', 'wt', os.path.join(root, 'a-wt'))
+    b = gitfactory.clone(origin, os.path.join(root, 'org', 'team', 'b'))
+    os.makedirs(os.path.join(b, 'nested'))
+    gitfactory.clone(origin, os.path.join(b, 'nested', 'inner'))
+    run_git(root, 'clone', '-q', '--bare', origin, os.path.join(root, 'org', 'c.git'))
+    gitfactory.clone(origin, os.path.join(root, 'node_modules', 'd'))
+    return root
+
+
+def relpaths(root, repos):
+    return [(os.path.relpath(r.path, root), r.kind) for r in repos]
+
+
+class TestRepoFinder:
+
+    def test_default_depth(self, farm):
+        found = list(RepoFinder().find(farm))
+        assert relpaths(farm, found) == [('a', CLONE)]
+        assert found[0].common_dir == os.path.realpath(os.path.join(farm, 'a', '.git'))
+
+    def test_recursive(self, farm):
+        rf = RepoFinder(max_depth=None)
+        assert relpaths(farm, rf.find(farm)) == [
+            ('a', CLONE),
+            ('org/team/b', CLONE),
+        ]
+
+    def test_all_kinds(self, farm):
+        rf = RepoFinder(max_depth=None, kinds=(CLONE, WORKTREE, SUBMODULE, BARE))
+        assert relpaths(farm, rf.find(farm)) == [
+            ('a', CLONE),
+            ('org/c.git', BARE),
+            ('org/team/b', CLONE),
+        ]
+
+    def test_worktree_first(self, farm):
+        """ a worktree found before its main clone is yielded instead of it """
+        rf = RepoFinder(max_depth=None, prune=DEFAULT_PRUNE + ('a',))
+        assert relpaths(farm, rf.find(farm)) == [
+            ('a-wt', WORKTREE),
+            ('org/team/b', CLONE),
+        ]
+
+    def test_depth_limit(self, farm):
+        assert relpaths(farm, RepoFinder(max_depth=2).find(farm)) == [('a', CLONE)]
+        assert relpaths(farm, RepoFinder(max_depth=3).find(farm)) == [
+            ('a', CLONE), ('org/team/b', CLONE)]
+
+    def test_unpruned(self, farm):
+        rf = RepoFinder(max_depth=None, prune=())
+        assert relpaths(farm, rf.find(farm)) == [
+            ('a', CLONE),
+            ('node_modules/d', CLONE),
+            ('org/team/b', CLONE),
+        ]
+
+    def test_root_is_repo(self, farm):
+        found = list(RepoFinder().find(os.path.join(farm, 'a')))
+        assert relpaths(farm, found) == [('a', CLONE)]
+
+    def test_submodule_and_separate_gitdir(self, gitfactory):
+        origin = gitfactory.bare('origin')
+        sup = gitfactory.clone(origin, os.path.join(gitfactory.root, 'sup'))
+        run_git(sup, '-c', 'protocol.file.allow=always', 'submodule', 'add', '-q', origin, 'sub')
+        sep = os.path.join(gitfactory.root, 'sep')
+        run_git(gitfactory.root, 'clone', '-q', '--separate-git-dir',
+                os.path.join(gitfactory.root, 'sep-git'), origin, sep)
+        rf = RepoFinder(kinds=(CLONE, WORKTREE, SUBMODULE, BARE))
+        sub = os.path.join(sup, 'sub')
+        assert rf._classify(sub, discovery._scandir(sub)).kind == SUBMODULE
+        assert relpaths(gitfactory.root, rf.find(sep)) == [('sep', CLONE)]
+        assert rf._classify(sep, discovery._scandir(sep)).common_dir == os.path.realpath(
+            os.path.join(gitfactory.root, 'sep-git'))
+
+    def test_listdir_fallback(self, farm):
+        with patch.object(discovery, 'scandir', None):
+            rf = RepoFinder(max_depth=None)
+            assert relpaths(farm, rf.find(farm)) == [('a', CLONE), ('org/team/b', CLONE)]
+
+    def test_streaming(self, farm):
+        gen = RepoFinder(max_depth=None).find(farm)
+        first = next(gen)
+        assert os.path.basename(first.path) == 'a'
+
+    def test_unreadable_dir(self, farm):
+        rf = RepoFinder(max_depth=None)
+        real = discovery._scandir
+
+        def scan(path):
+            if path.endswith('org'):
+                raise OSError(13, 'Permission denied')
+            return real(path)
+
+        with patch.object(discovery, '_scandir', side_effect=scan):
+            assert relpaths(farm, rf.find(farm)) == [('a', CLONE)]
+
+    def test_bad_gitfile(self, tmpdir):
+        d = tmpdir.mkdir('x')
+        d.join('.git').write('garbage')
+        assert list(RepoFinder().find(str(tmpdir))) == []
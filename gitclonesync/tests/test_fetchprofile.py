@@ -0,0 +1,242 @@
+from gitclonesync.fetchprofile import (FetchProfile, parse_profile_config, reader_config_items, profile_config,
+                                       select_profile, PROFILE_CONFIG_ARGS)
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.subprocengine import CLONE_CONFIG_ARGS
+from gitclonesync.tests.conftest import run_git
+
+from mock import patch
+import git
+import logging
+import os
+import pytest
+
+ENGINES = [{'engine': 'gitpython'}, {'engine': 'subprocess'}]
+
+CONFIG_OUTPUT = '\0'.join([
+    'gitclonesync-profile.huge.filter\nblob:none',
+    'gitclonesync-profile.huge.depth\n50',
+    'gitclonesync-profile.huge.refspec\n+refs/heads/master:refs/remotes/{remote}/master',
+    'gitclonesync-profile.huge.tags\nfalse',
+    'gitclonesync-profile.huge.match\ngit@github.com:big-org/*',
+    'gitclonesync-profile.v1.0.filter\ntree:0',
+    'gitclonesync-profile.v1.0.match\n*/vendor/*',
+    'remote.upstream.gitclonesyncprofile\nv1.0',
+    'remote.origin.promisor\ntrue',
+    'gitclonesync.profile\nhuge',
+    '',
+])
+
+
+def test_parse_profile_config():
+    profiles, repo_profile, remotes = parse_profile_config(CONFIG_OUTPUT)
+    assert sorted(profiles) == ['huge', 'v1.0']
+    huge = profiles['huge']
+    assert huge.filter == 'blob:none'
+    assert huge.depth == 50
+    assert huge.refspecs == ['+refs/heads/master:refs/remotes/{remote}/master']
+    assert huge.tags is False
+    assert huge.matches == ['git@github.com:big-org/*']
+    assert profiles['v1.0'].filter == 'tree:0'
+    assert repo_profile == 'huge'
+    assert remotes == {'upstream': {'gitclonesyncprofile': 'v1.0'}, 'origin': {'promisor': 'true'}}
+    assert parse_profile_config('') == ({}, None, {})
+
+
+def test_parse_profile_config_bad_depth(caplog):
+    output = '\0'.join(['gitclonesync-profile.huge.depth\nfifty', 'gitclonesync-profile.huge.filter\nblob:none', ''])
+    profiles, _, _ = parse_profile_config(output)
+    assert profiles['huge'].depth is None
+    assert profiles['huge'].filter == 'blob:none'
+    assert ["Ignoring gitclonesync-profile.huge.depth: 'fifty' is not a number"] == [
+        r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+
+
+def test_fetch_args():
+    p = FetchProfile('huge', filter='blob:none', depth=50, tags=False,
+                     refspecs=['+refs/heads/master:refs/remotes/{remote}/master'])
+    assert p.fetch_args('origin') == ['--filter=blob:none', '--depth=50', '--no-tags', 'origin',
+                                      '+refs/heads/master:refs/remotes/origin/master']
+    assert FetchProfile('all', tags=True).fetch_args('origin') == ['--tags', 'origin']
+    assert FetchProfile('none').fetch_args('origin') == ['origin']
+
+
+def test_conversion_args():
+    p = FetchProfile('huge', filter='blob:none')
+    assert p.conversion_args('origin', {}) == [['config', 'remote.origin.promisor', 'true'],
+                                               ['config', 'remote.origin.partialclonefilter', 'blob:none']]
+    assert p.conversion_args('origin', {'promisor': 'true', 'partialclonefilter': 'blob:none'}) == []
+    assert p.conversion_args('origin', {'promisor': 'true', 'partialclonefilter': 'tree:0'}) == [
+        ['config', 'remote.origin.partialclonefilter', 'blob:none']]
+    assert FetchProfile('shallow', depth=1).conversion_args('origin', {}) == []
+
+
+def test_select_profile():
+    profiles, repo_profile, remotes = parse_profile_config(CONFIG_OUTPUT)
+    # remote setting, then the clone's, then match globs
+    assert select_profile(profiles, repo_profile, remotes, 'upstream', 'x', '/p').name == 'v1.0'
+    assert select_profile(profiles, repo_profile, remotes, 'origin', 'x', '/p').name == 'huge'
+    assert select_profile(profiles, None, remotes, 'origin', 'git@github.com:big-org/a.git', '/p').name == 'huge'
+    assert select_profile(profiles, None, remotes, 'origin', 'x', '/src/vendor/lib').name == 'v1.0'
+    assert select_profile(profiles, None, remotes, 'origin', 'git@github.com:me/a.git', '/p') is None
+    with pytest.raises(ValueError):
+        select_profile(profiles, 'missing', remotes, 'origin', 'x', '/p')
+
+
+def test_profile_config_args(gitfactory):
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'gitclonesync-profile.Big.filter', 'blob:none')
+    run_git(path, 'config', 'remote.origin.gitclonesyncProfile', 'Big')
+    run_git(path, 'config', 'gitclonesync.profile', 'Big')
+    profiles, repo_profile, remotes = parse_profile_config(run_git(path, *PROFILE_CONFIG_ARGS))
+    assert profiles['Big'].filter == 'blob:none'
+    assert repo_profile == 'Big'
+    assert remotes == {'origin': {'gitclonesyncprofile': 'Big'}}
+
+
+def test_reader_config_items(gitfactory):
+    """ GitPython's config reader and ``git config`` give the same profiles """
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'gitclonesync-profile.Big.filter', 'blob:none')
+    run_git(path, 'config', 'gitclonesync-profile.Big.Depth', '5')
+    run_git(path, 'config', '--add', 'gitclonesync-profile.Big.match', '*/a')
+    run_git(path, 'config', '--add', 'gitclonesync-profile.Big.match', '*/b')
+    run_git(path, 'config', 'remote.origin.gitclonesyncProfile', 'Big')
+    run_git(path, 'config', 'gitclonesync.profile', 'Big')
+    items = reader_config_items(git.Repo(path).config_reader())
+    if items is None:
+        pytest.skip('GitPython config reader does not return multi-valued keys')
+    profiles, repo_profile, remotes = profile_config(items)
+    expected = parse_profile_config(run_git(path, *PROFILE_CONFIG_ARGS))
+    assert (sorted(profiles), repo_profile, remotes) == (sorted(expected[0]), expected[1], expected[2])
+    assert vars(profiles['Big']) == vars(expected[0]['Big'])
+    assert profiles['Big'].matches == ['*/a', '*/b']
+    assert profiles['Big'].depth == 5
+
+
+def test_clone_config_args(gitfactory):
+    """ the subprocess engine reads remotes and profile settings at once """
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'gitclonesync-profile.Big.filter', 'blob:none')
+    run_git(path, 'config', 'remote.origin.gitclonesyncProfile', 'Big')
+    profiles, repo_profile, remotes = parse_profile_config(run_git(path, *CLONE_CONFIG_ARGS))
+    assert profiles['Big'].filter == 'blob:none'
+    assert remotes == {'origin': {'gitclonesyncprofile': 'Big'}}
+
+
+def test_no_config_subprocess(gitfactory):
+    """ the GitPython engine reads profiles without running ``git config`` """
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'gitclonesync-profile.tagless.tags', 'false')
+    run_git(path, 'config', 'gitclonesync.profile', 'tagless')
+    if reader_config_items(git.Repo(path).config_reader()) is None:
+        pytest.skip('GitPython config reader does not return multi-valued keys')
+    sha = gitfactory.push_commit(bare)
+    with patch('git.Git.execute', autospec=True, side_effect=git.Git.execute) as mock_exec:
+        CloneSyncer(path, disable_github=True).run()
+    assert run_git(path, 'rev-parse', 'origin/master') == sha
+    commands = [c[0][1] for c in mock_exec.call_args_list]
+    assert [c for c in commands if 'config' in c] == []
+    assert [c for c in commands if 'fetch' in c and '--no-tags' in c]
+
+
+def _big_blob(gitfactory, bare):
+    """ push a commit adding a large file, then one deleting it; return the file's blob sha """
+    work = bare + '-push'
+    gitfactory.push_commit(bare)
+    with open(os.path.join(work, 'big'), 'wb') as fh:
+        fh.write(os.urandom(1024 * 1024))
+    run_git(work, 'add', 'big')
+    run_git(work, 'commit', '-q', '-m', 'add big')
+    blob = run_git(work, 'rev-parse', 'HEAD:big')
+    run_git(work, 'rm', '-q', 'big')
+    run_git(work, 'commit', '-q', '-m', 'remove big')
+    run_git(work, 'push', '-q', 'origin', 'master')
+    return blob, run_git(work, 'rev-parse', 'HEAD')
+
+
+@pytest.mark.parametrize('kwargs', ENGINES)
+def test_blobless_profile(gitfactory, kwargs):
+    bare = gitfactory.bare('a')
+    run_git(bare, 'config', 'uploadpack.allowFilter', 'true')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    full = gitfactory.clone(bare, os.path.join(gitfactory.root, 'full'))
+    run_git(path, 'config', 'gitclonesync-profile.huge.filter', 'blob:none')
+    run_git(path, 'config', 'gitclonesync.profile', 'huge')
+    blob, sha = _big_blob(gitfactory, bare)
+    CloneSyncer(path, disable_github=True, **kwargs).run()
+    CloneSyncer(full, disable_github=True, **kwargs).run()
+    assert run_git(path, 'rev-parse', 'origin/master') == sha
+    assert run_git(path, 'rev-parse', 'HEAD') == sha
+    assert run_git(path, 'config', 'remote.origin.promisor') == 'true'
+    assert run_git(path, 'config', 'remote.origin.partialclonefilter') == 'blob:none'
+    # the deleted file's blob was never fetched; the unprofiled clone has it
+    missing = run_git(path, 'rev-list', '--objects', '--missing=print', 'origin/master').splitlines()
+    assert '?' + blob in missing
+    assert run_git(full, 'cat-file', '-t', blob) == 'blob'
+    # the partial clone keeps working
+    sha = gitfactory.push_commit(bare, fname='again')
+    CloneSyncer(path, disable_github=True, **kwargs).run()
+    assert run_git(path, 'rev-parse', 'HEAD') == sha
+
+
+@pytest.mark.parametrize('kwargs', ENGINES)
+def test_depth_profile(gitfactory, kwargs):
+    bare = gitfactory.bare('a', commits=5)
+    path = os.path.join(gitfactory.root, 'a')
+    run_git(gitfactory.root, 'clone', '-q', '--depth', '1', 'file://' + bare, path)
+    run_git(path, 'config', 'gitclonesync-profile.shallow.depth', '1')
+    run_git(path, 'config', 'remote.origin.gitclonesyncProfile', 'shallow')
+    sha = gitfactory.push_commit(bare)
+    CloneSyncer(path, disable_github=True, **kwargs).run()
+    assert run_git(path, 'rev-parse', 'origin/master') == sha
+    assert run_git(path, 'rev-list', '--count', 'origin/master') == '1'
+    with open(os.path.join(path, '.git', 'shallow')) as fh:
+        assert sha in fh.read().split()
+
+
+@pytest.mark.parametrize('kwargs', ENGINES)
+def test_refspec_profile(gitfactory, kwargs):
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'gitclonesync-profile.master.refspec',
+            '+refs/heads/master:refs/remotes/{remote}/master')
+    run_git(path, 'config', 'gitclonesync-profile.master.match', bare)
+    gitfactory.push_commit(bare, branch='master')
+    work = bare + '-push'
+    run_git(work, 'checkout', '-q', '-b', 'other')
+    run_git(work, 'push', '-q', 'origin', 'other')
+    sha = gitfactory.push_commit(bare)
+    CloneSyncer(path, disable_github=True, **kwargs).run()
+    assert run_git(path, 'rev-parse', 'origin/master') == sha
+    refs = run_git(path, 'for-each-ref', '--format=%(refname)', 'refs/remotes/origin').splitlines()
+    assert 'refs/remotes/origin/other' not in refs
+
+
+@pytest.mark.parametrize('kwargs', ENGINES)
+def test_undefined_profile(gitfactory, kwargs, caplog):
+    """ a remote naming a profile that isn't defined is fetched normally """
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'remote.origin.gitclonesyncProfile', 'missing')
+    sha = gitfactory.push_commit(bare)
+    CloneSyncer(path, disable_github=True, **kwargs).run()
+    assert run_git(path, 'rev-parse', 'origin/master') == sha
+    assert any("fetch profile 'missing' is not defined" in r.getMessage() for r in caplog.records)
+
+
+@pytest.mark.parametrize('kwargs', ENGINES)
+def test_dryrun_profile(gitfactory, kwargs, caplog):
+    caplog.set_level(logging.INFO)
+    bare = gitfactory.bare('a')
+    run_git(bare, 'config', 'uploadpack.allowFilter', 'true')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'config', 'gitclonesync-profile.huge.filter', 'blob:none')
+    run_git(path, 'config', 'gitclonesync.profile', 'huge')
+    CloneSyncer(path, disable_github=True, dryrun=True, **kwargs).run()
+    with pytest.raises(Exception):
+        run_git(path, 'config', 'remote.origin.promisor')
+    assert any('would convert remote' in r.getMessage() for r in caplog.records)
@@ -0,0 +1,302 @@
+from gitclonesync.githubapi import GitHubAPI, GitHubAPIError, HTTPCache, parse_github_url
+from gitclonesync.githubclone import GitHubClone, GitHubKeyError, get_token, parent_url
+
+from mock import patch, MagicMock
+import json
+import pytest
+import subprocess
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+try:
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from urllib.parse import urlparse, parse_qs
+
+
+class StubGitHub:
+    """
+    a local HTTP server standing in for the GitHub API; ``responses`` maps
+    (method, path) to a list of (status, headers, body) returned in turn
+    (the last one repeating), and ``requests`` records what was received
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                headers = dict((k.lower(), v) for k, v in self.headers.items())
+                stub.requests.append((self.command, self.path, headers, body))
+                queue = stub.responses.get((self.command, self.path),
+                                           stub.responses.get((self.command, self.path.split('?')[0]),
+                                                              [(404, {}, {'message': 'Not Found'})]))
+                status, headers, payload = queue.pop(0) if len(queue) > 1 else queue[0]
+                if callable(payload):
+                    status, headers, payload = payload(self.headers, body)
+                data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{p}'.format(p=self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    s = StubGitHub()
+    yield s
+    s.stop()
+
+
+def test_parse_github_url():
+    assert parse_github_url('git@github.com:foo/bar.git') == 'foo/bar'
+    assert parse_github_url('https://github.com/foo/bar') == 'foo/bar'
+    assert parse_github_url('https://user@github.com/foo/bar.git/') == 'foo/bar'
+    assert parse_github_url('ssh://git@github.com:22/foo/bar.git') == 'foo/bar'
+    assert parse_github_url('git://github.com/foo/bar.git') == 'foo/bar'
+    assert parse_github_url('git@gitlab.com:foo/bar.git') is None
+    assert parse_github_url('/srv/git/foo/bar.git') is None
+    assert parse_github_url('https://github.com/foo/bar/baz') is None
+    assert parse_github_url('git@ghe.example.com:foo/bar.git', host='ghe.example.com') == 'foo/bar'
+
+
+def test_get_token():
+    with patch('gitclonesync.githubclone.subprocess.check_output') as mock_out:
+        mock_out.return_value = b'abc123\n'
+        assert get_token() == 'abc123'
+        mock_out.side_effect = subprocess.CalledProcessError(1, 'git')
+        with pytest.raises(GitHubKeyError):
+            get_token()
+
+
+def test_githubclone_client(tmpdir):
+    with patch('gitclonesync.githubclone.get_token') as mock_token:
+        mock_token.return_value = 'sekrit'
+        ghc = GitHubClone(api_url='https://ghe.example.com/api/v3', cache_path=str(tmpdir.join('c.json')))
+    assert ghc.client.base_url == 'https://ghe.example.com/api/v3'
+    assert ghc.client.graphql_url == 'https://ghe.example.com/api/graphql'
+    assert ghc.client.session.headers['Authorization'] == 'token sekrit'
+    assert ghc.host == 'ghe.example.com'
+
+
+def test_parent_url():
+    parent = {'nameWithOwner': 'up/a', 'url': 'https://github.com/up/a', 'sshUrl': 'git@github.com:up/a.git'}
+    assert parent_url(parent, 'git@github.com:me/a.git') == 'git@github.com:up/a.git'
+    assert parent_url(parent, 'https://github.com/me/a') == 'https://github.com/up/a.git'
+
+
+def test_find_upstreams():
+    with patch('gitclonesync.githubclone.get_token') as mock_token:
+        mock_token.return_value = 'sekrit'
+        ghc = GitHubClone(cache_path=None)
+    ghc.client = MagicMock(requests_made=1)
+    parent = {'nameWithOwner': 'up/a', 'url': 'https://github.com/up/a', 'sshUrl': 'git@github.com:up/a.git'}
+    ghc.client.get_repositories.return_value = {
+        'me/a': {'nameWithOwner': 'me/a', 'isFork': True, 'parent': parent},
+        'me/b': {'nameWithOwner': 'me/b', 'isFork': False, 'parent': None},
+        'me/gone': None,
+    }
+    res = ghc.find_upstreams({
+        '/src/a': 'git@github.com:Me/a.git',
+        '/src/b': 'https://github.com/me/b',
+        '/src/gone': 'git@github.com:me/gone.git',
+        '/src/elsewhere': 'git@gitlab.com:me/c.git',
+    })
+    assert res == {'/src/a': 'git@github.com:up/a.git'}
+    assert len(ghc.client.get_repositories.mock_calls) == 1
+    assert sorted(ghc.client.get_repositories.call_args[0][0]) == ['Me/a', 'me/b', 'me/gone']
+
+
+class TestGitHubAPI:
+
+    def test_conditional_get(self, stub, tmpdir):
+        cache = str(tmpdir.join('cache.json'))
+
+        def repo(headers, body):
+            if headers.get('If-None-Match') == '"v1"':
+                return 304, {'ETag': '"v1"'}, None
+            return 200, {'ETag': '"v1"', 'X-RateLimit-Remaining': '4999'}, {'full_name': 'foo/bar'}
+
+        stub.responses[('GET', '/repos/foo/bar')] = [(200, {}, repo)]
+        api = GitHubAPI('t0k', base_url=stub.url, cache_path=cache)
+        assert api.get_repository('foo/bar') == {'full_name': 'foo/bar'}
+        assert api.rate_remaining == 4999
+        assert api.get_repository('foo/bar') == {'full_name': 'foo/bar'}
+        assert api.not_modified == 1
+        api.save()
+        # a new client revalidates from the persisted cache
+        api2 = GitHubAPI('t0k', base_url=stub.url, cache_path=cache)
+        assert api2.get_repository('foo/bar') == {'full_name': 'foo/bar'}
+        assert api2.not_modified == 1
+        assert [r[2].get('if-none-match') for r in stub.requests] == [None, '"v1"', '"v1"']
+        assert stub.requests[0][2]['authorization'] == 'token t0k'
+
+    def test_get_error(self, stub):
+        api = GitHubAPI('t0k', base_url=stub.url)
+        with pytest.raises(GitHubAPIError):
+            api.get('repos/no/such')
+
+    def test_rate_limit_backoff(self, stub):
+        reset = str(int(time.time()) + 30)
+        stub.responses[('GET', '/repos/foo/bar')] = [
+            (403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}, {'message': 'rate limited'}),
+            (429, {'Retry-After': '7'}, {'message': 'slow down'}),
+            (502, {}, {'message': 'bad gateway'}),
+            (200, {}, {'full_name': 'foo/bar'}),
+        ]
+        api = GitHubAPI('t0k', base_url=stub.url)
+        with patch('gitclonesync.githubapi.time.sleep') as mock_sleep:
+            assert api.get('repos/foo/bar') == {'full_name': 'foo/bar'}
+        waits = [c[0][0] for c in mock_sleep.call_args_list]
+        assert 25 <= waits[0] <= 30
+        assert waits[1:] == [7, 8]
+        assert api.requests_made == 4
+
+    def test_rate_limit_too_long(self, stub):
+        reset = str(int(time.time()) + 7200)
+        stub.responses[('GET', '/repos/foo/bar')] = [
+            (403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}, {'message': 'rate limited'})]
+        api = GitHubAPI('t0k', base_url=stub.url)
+        with pytest.raises(GitHubAPIError):
+            api.get('repos/foo/bar')
+
+    def test_get_repositories_batched(self, stub):
+        def graphql(headers, body):
+            req = json.loads(body.decode('utf-8'))
+            v = req['variables']
+            data = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': 'x'}}
+            errors = []
+            for key in v:
+                if not key.startswith('o'):
+                    continue
+                j = key[1:]
+                full = '{o}/{n}'.format(o=v['o' + j], n=v['n' + j])
+                if full == 'gone/away':
+                    data['r' + j] = None
+                    errors.append({'type': 'NOT_FOUND', 'path': ['r' + j], 'message': 'nope'})
+                    continue
+                assert 'r{j}: repository(owner: $o{j}, name: $n{j})'.format(j=j) in req['query']
+                data['r' + j] = {'nameWithOwner': full, 'isFork': full.startswith('me/'), 'url': 'u',
+                                 'sshUrl': 's', 'parent': None}
+            return 200, {}, {'data': data, 'errors': errors}
+
+        stub.responses[('POST', '/graphql')] = [(200, {}, graphql)]
+        api = GitHubAPI('t0k', base_url=stub.url, batch_size=2)
+        res = api.get_repositories(['me/a', 'Me/B', 'up/a', 'gone/away', 'me/a'])
+        assert sorted(res) == ['gone/away', 'me/a', 'me/b', 'up/a']
+        assert res['gone/away'] is None
+        assert res['me/b']['isFork'] is True
+        assert res['up/a']['isFork'] is False
+        assert len(stub.requests) == 2
+
+    def test_get_pulls(self, stub):
+        stub.responses[('GET', '/repos/foo/bar/pulls')] = [
+            (200, {}, [{'number': 4}, {'number': 3}]), (200, {}, [{'number': 1}])]
+        api = GitHubAPI('t0k', base_url=stub.url)
+        assert [p['number'] for p in api.get_pulls('foo/bar', per_page=2)] == [4, 3, 1]
+        queries = [parse_qs(urlparse(r[1]).query) for r in stub.requests]
+        assert queries == [{'state': ['open'], 'per_page': ['2'], 'page': [str(p)]} for p in (1, 2)]
+
+    def test_get_pulls_since(self, stub):
+        stub.responses[('GET', '/repos/foo/bar/pulls')] = [
+            (200, {}, [{'number': 7, 'updated_at': '2015-01-03T00:00:00Z'},
+                       {'number': 2, 'updated_at': '2015-01-02T00:00:00Z'}]),
+            (200, {}, [{'number': 5, 'updated_at': '2015-01-01T00:00:00Z'},
+                       {'number': 1, 'updated_at': '2014-12-01T00:00:00Z'}]),
+            (200, {}, []),
+        ]
+        api = GitHubAPI('t0k', base_url=stub.url)
+        res = api.get_pulls('foo/bar', since='2015-01-01T00:00:00Z', per_page=2)
+        assert [p['number'] for p in res] == [7, 2, 5]
+        assert len(stub.requests) == 2
+        query = parse_qs(urlparse(stub.requests[0][1]).query)
+        assert (query['state'], query['sort'], query['direction']) == (['all'], ['updated'], ['desc'])
+
+    def test_graphql_rate_limited(self, stub):
+        stub.responses[('POST', '/graphql')] = [
+            (200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 10)},
+             {'data': None, 'errors': [{'type': 'RATE_LIMITED', 'message': 'limit'}]}),
+            (200, {}, {'data': {'viewer': {'login': 'me'}}}),
+        ]
+        api = GitHubAPI('t0k', base_url=stub.url)
+        with patch('gitclonesync.githubapi.time.sleep') as mock_sleep:
+            data, errors = api.graphql('{ viewer { login } }')
+        assert data == {'viewer': {'login': 'me'}}
+        assert errors == []
+        assert len(mock_sleep.call_args_list) == 1
+
+    def test_graphql_error(self, stub):
+        stub.responses[('POST', '/graphql')] = [(200, {}, {'data': None, 'errors': [{'message': 'bad query'}]})]
+        api = GitHubAPI('t0k', base_url=stub.url)
+        with pytest.raises(GitHubAPIError):
+            api.graphql('{ nope }')
+
+
+def test_http_cache_corrupt(tmpdir):
+    path = tmpdir.join('cache.json')
+    path.write('not json')
+    c = HTTPCache(str(path))
+    assert c.get('http://x') is None
+    c.put('http://x', None, None, {'a': 1})
+    assert c.get('http://x') is None
+    c.put('http://x', '"e"', None, {'a': 1})
+    c.save()
+    assert json.loads(path.read())['http://x']['body'] == {'a': 1}
+
+
+def test_http_cache_save_own_tmp(tmpdir):
+    """ a concurrent run's temporary file is neither written nor renamed into place """
+    path = tmpdir.join('cache.json')
+    other = tmpdir.join('cache.json.tmp')
+    other.write('partial')
+    c = HTTPCache(str(path))
+    c.put('http://x', '"e"', None, {'a': 1})
+    c.save()
+    assert json.loads(path.read())['http://x']['body'] == {'a': 1}
+    assert other.read() == 'partial'
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['cache.json', 'cache.json.tmp']
+
+
+def test_requests_counted_across_threads(stub):
+    stub.responses[('GET', '/repos/foo/bar')] = [(200, {'X-RateLimit-Remaining': '10'}, {'full_name': 'foo/bar'})]
+    api = GitHubAPI('t0k', base_url=stub.url, pool_size=4)
+
+    def get():
+        for _ in range(5):
+            api.get('repos/foo/bar')
+
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert api.requests_made == 20
+    assert api.rate_remaining == 10
@@ -0,0 +1,141 @@
+from gitclonesync.journal import RunJournal, COMPACT_FACTOR
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.timing import RepoTimer
+
+import json
+import os
+import pytest
+import time
+
+
+def result(path, status, phase=None, error=None):
+    timer = RepoTimer(path)
+    if phase is not None:
+        timer.add(phase, 0.1)
+    return SyncResult(path, status, 0.5, error=error, timer=timer)
+
+
+def read_lines(path):
+    with open(path) as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test_record_and_reload(tmpdir):
+    path = str(tmpdir.join('j.jsonl'))
+    j = RunJournal(path)
+    j.record(result('/a', SyncResult.SYNCED, phase='fetch'))
+    j.record(result('/b', SyncResult.FAILED, phase='status', error='boom'))
+    # flushed as written, before the journal is closed
+    lines = read_lines(path)
+    assert [(e['path'], e['status'], e['phase'], e['error']) for e in lines] == [
+        ('/a', 'synced', 'fetch', None), ('/b', 'failed', 'status', 'boom')]
+    j.record(result('/b', SyncResult.SKIPPED))
+    j.close()
+    with open(path, 'a') as fh:
+        fh.write('not json\n')
+    j2 = RunJournal(path)
+    assert j2.latest('/b')['status'] == 'skipped'
+    assert j2.latest('/c') is None
+
+
+def test_selection(tmpdir):
+    j = RunJournal(str(tmpdir.join('j.jsonl')), resume_window=100)
+    j.record(result('/a', SyncResult.SYNCED))
+    j.record(result('/b', SyncResult.SKIPPED))
+    j.record(result('/c', SyncResult.FAILED))
+    assert j.finished_recently('/a') is True
+    assert j.finished_recently('/b') is True
+    assert j.finished_recently('/c') is False
+    assert j.finished_recently('/d') is False
+    assert j.finished_recently('/a', now=time.time() + 200) is False
+    assert [p for p in ('/a', '/b', '/c', '/d') if j.failed(p)] == ['/c']
+
+
+def test_compact(tmpdir):
+    path = str(tmpdir.join('j.jsonl'))
+    j = RunJournal(path)
+    for _ in range(2 * COMPACT_FACTOR):
+        j.record(result('/a', SyncResult.SYNCED))
+    j.record(result('/b', SyncResult.FAILED))
+    j.close()
+    assert len(read_lines(path)) == 2 * COMPACT_FACTOR + 1
+    RunJournal(path)
+    lines = read_lines(path)
+    assert [(e['path'], e['status']) for e in lines] == [('/a', 'synced'), ('/b', 'failed')]
+
+
+@pytest.fixture
+def farm(gitfactory):
+    origin = gitfactory.bare('origin')
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(root)
+    paths = [gitfactory.clone(origin, os.path.join(root, n)) for n in ('a', 'b', 'c')]
+    journal = os.path.join(gitfactory.root, 'journal.jsonl')
+    # as left by a run that synced a, failed b and was killed before c
+    j = RunJournal(journal)
+    j.record(result(paths[0], SyncResult.SYNCED, phase='fetch'))
+    j.record(result(paths[1], SyncResult.FAILED, phase='fetch', error='boom'))
+    j.close()
+    return root, paths, journal
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_resume(farm, engine):
+    root, paths, journal = farm
+    cs = CloneSyncer(root, disable_github=True, engine=engine, jobs=2, journal_path=journal, resume=True)
+    results = cs.run()
+    assert sorted(r.path for r in results) == paths[1:]
+    j = RunJournal(journal)
+    assert [j.finished_recently(p) for p in paths] == [True, True, True]
+
+
+def test_retry_failed(farm):
+    root, paths, journal = farm
+    cs = CloneSyncer(root, disable_github=True, journal_path=journal, retry_failed=True)
+    results = cs.run()
+    assert [r.path for r in results] == [paths[1]]
+    assert RunJournal(journal).failed(paths[1]) is False
+
+
+def test_journal_written_by_full_run(farm):
+    root, paths, journal = farm
+    os.remove(journal)
+    CloneSyncer(root, disable_github=True, processes=2, journal_path=journal).run()
+    lines = read_lines(journal)
+    assert sorted(e['path'] for e in lines) == paths
+    assert set(e['status'] for e in lines) == set([SyncResult.SYNCED])
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'engine': 'gitpython'},
+    {'engine': 'subprocess'},
+    {'engine': 'gitpython', 'processes': 2},
+])
+def test_dryrun_not_journaled(farm, kwargs):
+    root, paths, journal = farm
+    with open(journal, 'a') as fh:
+        for _ in range(2 * COMPACT_FACTOR):
+            fh.write(json.dumps({'path': paths[0], 'status': 'synced', 'time': time.time()}) + '\n')
+    with open(journal) as fh:
+        before = fh.read()
+    CloneSyncer(root, disable_github=True, dryrun=True, journal_path=journal, **kwargs).run()
+    # not recorded, and not compacted
+    with open(journal) as fh:
+        assert fh.read() == before
+    # a dry run can still show what --retry-failed would sync
+    results = CloneSyncer(root, disable_github=True, dryrun=True, journal_path=journal, retry_failed=True).run()
+    assert [r.path for r in results] == [paths[1]]
+
+
+def test_single_clone_journaled(farm):
+    root, paths, journal = farm
+    CloneSyncer(paths[2], disable_github=True, journal_path=journal).run()
+    j = RunJournal(journal)
+    assert j.latest(paths[2])['status'] == SyncResult.SYNCED
+    assert j.latest(paths[2])['phase'] is not None
+
+
+def test_resume_requires_journal():
+    with pytest.raises(ValueError):
+        CloneSyncer('/foo', disable_github=True, resume=True)
@@ -0,0 +1,112 @@
+from gitclonesync.maintenance import (parse_count_objects, count_packs, midx_pack_names, maintenance_reason,
+                                      maintenance_steps, maintenance_summary)
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.tests.conftest import run_git
+
+import os
+import pytest
+
+COUNT_OBJECTS = """count: 12
+size: 48
+in-pack: 30
+packs: 3
+size-pack: 9
+prune-packable: 2
+garbage: 0
+size-garbage: 0
+"""
+
+
+def test_parse_count_objects():
+    counts = parse_count_objects(COUNT_OBJECTS)
+    assert counts['count'] == 12
+    assert counts['packs'] == 3
+    assert counts['prune-packable'] == 2
+    assert parse_count_objects('') == {}
+
+
+def test_thresholds():
+    counts = parse_count_objects(COUNT_OBJECTS)
+    assert maintenance_reason(counts) is None
+    assert maintenance_reason(counts, max_packs=2) == '3 packs'
+    assert maintenance_reason(counts, max_packs=2, max_loose=10) == '3 packs, 12 loose objects'
+    assert [n for n, _ in maintenance_steps(counts, max_loose=10)] == ['repack', 'multi-pack-index', 'commit-graph']
+    # under the thresholds, only loose objects that are already packed are removed
+    assert maintenance_steps(counts) == [('prune-packed', ['prune-packed', '-q'])]
+    counts['prune-packable'] = 0
+    assert maintenance_steps(counts) == []
+    # packs the last maintenance's multi-pack-index covers don't count
+    counts['midx-packs'] = 2
+    assert maintenance_reason(counts, max_packs=2) is None
+    assert maintenance_reason(counts, max_packs=0) == '1 packs not in the multi-pack-index'
+
+
+def test_summary():
+    before = {'packs': 12, 'count': 3000}
+    after = {'packs': 2, 'count': 0}
+    assert maintenance_summary(before, after) == {
+        'packs_before': 12, 'packs_after': 2, 'loose_before': 3000, 'loose_after': 0}
+
+
+@pytest.fixture
+def packed(gitfactory):
+    """ a clone whose origin has gained several commits, each fetched into its own pack """
+    origin = gitfactory.bare('origin')
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(root)
+    path = gitfactory.clone(origin, os.path.join(root, 'a'))
+    run_git(path, 'config', 'fetch.unpackLimit', '1')
+    for i in range(4):
+        gitfactory.push_commit(origin, fname='f{i}'.format(i=i))
+        run_git(path, 'fetch', '-q', 'origin')
+    return root, path
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_maintain(packed, engine):
+    root, path = packed
+    before = parse_count_objects(run_git(path, 'count-objects', '-v'))
+    assert before['packs'] >= 4
+    cs = CloneSyncer(root, disable_github=True, engine=engine, maintenance=True, max_packs=2)
+    results = cs.run()
+    timer = results[0].timer
+    assert timer.maintenance['packs_before'] == before['packs']
+    assert timer.maintenance['packs_after'] < before['packs']
+    assert [p['phase'] for p in timer.phases if p['phase'] in ('repack', 'multi-pack-index', 'commit-graph')] == [
+        'repack', 'multi-pack-index', 'commit-graph']
+    assert os.path.exists(os.path.join(path, '.git', 'objects', 'pack', 'multi-pack-index'))
+    assert os.path.isdir(os.path.join(path, '.git', 'objects', 'info', 'commit-graphs'))
+    assert run_git(path, 'fsck', '--connectivity-only') == ''
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_maintain_under_threshold_and_dryrun(packed, engine):
+    root, path = packed
+    packs = parse_count_objects(run_git(path, 'count-objects', '-v'))['packs']
+    for cs in (CloneSyncer(root, disable_github=True, engine=engine, maintenance=True, max_packs=100),
+               CloneSyncer(root, disable_github=True, engine=engine, maintenance=True, max_packs=2, dryrun=True)):
+        timer = cs.run()[0].timer
+        assert timer.maintenance is None
+        assert 'repack' not in [p['phase'] for p in timer.phases]
+        assert parse_count_objects(run_git(path, 'count-objects', '-v'))['packs'] == packs
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_maintain_not_repeated(gitfactory, packed, engine):
+    """ packs left by the last maintenance don't trigger another, however many there are """
+    root, path = packed
+    git_dir = os.path.join(path, '.git')
+    assert midx_pack_names(git_dir) == set()
+    CloneSyncer(root, disable_github=True, engine=engine, maintenance=True, max_packs=2).run()
+    idx = set(n for n in os.listdir(os.path.join(git_dir, 'objects', 'pack')) if n.endswith('.idx'))
+    assert midx_pack_names(git_dir) == idx
+    counts = count_packs(parse_count_objects(run_git(path, 'count-objects', '-v')), git_dir)
+    assert counts['midx-packs'] == counts['packs'] == len(idx)
+    timer = CloneSyncer(root, disable_github=True, engine=engine, maintenance=True, max_packs=0).run()[0].timer
+    assert timer.maintenance is None
+    assert 'repack' not in [p['phase'] for p in timer.phases]
+    # a newly fetched pack isn't covered, so it does
+    gitfactory.push_commit(os.path.join(gitfactory.root, 'remotes', 'origin.git'), fname='new')
+    run_git(path, 'fetch', '-q', 'origin')
+    timer = CloneSyncer(root, disable_github=True, engine=engine, maintenance=True, max_packs=0).run()[0].timer
+    assert timer.maintenance['packs_before'] == len(idx) + 1
@@ -0,0 +1,189 @@
+from gitclonesync.procpool import ProcessPoolRunner
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.prrefs import PRState, PR_STATE_FILE
+from gitclonesync.refcache import RefCache
+from gitclonesync.scheduler import HostLimiter, SharedHostLimiter, SyncResult
+from gitclonesync.timing import RepoTimer
+
+import logging
+import multiprocessing
+import os
+import pytest
+import time
+
+
+class FakeSyncer:
+    """ just enough of a CloneSyncer for ProcessPoolRunner; forked, so needn't pickle """
+
+    def __init__(self, do_git_dir, ref_cache=None, max_per_host=None):
+        self.logger = logging.getLogger('FakeSyncer')
+        self.ref_cache = ref_cache
+        self.journal = None
+        self.pr_plans = {}
+        self.host_limiter = HostLimiter(max_per_host)
+        self._do = do_git_dir
+
+    def _do_git_dir(self, path, timer=None):
+        return self._do(self, path, timer)
+
+
+def by_path(results):
+    return dict((r.path, r) for r in results)
+
+
+def test_results_and_warnings(caplog):
+    def do(syncer, path, timer):
+        timer.add('fetch', 0.5, remote='origin')
+        timer.add_fetch('origin', 3, 300)
+        syncer.logger.info("synced {p}".format(p=path))
+        syncer.logger.warning("warned {p} in pid {pid}".format(p=path, pid=os.getpid()))
+        if path == '/c':
+            raise RuntimeError('boom')
+        return path != '/b'
+
+    caplog.set_level(logging.INFO)
+    runner = ProcessPoolRunner(FakeSyncer(do), processes=2)
+    results = by_path(runner.run(['/a', '/b', '/c']))
+    assert results['/a'].status == SyncResult.SYNCED
+    assert results['/b'].status == SyncResult.SKIPPED
+    assert results['/c'].status == SyncResult.FAILED
+    assert results['/c'].error == 'boom'
+    assert results['/a'].timer.fetches == {'origin': {'objects': 3, 'bytes': 300}}
+    assert results['/a'].timer.total() == 0.5
+    msgs = [r.getMessage() for r in caplog.records if r.name == 'FakeSyncer']
+    # only warnings and errors come back from the workers
+    assert len(msgs) == 4
+    assert not any(m.startswith('synced') for m in msgs)
+    assert "Error syncing /c: boom" in msgs
+    # the work really happened in other processes
+    assert not any(m.endswith('pid {p}'.format(p=os.getpid())) for m in msgs)
+    assert runner.respawned == 0
+
+
+def test_crash_and_timeout():
+    def do(syncer, path, timer):
+        if path == '/crash':
+            os._exit(3)
+        if path == '/hang':
+            time.sleep(60)
+        return True
+
+    runner = ProcessPoolRunner(FakeSyncer(do), processes=2, timeout=1)
+    start = time.time()
+    results = by_path(runner.run(['/crash', '/hang', '/a', '/b']))
+    assert time.time() - start < 30
+    assert sorted(results) == ['/a', '/b', '/crash', '/hang']
+    assert results['/crash'].status == SyncResult.FAILED
+    assert results['/crash'].error == 'worker process exited with code 3'
+    assert results['/hang'].status == SyncResult.FAILED
+    assert results['/hang'].error == 'timed out after 1s'
+    assert results['/a'].status == SyncResult.SYNCED
+    assert results['/b'].status == SyncResult.SYNCED
+    assert runner.respawned == 2
+
+
+def test_host_cap_shared_across_processes():
+    active = multiprocessing.Value('i', 0)
+    peak = multiprocessing.Value('i', 0)
+
+    def do(syncer, path, timer):
+        with syncer.host_limiter.limit('git@example.com:' + path):
+            if path == '/hang':
+                time.sleep(60)
+            with active.get_lock():
+                active.value += 1
+                peak.value = max(peak.value, active.value)
+            time.sleep(0.2)
+            with active.get_lock():
+                active.value -= 1
+        return True
+
+    syncer = FakeSyncer(do, max_per_host=1)
+    limiter = syncer.host_limiter
+    runner = ProcessPoolRunner(syncer, processes=3, timeout=2)
+    results = by_path(runner.run(['/a', '/b', '/c']))
+    assert set(r.status for r in results.values()) == set([SyncResult.SYNCED])
+    assert peak.value == 1
+    assert syncer.host_limiter is limiter
+    # /hang holds the host's only slot until it is killed; the slot must be given back
+    syncer.host_limiter = SharedHostLimiter(1)
+    results = by_path(ProcessPoolRunner(syncer, processes=2, timeout=1).run(['/hang']))
+    assert results['/hang'].error == 'timed out after 1s'
+    i = syncer.host_limiter._stripe('example.com')
+    assert syncer.host_limiter._stripes[i].acquire(False)
+
+
+def test_pr_plans_sent_to_workers(tmpdir):
+    """ pull request plans made after the workers were forked reach them with each path """
+    def do(syncer, path, timer):
+        state, plans = syncer.pr_plans[path]
+        assert plans == ['plan' + path]
+        assert state.path == str(tmpdir.join(path.strip('/'), PR_STATE_FILE))
+        return True
+
+    syncer = FakeSyncer(do)
+
+    def planned(paths):
+        for path in paths:
+            syncer.pr_plans[path] = (PRState(str(tmpdir.join(path.strip('/')))), ['plan' + path])
+            yield path
+
+    results = by_path(ProcessPoolRunner(syncer, processes=2).run(planned(['/a', '/b', '/c'])))
+    assert set(r.status for r in results.values()) == set([SyncResult.SYNCED])
+
+
+def test_ref_cache_changes(tmpdir):
+    def do(syncer, path, timer):
+        syncer.ref_cache.update('url' + path, path + '/.git', 'h')
+        syncer.ref_cache.record_avoided()
+        return True
+
+    rc = RefCache(str(tmpdir.join('c.json')))
+    runner = ProcessPoolRunner(FakeSyncer(do, ref_cache=rc), processes=2)
+    runner.run(['/a', '/b'])
+    assert rc.is_current('url/a', '/a/.git', 'h') is True
+    assert rc.is_current('url/b', '/b/.git', 'h') is True
+    assert rc.avoided == 2
+    assert rc.pop_changes() == []
+
+
+def test_apply_changes(tmpdir):
+    worker = RefCache(str(tmpdir.join('c.json')))
+    worker.update('u', '/a/.git', 'h1')
+    worker.update('v', '/b/.git', 'h2')
+    worker.invalidate('v')
+    changes = worker.pop_changes()
+    assert worker.pop_changes() == []
+    parent = RefCache(str(tmpdir.join('c.json')))
+    parent.apply_changes(changes, avoided=3)
+    assert parent.is_current('u', '/a/.git', 'h1') is True
+    assert sorted(parent._data) == ['u']
+    assert parent.avoided == 3
+
+
+def test_timer_from_dict():
+    t = RepoTimer('/r/a')
+    t.add('status', 0.5)
+    t.add('fetch', 1.0, remote='origin')
+    t.add_fetch('origin', 10, 2048)
+    t2 = RepoTimer.from_dict(t.as_dict())
+    assert t2.as_dict() == t.as_dict()
+
+
+def test_clonesyncer_processes(gitfactory):
+    origin = gitfactory.bare('origin')
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(root)
+    for name in ('a', 'b', 'c'):
+        gitfactory.clone(origin, os.path.join(root, name))
+    gitfactory.push_commit(origin)
+    cs = CloneSyncer(root, disable_github=True, processes=2, repo_timeout=60)
+    results, elapsed = cs.sync_paths(cs.discover())
+    assert sorted(r.path for r in results) == [os.path.join(root, n) for n in ('a', 'b', 'c')]
+    assert set(r.status for r in results) == set([SyncResult.SYNCED])
+    assert all(r.timer.fetches['origin']['objects'] > 0 for r in results)
+
+
+def test_clonesyncer_processes_subprocess_engine():
+    with pytest.raises(ValueError):
+        CloneSyncer('/foo', disable_github=True, engine='subprocess', processes=2)
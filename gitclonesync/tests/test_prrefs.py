@@ -0,0 +1,158 @@
+from gitclonesync.prrefs import (PRState, PRPlan, plan_pr_refs, pr_branch, pr_fetch_args, pr_delete_args,
+                                 PR_STATE_FILE)
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import HostLimiter
+from gitclonesync.tests.conftest import run_git
+
+from mock import patch, call, MagicMock
+import json
+import os
+import pytest
+
+
+def test_pr_args():
+    assert pr_branch('upstream', 12) == 'upstream-pr/12'
+    assert pr_fetch_args('upstream', [1, 12]) == [
+        'fetch', '--no-tags', 'upstream',
+        '+refs/pull/1/head:refs/remotes/upstream-pr/1', '+refs/pull/12/head:refs/remotes/upstream-pr/12']
+    assert pr_delete_args('origin', [3]) == ['branch', '--quiet', '-D', '-r', 'origin-pr/3']
+
+
+def test_plan_first_run():
+    client = MagicMock()
+    client.get_pulls.return_value = [{'number': 5, 'state': 'open'}, {'number': 2, 'state': 'open'}]
+    plan = plan_pr_refs(client, 'origin', 'me/a', None, now=1420167845)
+    assert client.get_pulls.mock_calls == [call('me/a')]
+    assert plan.since == '2015-01-02T02:59:05Z'
+    assert (plan.fetch, plan.prune, plan.open) == ([2, 5], [], set([2, 5]))
+
+
+def test_plan_incremental():
+    client = MagicMock()
+    client.get_pulls.return_value = [
+        {'number': 9, 'state': 'open'}, {'number': 5, 'state': 'closed'}, {'number': 7, 'state': 'closed'},
+        {'number': 2, 'state': 'open'}]
+    entry = {'repo': 'Me/A', 'since': '2015-01-01T00:00:00Z', 'prs': [2, 3, 5]}
+    plan = plan_pr_refs(client, 'origin', 'me/a', entry)
+    assert client.get_pulls.mock_calls == [call('me/a', since='2015-01-01T00:00:00Z')]
+    assert (plan.fetch, plan.prune, plan.open) == ([2, 9], [5], set([2, 3, 9]))
+
+
+def test_plan_repo_changed():
+    client = MagicMock()
+    client.get_pulls.return_value = [{'number': 3, 'state': 'open'}]
+    entry = {'repo': 'old/name', 'since': '2015-01-01T00:00:00Z', 'prs': [1, 3]}
+    plan = plan_pr_refs(client, 'origin', 'me/a', entry)
+    assert client.get_pulls.mock_calls == [call('me/a')]
+    assert (plan.fetch, plan.prune) == ([3], [1])
+
+
+def test_state(tmpdir):
+    state = PRState(str(tmpdir))
+    assert state.get('origin') is None
+    state.update(PRPlan('origin', 'me/a', '2015-01-02T00:00:00Z', set([4, 1]), [1, 4], []))
+    state.save()
+    assert PRState(str(tmpdir)).get('origin') == {'repo': 'me/a', 'since': '2015-01-02T00:00:00Z', 'prs': [1, 4]}
+    tmpdir.join(PR_STATE_FILE).write('{')
+    assert PRState(str(tmpdir)).remotes == {}
+
+
+def test_state_save_own_tmp(tmpdir):
+    """ a concurrent run's temporary file is neither written nor renamed into place """
+    other = tmpdir.join(PR_STATE_FILE + '.tmp')
+    other.write('partial')
+    state = PRState(str(tmpdir))
+    state.update(PRPlan('origin', 'me/a', 'T1', set([1]), [1], []))
+    state.save()
+    assert PRState(str(tmpdir)).get('origin')['prs'] == [1]
+    assert other.read() == 'partial'
+    assert sorted(p.basename for p in tmpdir.listdir()) == sorted([PR_STATE_FILE, PR_STATE_FILE + '.tmp'])
+
+
+@pytest.fixture
+def pulls(gitfactory):
+    """ a clone of a bare repo that has refs/pull/<N>/head for pull requests 1, 2 and 3 """
+    origin = gitfactory.bare('origin', branches=('master', 'pr1', 'pr2', 'pr3'))
+    for n in (1, 2, 3):
+        run_git(origin, 'update-ref', 'refs/pull/{n}/head'.format(n=n), 'pr{n}'.format(n=n))
+        run_git(origin, 'branch', '-D', 'pr{n}'.format(n=n))
+    path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+    return path
+
+
+def pr_refs(path):
+    return run_git(path, 'for-each-ref', '--format=%(refname)', 'refs/remotes/origin-pr/').splitlines()
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_fetch_and_prune(pulls, engine):
+    git_dir = os.path.join(pulls, '.git')
+    cs = CloneSyncer(pulls, disable_github=True, engine=engine)
+    cs.pr_plans[pulls] = (PRState(git_dir), [PRPlan('origin', 'me/a', 'T1', set([1, 2]), [1, 2], [])])
+    cs.run()
+    assert pr_refs(pulls) == ['refs/remotes/origin-pr/1', 'refs/remotes/origin-pr/2']
+    with open(os.path.join(git_dir, PR_STATE_FILE)) as fh:
+        assert json.load(fh) == {'origin': {'repo': 'me/a', 'since': 'T1', 'prs': [1, 2]}}
+    # a prune-only plan, as when pull request 1 is closed; a normal fetch with --prune leaves the others alone
+    run_git(pulls, 'config', 'fetch.prune', 'true')
+    cs.pr_plans[pulls] = (PRState(git_dir), [PRPlan('origin', 'me/a', 'T2', set([2]), [], [1])])
+    cs.run()
+    assert pr_refs(pulls) == ['refs/remotes/origin-pr/2']
+    assert PRState(git_dir).get('origin')['since'] == 'T2'
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_prune_remotes_packed(pulls, engine):
+    """ closed pull requests of several remotes are all pruned, their refs being packed """
+    run_git(pulls, 'remote', 'add', 'fork', run_git(pulls, 'config', 'remote.origin.url'))
+    git_dir = os.path.join(pulls, '.git')
+    cs = CloneSyncer(pulls, disable_github=True, engine=engine)
+    cs.pr_plans[pulls] = (PRState(git_dir), [PRPlan('origin', 'me/a', 'T1', set([1, 2]), [1, 2], []),
+                                             PRPlan('fork', 'you/a', 'T1', set([1, 2]), [1, 2], [])])
+    cs.run()
+    assert len(run_git(pulls, 'for-each-ref', 'refs/remotes/fork-pr/').splitlines()) == 2
+    run_git(pulls, 'pack-refs', '--all')
+    cs.pr_plans[pulls] = (PRState(git_dir), [PRPlan('origin', 'me/a', 'T2', set([2]), [], [1]),
+                                             PRPlan('fork', 'you/a', 'T2', set(), [], [1, 2])])
+    cs.run()
+    assert pr_refs(pulls) == ['refs/remotes/origin-pr/2']
+    assert run_git(pulls, 'for-each-ref', 'refs/remotes/fork-pr/') == ''
+
+
+def test_fetch_host_limited(pulls):
+    cs = CloneSyncer(pulls, disable_github=True)
+    cs.host_limiter = MagicMock(wraps=HostLimiter(4))
+    cs.pr_plans[pulls] = (PRState(os.path.join(pulls, '.git')), [PRPlan('origin', 'me/a', 'T1', set([1]), [1], [])])
+    cs.run()
+    assert pr_refs(pulls) == ['refs/remotes/origin-pr/1']
+    url = run_git(pulls, 'config', 'remote.origin.url')
+    # the remote's own fetch, then the pull request fetch
+    assert cs.host_limiter.limit.mock_calls == [call(url), call(url)]
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_fetch_dryrun(pulls, engine):
+    cs = CloneSyncer(pulls, disable_github=True, engine=engine, dryrun=True)
+    cs.pr_plans[pulls] = (PRState(os.path.join(pulls, '.git')), [PRPlan('origin', 'me/a', 'T1', set([1]), [1], [])])
+    cs.run()
+    assert pr_refs(pulls) == []
+    assert not os.path.exists(os.path.join(pulls, '.git', PR_STATE_FILE))
+
+
+def test_plan_pr_refs(pulls):
+    run_git(pulls, 'remote', 'set-url', 'origin', 'git@github.com:me/a.git')
+    run_git(pulls, 'remote', 'add', 'local', '/srv/git/b.git')
+    with patch('gitclonesync.githubclone.GitHubClone', autospec=True):
+        cs = CloneSyncer(pulls, pr_refs=True, jobs=2)
+    cs.gh.host = 'github.com'
+    cs.gh.client = MagicMock(requests_made=1)
+    cs.gh.client.get_pulls.return_value = [{'number': 3, 'state': 'open'}]
+    cs._plan_pr_refs({pulls: cs._remote_urls(pulls)})
+    state, plans = cs.pr_plans[pulls]
+    assert state.path == os.path.join(pulls, '.git', PR_STATE_FILE)
+    assert [(p.remote, p.full_name, p.fetch) for p in plans] == [('origin', 'me/a', [3])]
+
+
+def test_pr_refs_requires_github():
+    cs = CloneSyncer('/foo', disable_github=True, pr_refs=True)
+    assert cs.pr_refs is False
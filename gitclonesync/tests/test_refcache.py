@@ -0,0 +1,63 @@
+from gitclonesync.refcache import RefCache, ref_fingerprint
+
+from mock import patch
+import json
+
+
+class TestRefFingerprint:
+
+    def test_order_and_whitespace_insensitive(self):
+        a = 'aaa\trefs/heads/master\nbbb\trefs/tags/v1\n'
+        b = '\nbbb\trefs/tags/v1\naaa\trefs/heads/master'
+        assert ref_fingerprint(a) == ref_fingerprint(b)
+
+    def test_changes(self):
+        assert ref_fingerprint('aaa\trefs/heads/master') != ref_fingerprint('aab\trefs/heads/master')
+
+
+class TestRefCache:
+
+    def test_missing_file(self, tmpdir):
+        rc = RefCache(str(tmpdir.join('nope.json')))
+        assert rc._data == {}
+        assert rc.is_current('u', '/c/.git', 'h') is False
+
+    def test_corrupt_file(self, tmpdir):
+        p = tmpdir.join('bad.json')
+        p.write('{not json')
+        assert RefCache(str(p))._data == {}
+
+    def test_update_is_current(self, tmpdir):
+        rc = RefCache(str(tmpdir.join('c.json')), max_age=100)
+        with patch('gitclonesync.refcache.time.time') as mock_time:
+            mock_time.return_value = 1000.0
+            rc.update('u', '/a/.git', 'h1')
+            assert rc.is_current('u', '/a/.git', 'h1') is True
+            # different clone of the same URL has not fetched yet
+            assert rc.is_current('u', '/b/.git', 'h1') is False
+            assert rc.is_current('u', '/a/.git', 'h2') is False
+            mock_time.return_value = 1100.0
+            assert rc.is_current('u', '/a/.git', 'h1') is False
+
+    def test_invalidate(self, tmpdir):
+        rc = RefCache(str(tmpdir.join('c.json')))
+        rc.update('u', '/a/.git', 'h1')
+        rc.update('u', '/b/.git', 'h1')
+        rc.invalidate('u', '/a/.git')
+        assert rc.is_current('u', '/a/.git', 'h1') is False
+        assert rc.is_current('u', '/b/.git', 'h1') is True
+        rc.invalidate('u')
+        assert rc.is_current('u', '/b/.git', 'h1') is False
+        rc.invalidate('other')
+
+    def test_save_roundtrip(self, tmpdir):
+        p = tmpdir.join('c.json')
+        rc = RefCache(str(p))
+        rc.save()
+        assert not p.check()
+        rc.update('u', '/a/.git', 'h1')
+        rc.save()
+        data = json.loads(p.read())
+        assert data['u']['hash'] == 'h1'
+        assert RefCache(str(p)).is_current('u', '/a/.git', 'h1') is True
+        assert tmpdir.listdir() == [p]
@@ -0,0 +1,223 @@
+from gitclonesync.scheduler import remote_host, HostLimiter, SharedHostLimiter, SyncResult, SyncScheduler
+
+from mock import MagicMock
+import pytest
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+
+class TestRemoteHost:
+
+    @pytest.mark.parametrize('url,host', [
+        ('git@github.com:jantman/gitclonesync.git', 'github.com'),
+        ('github.com:jantman/gitclonesync.git', 'github.com'),
+        ('https://github.com/jantman/gitclonesync.git', 'github.com'),
+        ('ssh://git@git.example.com:2222/foo/bar.git', 'git.example.com'),
+        ('git://git.example.com/foo.git', 'git.example.com'),
+        ('file:///srv/git/foo.git', None),
+        ('/srv/git/foo.git', None),
+        ('../foo.git', None),
+        ('./a:b/foo.git', None),
+    ])
+    def test_remote_host(self, url, host):
+        assert remote_host(url) == host
+
+
+class TestHostLimiter:
+
+    def test_unlimited(self):
+        hl = HostLimiter(None)
+        with hl.limit('git@github.com:foo/bar.git'):
+            pass
+        assert hl._semaphores == {}
+
+    def test_local_not_limited(self):
+        hl = HostLimiter(1)
+        with hl.limit('/srv/git/foo.git'):
+            with hl.limit('/srv/git/foo.git'):
+                pass
+        assert hl._semaphores == {}
+
+    def test_limits_per_host(self):
+        hl = HostLimiter(2)
+        active = {'a': 0}
+        peak = {'a': 0}
+        lock = threading.Lock()
+
+        def work():
+            with hl.limit('git@a.example.com:x/y.git'):
+                with lock:
+                    active['a'] += 1
+                    peak['a'] = max(peak['a'], active['a'])
+                time.sleep(0.02)
+                with lock:
+                    active['a'] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert peak['a'] == 2
+        assert list(hl._semaphores.keys()) == ['a.example.com']
+
+
+def free_slots(hl, i):
+    """ the number of free slots in stripe ``i`` of a SharedHostLimiter """
+    n = 0
+    while hl._stripes[i].acquire(False):
+        n += 1
+    for _ in range(n):
+        hl._stripes[i].release()
+    return n
+
+
+def _hold_slot(hl, held, url, started, release, done):
+    hl.held = held
+    with hl.limit(url):
+        started.set()
+        release.wait()
+    done.set()
+
+
+class TestSharedHostLimiter:
+
+    def test_limits_and_reclaims(self):
+        hl = SharedHostLimiter(2, stripes=4)
+        url = 'git@a.example.com:x/y.git'
+        i = hl._stripe('a.example.com')
+        with hl.limit(url):
+            with hl.limit(url):
+                assert free_slots(hl, i) == 0
+                assert hl.held[i] == 2
+                # what a killed worker holds is given back
+                held = hl.holdings()
+                held[i] = 1
+                hl.reclaim(held)
+                assert free_slots(hl, i) == 1
+                assert list(held) == [0, 0, 0, 0]
+                hl._stripes[i].acquire()
+            assert free_slots(hl, i) == 1
+        assert free_slots(hl, i) == 2
+        assert hl.held[i] == 0
+
+    def test_reclaim_over_release(self):
+        """ a worker killed after releasing its slot, but before recording that, isn't given back twice """
+        hl = SharedHostLimiter(1, stripes=4)
+        i = hl._stripe('a.example.com')
+        held = hl.holdings()
+        held[i] = 1
+        hl.reclaim(held)
+        assert free_slots(hl, i) == 1
+        assert held[i] == 0
+
+    def test_local_not_limited(self):
+        hl = SharedHostLimiter(1, stripes=4)
+        with hl.limit('/srv/git/foo.git'):
+            with hl.limit('/srv/git/foo.git'):
+                pass
+        assert [free_slots(hl, i) for i in range(4)] == [1, 1, 1, 1]
+
+    def test_kill_waiting_worker(self):
+        """ killing a worker blocked in limit() doesn't wedge the worker holding the slot, or reclaim() """
+        hl = SharedHostLimiter(1, stripes=4)
+        url = 'git@a.example.com:x/y.git'
+        events = [multiprocessing.Event() for _ in range(5)]
+        started, release, done, waiter_started, waiter_done = events
+        holder = multiprocessing.Process(target=_hold_slot,
+                                         args=(hl, hl.holdings(), url, started, release, done))
+        holder.start()
+        assert started.wait(10)
+        waiter_held = hl.holdings()
+        waiter = multiprocessing.Process(target=_hold_slot,
+                                         args=(hl, waiter_held, url, waiter_started, release, waiter_done))
+        waiter.start()
+        time.sleep(0.5)
+        assert not waiter_started.is_set()
+        os.kill(waiter.pid, signal.SIGKILL)
+        waiter.join(10)
+        release.set()
+        holder.join(10)
+        assert done.is_set()
+        assert holder.exitcode == 0
+        hl.reclaim(waiter_held)
+        assert free_slots(hl, hl._stripe('a.example.com')) == 1
+
+
+class TestSyncScheduler:
+
+    def make_syncer(self, side_effect):
+        syncer = MagicMock(name='syncer')
+        syncer.logger = logging.getLogger('TestSyncScheduler')
+        syncer._do_git_dir.side_effect = side_effect
+        return syncer
+
+    def fake_sync(self, path, timer=None):
+        if path.endswith('bad'):
+            raise RuntimeError('boom')
+        return not path.endswith('dirty')
+
+    def test_run_serial(self):
+        syncer = self.make_syncer(self.fake_sync)
+        s = SyncScheduler(syncer, jobs=1)
+        res = s.run(['/a/one', '/a/dirty', '/a/bad'])
+        assert [(r.path, r.status) for r in res] == [
+            ('/a/one', SyncResult.SYNCED),
+            ('/a/dirty', SyncResult.SKIPPED),
+            ('/a/bad', SyncResult.FAILED),
+        ]
+        assert res[2].error == 'boom'
+
+    def test_run_parallel(self):
+        syncer = self.make_syncer(self.fake_sync)
+        s = SyncScheduler(syncer, jobs=3)
+        paths = ['/a/{i}'.format(i=i) for i in range(10)] + ['/a/dirty', '/a/bad']
+        res = s.run(iter(paths))
+        assert sorted(r.path for r in res) == sorted(paths)
+        statuses = dict((r.path, r.status) for r in res)
+        assert statuses['/a/dirty'] == SyncResult.SKIPPED
+        assert statuses['/a/bad'] == SyncResult.FAILED
+        assert statuses['/a/3'] == SyncResult.SYNCED
+        assert syncer.logger.filters == []
+
+    def test_parallel_logs_grouped(self):
+        records = []
+
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        def sync(path, timer=None):
+            syncer.logger.warning('{p} start'.format(p=path))
+            time.sleep(0.01)
+            syncer.logger.warning('{p} end'.format(p=path))
+            return True
+
+        syncer = self.make_syncer(sync)
+        handler = ListHandler()
+        syncer.logger.addHandler(handler)
+        try:
+            SyncScheduler(syncer, jobs=4).run(['/p{i}'.format(i=i) for i in range(8)])
+        finally:
+            syncer.logger.removeHandler(handler)
+        msgs = [r.getMessage() for r in records]
+        assert len(msgs) == 16
+        for i in range(0, 16, 2):
+            assert msgs[i].endswith(' start')
+            assert msgs[i + 1] == msgs[i].replace(' start', ' end')
+
+    def test_log_summary(self):
+        syncer = self.make_syncer(self.fake_sync)
+        s = SyncScheduler(syncer, jobs=1)
+        s.logger = MagicMock(spec_set=logging.Logger)
+        s.run(['/a/one', '/a/dirty', '/a/bad'])
+        s.log_summary()
+        msgs = [c[0][0] for c in s.logger.info.call_args_list]
+        assert msgs[0].startswith('Finished 3 clones in ')
+        assert msgs[0].endswith(': 1 synced, 1 skipped, 1 failed')
+        assert msgs[1] == 'skipped /a/dirty'
+        assert [c[0][0] for c in s.logger.warning.call_args_list] == ['FAILED /a/bad: boom']
@@ -0,0 +1,110 @@
+from gitclonesync.sharedobjects import (url_key, group_clones, reference_path, read_alternates,
+                                        add_alternate, reference_fetch_args)
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.tests.conftest import run_git
+
+import os
+import pytest
+
+
+def test_url_key():
+    assert url_key('git@github.com:owner/name.git') == 'github.com/owner/name'
+    assert url_key('https://github.com/owner/name') == 'github.com/owner/name'
+    assert url_key('ssh://git@GitHub.com/owner/name.git/') == 'github.com/owner/name'
+    assert url_key('/srv/git/name.git') == '/srv/git/name.git'
+    assert url_key('file:///srv/git/name.git/') == '/srv/git/name.git'
+
+
+def test_group_clones():
+    remotes = {
+        '/r/a': {'origin': 'git@github.com:me/name.git', 'upstream': 'https://github.com/up/name'},
+        '/r/b': {'origin': 'https://github.com/me/name.git'},
+        '/r/c': {'origin': 'git@github.com:up/name.git'},
+        '/r/d': {'origin': 'git@github.com:me/other.git'},
+    }
+    assert group_clones(remotes) == {
+        'github.com/me/name': ('git@github.com:me/name.git', ['/r/a', '/r/b']),
+        'github.com/up/name': ('git@github.com:up/name.git', ['/r/a', '/r/c']),
+    }
+    assert sorted(group_clones(remotes, min_clones=1)) == [
+        'github.com/me/name', 'github.com/me/other', 'github.com/up/name']
+    assert group_clones(remotes, min_clones=3) == {}
+
+
+def test_reference_path():
+    a = reference_path('/refs', 'github.com/me/name')
+    assert a.startswith('/refs/github.com_me_name-') and a.endswith('.git')
+    assert a != reference_path('/refs', 'github.com/me_name')
+
+
+def test_add_alternate(tmpdir):
+    git_dir = str(tmpdir.join('repo.git'))
+    os.makedirs(os.path.join(git_dir, 'objects'))
+    assert read_alternates(git_dir) == []
+    assert add_alternate(git_dir, '/refs/a.git/objects') is True
+    assert add_alternate(git_dir, '/refs/a.git/objects') is False
+    assert add_alternate(git_dir, '/refs/b.git/objects') is True
+    assert read_alternates(git_dir) == ['/refs/a.git/objects', '/refs/b.git/objects']
+
+
+@pytest.fixture
+def shared(gitfactory):
+    origin = gitfactory.bare('origin')
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(root)
+    paths = [gitfactory.clone(origin, os.path.join(root, n)) for n in ('a', 'b')]
+    gitfactory.clone(gitfactory.bare('other'), os.path.join(root, 'c'))
+    return origin, root, paths, os.path.join(gitfactory.root, 'refs')
+
+
+@pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+def test_share_objects(gitfactory, shared, engine):
+    origin, root, paths, refs = shared
+    sha = gitfactory.push_commit(origin)
+    cs = CloneSyncer(root, disable_github=True, engine=engine, shared_objects=refs)
+    results = cs.run()
+    assert set(r.status for r in results) == set([SyncResult.SYNCED])
+    # one reference repository, for the remote two clones share
+    ref, = [os.path.join(refs, d) for d in os.listdir(refs)]
+    assert run_git(ref, 'rev-parse', 'refs/heads/master') == sha
+    for path in paths:
+        assert read_alternates(os.path.join(path, '.git')) == [os.path.join(ref, 'objects')]
+        assert run_git(path, 'rev-parse', 'origin/master') == sha
+        assert run_git(path, 'fsck', '--connectivity-only') == ''
+    assert not os.path.exists(os.path.join(root, 'c', '.git', 'objects', 'info', 'alternates'))
+    # the clones find the new objects in the reference and fetch none themselves
+    fetched = dict((r.path, r.timer.fetches.get('origin', {}).get('objects', 0)) for r in results)
+    assert fetched[paths[0]] == 0
+    assert fetched[paths[1]] == 0
+    # and the next run just refreshes the reference
+    sha = gitfactory.push_commit(origin, fname='again')
+    CloneSyncer(root, disable_github=True, engine=engine, shared_objects=refs).run()
+    assert run_git(ref, 'rev-parse', 'refs/heads/master') == sha
+    assert read_alternates(os.path.join(paths[0], '.git')) == [os.path.join(ref, 'objects')]
+
+
+def test_share_objects_dryrun(shared):
+    origin, root, paths, refs = shared
+    CloneSyncer(root, disable_github=True, dryrun=True, shared_objects=refs).run()
+    assert not os.path.exists(refs)
+    assert read_alternates(os.path.join(paths[0], '.git')) == []
+
+
+def test_share_objects_batches(gitfactory, shared, monkeypatch):
+    """ clones counted across pre-pass batches; the reference is fetched once, for the batch that needs it """
+    monkeypatch.setattr('gitclonesync.clonesyncer.PREPASS_BATCH', 1)
+    origin, root, paths, refs = shared
+    third = gitfactory.clone(origin, os.path.join(root, 'd'))
+    cs = CloneSyncer(root, disable_github=True, shared_objects=refs)
+    fetch_args = []
+    monkeypatch.setattr('gitclonesync.clonesyncer.reference_fetch_args',
+                        lambda url: fetch_args.append(url) or reference_fetch_args(url))
+    results, elapsed = cs.sync_paths(sorted(paths + [third]))
+    assert set(r.status for r in results) == set([SyncResult.SYNCED])
+    assert len(fetch_args) == 1
+    ref, = [os.path.join(refs, d) for d in os.listdir(refs)]
+    # the first clone was synced before a second with its remote was found
+    assert read_alternates(os.path.join(paths[0], '.git')) == []
+    for path in (paths[1], third):
+        assert read_alternates(os.path.join(path, '.git')) == [os.path.join(ref, 'objects')]
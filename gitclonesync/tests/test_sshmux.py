@@ -0,0 +1,136 @@
+from gitclonesync.sshmux import SSHMultiplexer, ssh_target
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.tests.conftest import run_git
+
+import json
+import os
+import pytest
+import sys
+
+# stands in for ssh: logs its arguments, keeps a file at the ControlPath as the
+# "master", and runs remote commands (git-upload-pack etc.) locally
+FAKE_SSH = r'''#!{python}
+import json, os, subprocess, sys
+args = sys.argv[1:]
+with open(os.environ['FAKE_SSH_LOG'], 'a') as fh:
+    fh.write(json.dumps(args) + '\n')
+opts, flags, rest, control = {{}}, set(), [], None
+while args:
+    a = args.pop(0)
+    if a in ('-o', '-p', '-O'):
+        v = args.pop(0)
+        if a == '-o':
+            k, v = v.split('=', 1)
+            opts.setdefault(k, v)
+        else:
+            opts[a] = v
+    elif a.startswith('-') and not rest:
+        flags.update(a[1:])
+    else:
+        rest.append(a)
+path = opts.get('ControlPath', '').replace('%C', rest[0].replace('@', '_'))
+if opts.get('-O') == 'check':
+    sys.exit(0 if os.path.exists(path) else 255)
+if opts.get('-O') == 'exit':
+    if not os.path.exists(path):
+        sys.exit(255)
+    os.remove(path)
+    sys.exit(0)
+if 'M' in flags:
+    open(path, 'w').close()
+    sys.exit(0)
+sys.exit(subprocess.call(['sh', '-c', ' '.join(rest[1:])]))
+'''
+
+
+def test_ssh_target():
+    assert ssh_target('git@github.com:me/a.git') == ['git@github.com']
+    assert ssh_target('github.com:me/a.git') == ['github.com']
+    assert ssh_target('ssh://git@host.example.com/me/a.git') == ['git@host.example.com']
+    assert ssh_target('ssh://host.example.com:2222/me/a.git') == ['-p', '2222', 'host.example.com']
+    assert ssh_target('https://github.com/me/a.git') is None
+    assert ssh_target('git://github.com/me/a.git') is None
+    assert ssh_target('file:///srv/git/a.git') is None
+    assert ssh_target('/srv/git/a.git') is None
+    assert ssh_target('./a:b') is None
+
+
+def test_git_ssh_command(monkeypatch):
+    monkeypatch.setenv('GIT_SSH_COMMAND', 'ssh -i "/my keys/id"')
+    mux = SSHMultiplexer(persist=30)
+    mux.start()
+    try:
+        cmd = os.environ['GIT_SSH_COMMAND']
+        assert cmd.startswith("ssh -i '/my keys/id' -o ControlMaster=auto -o ControlPath=")
+        assert cmd.endswith('%C -o ControlPersist=30')
+        assert os.path.isdir(mux.control_dir)
+    finally:
+        mux.close()
+    assert os.environ['GIT_SSH_COMMAND'] == 'ssh -i "/my keys/id"'
+    assert mux.control_dir is None
+
+
+@pytest.fixture
+def fake_ssh(tmpdir, monkeypatch):
+    script = str(tmpdir.join('fake-ssh'))
+    with open(script, 'w') as fh:
+        fh.write(FAKE_SSH.format(python=sys.executable))
+    os.chmod(script, 0o755)
+    log = str(tmpdir.join('ssh.log'))
+    monkeypatch.setenv('GIT_SSH_COMMAND', script)
+    monkeypatch.setenv('GIT_SSH_VARIANT', 'ssh')
+    monkeypatch.setenv('FAKE_SSH_LOG', log)
+    return script, log
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'engine': 'gitpython', 'jobs': 3},
+    {'engine': 'subprocess', 'jobs': 3},
+    {'engine': 'gitpython', 'processes': 2},
+])
+def test_multiplex(gitfactory, fake_ssh, kwargs):
+    script, log = fake_ssh
+    root = os.path.join(gitfactory.root, 'root')
+    os.makedirs(root)
+    shas = {}
+    for name in ('a', 'b', 'c'):
+        bare = gitfactory.bare(name)
+        path = gitfactory.clone(bare, os.path.join(root, name))
+        run_git(path, 'remote', 'set-url', 'origin', 'ssh://git@example.invalid' + bare)
+        shas[name] = gitfactory.push_commit(bare)
+    cs = CloneSyncer(root, disable_github=True, ssh_multiplex=True, **kwargs)
+    results = cs.run()
+    assert set(r.status for r in results) == set([SyncResult.SYNCED])
+    for name in shas:
+        assert run_git(os.path.join(root, name), 'rev-parse', 'origin/master') == shas[name]
+    with open(log) as fh:
+        calls = [json.loads(line) for line in fh]
+    # one master for the host, used by every fetch, and shut down at the end
+    masters = [c for c in calls if '-M' in c]
+    assert len(masters) == 1
+    control = [a for a in masters[0] if a.startswith('ControlPath=')][0]
+    fetches = [c for c in calls if any('git-upload-pack' in a for a in c)]
+    assert len(fetches) == 3
+    assert all(control in c for c in fetches)
+    exits = [c for c in calls if c[-2:] == ['exit', 'gitclonesync-mux']]
+    assert len(exits) == 1
+    assert not os.path.exists(os.path.dirname(control.split('=', 1)[1]))
+    assert os.environ['GIT_SSH_COMMAND'] == script
+
+
+def test_multiplex_unreachable(gitfactory, fake_ssh, caplog):
+    """ a master that can't be opened is logged, and git connects without it """
+    script, log = fake_ssh
+    with open(script) as fh:
+        code = fh.read()
+    with open(script, 'w') as fh:
+        fh.write(code.replace("    open(path, 'w').close()\n    sys.exit(0)", "    sys.exit(255)"))
+    bare = gitfactory.bare('a')
+    path = gitfactory.clone(bare, os.path.join(gitfactory.root, 'a'))
+    run_git(path, 'remote', 'set-url', 'origin', 'git@example.invalid:' + bare)
+    sha = gitfactory.push_commit(bare)
+    CloneSyncer(path, disable_github=True, ssh_multiplex=True).run()
+    assert run_git(path, 'rev-parse', 'origin/master') == sha
+    assert any('Unable to open SSH master connection to git@example.invalid' in r.getMessage()
+               for r in caplog.records)
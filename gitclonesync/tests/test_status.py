@@ -0,0 +1,85 @@
+from gitclonesync.status import RepoStatus, get_repo_status, parse_speedup_config
+from gitclonesync.tests.conftest import run_git
+
+from mock import patch
+import git
+import os
+
+
+class TestRepoStatusParse:
+
+    def test_clean(self):
+        out = '# branch.oid abc123\0# branch.head master\0# branch.upstream origin/master\0# branch.ab +2 -3\0'
+        st = RepoStatus.parse(out)
+        assert st.head == 'abc123'
+        assert st.branch == 'master'
+        assert st.upstream == 'origin/master'
+        assert (st.ahead, st.behind) == (2, 3)
+        assert st.is_dirty() is False
+        assert st.is_dirty(untracked_files=True) is False
+
+    def test_changes(self):
+        out = ('# branch.oid (initial)\0# branch.head (detached)\0'
+               '1 .M N... 100644 100644 100644 aaa aaa a.txt\0'
+               '2 R. N... 100644 100644 100644 bbb bbb R100 new name\0old name\0'
+               'u UU N... 100644 100644 100644 100644 c c c conflict\0'
+               '? untracked file\0? other\0')
+        st = RepoStatus.parse(out)
+        assert st.head is None
+        assert st.branch is None
+        assert st.upstream is None
+        assert st.changed == 3
+        assert st.untracked == 2
+
+    def test_untracked_only(self):
+        st = RepoStatus.parse('# branch.head master\0? foo\0')
+        assert st.is_dirty() is False
+        assert st.is_dirty(untracked_files=True) is True
+
+
+class TestGetRepoStatus:
+
+    def test_real_clone(self, gitfactory):
+        origin = gitfactory.bare('origin')
+        path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+        repo = git.Repo(path)
+        st = get_repo_status(repo)
+        assert st.branch == 'master'
+        assert st.upstream == 'origin/master'
+        assert st.head == run_git(path, 'rev-parse', 'HEAD')
+        assert st.is_dirty(untracked_files=True) is False
+        assert st.elapsed > 0
+        assert (st.untracked_cache, st.fsmonitor) == (False, False)
+        with open(os.path.join(path, 'new file'), 'w') as fh:
+            fh.write('x')
+        st = get_repo_status(repo, optional_locks=False)
+        assert (st.changed, st.untracked) == (0, 1)
+        with open(os.path.join(path, 'file0'), 'a') as fh:
+            fh.write('y')
+        run_git(path, 'config', 'core.untrackedCache', 'true')
+        st = get_repo_status(repo)
+        assert (st.changed, st.untracked) == (1, 1)
+        assert st.is_dirty() == repo.is_dirty()
+
+    def test_one_invocation(self, gitfactory):
+        """ a fast status pass is one git command; the speedup settings are only read when it is slow """
+        origin = gitfactory.bare('origin')
+        path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+        run_git(path, 'config', 'core.untrackedCache', 'true')
+        repo = git.Repo(path)
+        execute = git.Git.execute
+        with patch.object(git.Git, 'execute', autospec=True, side_effect=execute) as mock_exec:
+            st = get_repo_status(repo, optional_locks=False)
+            assert mock_exec.call_count == 1
+            assert mock_exec.call_args[0][1][:3] == ['git', '--no-optional-locks', 'status']
+            assert (st.untracked_cache, st.fsmonitor) == (False, False)
+            with patch('gitclonesync.status.SLOW_STATUS', -1):
+                st = get_repo_status(repo)
+            assert mock_exec.call_count == 3
+        assert (st.untracked_cache, st.fsmonitor) == (True, False)
+
+    def test_parse_speedup_config(self):
+        assert parse_speedup_config('') == (False, False)
+        assert parse_speedup_config('core.untrackedcache\ntrue\0core.fsmonitor\n.git/hooks/fsmonitor\0') == (
+            True, True)
+        assert parse_speedup_config('core.untrackedcache\nkeep\0core.fsmonitor\nfalse\0') == (True, False)
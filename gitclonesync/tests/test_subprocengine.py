@@ -0,0 +1,167 @@
+from gitclonesync.clonesyncer import CloneSyncer
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.subprocengine import SubprocessEngine, GitCommand
+from gitclonesync.gitutils import parse_remote_config
+from gitclonesync.tests.conftest import run_git
+
+from mock import MagicMock
+import logging
+import os
+import pytest
+import time
+
+
+@pytest.fixture
+def farm(gitfactory):
+    """ a root with three clones of origin (with an upstream remote); 'dirty' is dirty """
+    origin = gitfactory.bare('origin')
+    upstream = gitfactory.bare('upstream')
+    root = os.path.join(gitfactory.root, 'root')
+    for name in ('a', 'b', 'dirty'):
+        gitfactory.clone(origin, os.path.join(root, name), remotes={'upstream': upstream})
+    with open(os.path.join(root, 'dirty', 'file0'), 'a') as fh:
+        fh.write('changed')
+    shas = {
+        'origin': gitfactory.push_commit(origin),
+        'upstream': gitfactory.push_commit(upstream),
+    }
+    return root, shas
+
+
+def statuses(results):
+    return dict((os.path.basename(r.path), r.status) for r in results)
+
+
+class TestSubprocessEngine:
+
+    def test_run(self, farm):
+        root, shas = farm
+        cs = CloneSyncer(root, disable_github=True, remote_jobs=2, engine='subprocess', jobs=4)
+        res = cs.run()
+        assert statuses(res) == {
+            'a': SyncResult.SYNCED, 'b': SyncResult.SYNCED, 'dirty': SyncResult.SKIPPED}
+        for name in ('a', 'b'):
+            for rmt, sha in shas.items():
+                assert run_git(os.path.join(root, name), 'rev-parse', rmt + '/master') == sha
+        assert run_git(os.path.join(root, 'dirty'), 'rev-parse', 'origin/master') != shas['origin']
+        timer = [r.timer for r in res if r.path.endswith('a')][0]
+        assert sorted((p['phase'], p['remote']) for p in timer.phases) == [
+            ('fast-forward', None), ('fetch', 'origin'), ('fetch', 'upstream'), ('status', None)]
+        assert timer.fetches['origin']['objects'] > 0
+
+    @pytest.mark.parametrize('engine', ['gitpython', 'subprocess'])
+    def test_sync_dirty(self, farm, engine):
+        """ both engines fail a dirty clone the same way with --sync-dirty """
+        root, shas = farm
+        res = CloneSyncer(root, disable_github=True, sync_dirty=True, engine=engine, jobs=2).run()
+        assert statuses(res) == {
+            'a': SyncResult.SYNCED, 'b': SyncResult.SYNCED, 'dirty': SyncResult.FAILED}
+        assert [r.error for r in res if r.path.endswith('dirty')] == [
+            'TODO: implement what to do with dirty repos']
+
+    def test_origin_only_single_clone(self, farm):
+        root, shas = farm
+        path = os.path.join(root, 'a')
+        cs = CloneSyncer(path, disable_github=True, origin_only=True, engine='subprocess')
+        assert statuses(cs.run()) == {'a': SyncResult.SYNCED}
+        assert run_git(path, 'rev-parse', 'origin/master') == shas['origin']
+        assert run_git(path, 'for-each-ref', 'refs/remotes/upstream') == ''
+
+    def test_dryrun(self, farm):
+        root, shas = farm
+        path = os.path.join(root, 'a')
+        before = run_git(path, 'rev-parse', 'origin/master')
+        cs = CloneSyncer(path, disable_github=True, dryrun=True, engine='subprocess')
+        cs.logger = MagicMock(spec_set=logging.Logger)
+        assert statuses(cs.run()) == {'a': SyncResult.SYNCED}
+        assert run_git(path, 'rev-parse', 'origin/master') == before
+        msgs = [c[0][1] for c in cs.logger.log.call_args_list]
+        assert "DRYRUN - would fetch rmt 'origin'" in msgs
+        assert "DRYRUN - would fetch rmt 'upstream'" in msgs
+
+    def test_ref_cache(self, farm, tmpdir):
+        root, shas = farm
+        cache = str(tmpdir.join('refcache.json'))
+        cs = CloneSyncer(root, disable_github=True, engine='subprocess', jobs=4, ref_cache_path=cache)
+        cs.run()
+        assert cs.ref_cache.avoided == 0
+        cs = CloneSyncer(root, disable_github=True, engine='subprocess', jobs=4, ref_cache_path=cache)
+        cs.run()
+        # two clean clones, two remotes each
+        assert cs.ref_cache.avoided == 4
+
+    def test_fetch_failure(self, farm):
+        root, shas = farm
+        path = os.path.join(root, 'a')
+        run_git(path, 'remote', 'add', 'broken', os.path.join(root, 'nonexistent'))
+        cs = CloneSyncer(path, disable_github=True, engine='subprocess', remote_jobs=3)
+        cs.logger = MagicMock(spec_set=logging.Logger)
+        assert statuses(cs.run()) == {'a': SyncResult.SYNCED}
+        errors = [c[0][1] for c in cs.logger.log.call_args_list if c[0][0] == logging.ERROR]
+        assert len(errors) == 1
+        assert errors[0].startswith("Error fetching remote 'broken'")
+        assert run_git(path, 'rev-parse', 'upstream/master') == shas['upstream']
+
+    def test_timeout_and_concurrency(self, tmpdir):
+        cs = CloneSyncer(str(tmpdir), disable_github=True)
+        eng = SubprocessEngine(cs, max_procs=3)
+        got = {}
+
+        def sync(task):
+            start = time.time()
+            res = yield [GitCommand(str(tmpdir), ['-c', 'alias.slp=!sleep 5', 'slp'], timeout=0.3),
+                         GitCommand(str(tmpdir), ['version'])]
+            got[task.path] = (res, time.time() - start)
+
+        eng._sync_clone = sync
+        results = eng.run(['p1', 'p2', 'p3'])
+        assert sorted(r.status for r in results) == [SyncResult.SYNCED] * 3
+        for res, elapsed in got.values():
+            assert res[0].timed_out is True
+            assert res[0].ok is False
+            assert 'Timeout' in res[0].stderr
+            assert res[1].ok is True
+            assert res[1].stdout.startswith('git version')
+            assert elapsed < 3
+
+    def test_generator_exception(self, tmpdir):
+        cs = CloneSyncer(str(tmpdir), disable_github=True)
+        eng = SubprocessEngine(cs)
+
+        def sync(task):
+            yield GitCommand(str(tmpdir), ['version'])
+            raise RuntimeError('boom')
+
+        eng._sync_clone = sync
+        res = eng.run(['x'])
+        assert [(r.status, r.error) for r in res] == [(SyncResult.FAILED, 'boom')]
+
+    def test_per_host_limit(self, tmpdir):
+        cs = CloneSyncer(str(tmpdir), disable_github=True, max_per_host=1)
+        eng = SubprocessEngine(cs, max_procs=8)
+        peak = {'n': 0}
+        real_spawn = eng._spawn
+
+        def spawn(task, index, cmd):
+            real_spawn(task, index, cmd)
+            peak['n'] = max(peak['n'], eng._hosts.get('git.example.com', 0))
+
+        def sync(task):
+            yield [GitCommand(str(tmpdir), ['version'], url='git@git.example.com:a/b.git')
+                   for _ in range(4)]
+
+        eng._spawn = spawn
+        eng._sync_clone = sync
+        assert len(eng.run(['x', 'y'])) == 2
+        assert peak['n'] == 1
+
+
+def test_parse_remote_config():
+    out = ('remote.origin.url\ngit@github.com:a/b.git\0'
+           'remote.origin.fetch\n+refs/heads/*:refs/remotes/origin/*\0'
+           'remote.my.fork.url\n/srv/x.git\0'
+           'remote.origin.fetch\n+refs/pull/*/head:refs/remotes/origin/pr/*\0')
+    urls, refspecs = parse_remote_config(out)
+    assert urls == {'origin': 'git@github.com:a/b.git', 'my.fork': '/srv/x.git'}
+    assert refspecs == {'origin': ['+refs/heads/*:refs/remotes/origin/*',
+                                   '+refs/pull/*/head:refs/remotes/origin/pr/*']}
@@ -0,0 +1,102 @@
+from gitclonesync.timing import RepoTimer, TimedIterator, SyncReport
+from gitclonesync.scheduler import SyncResult
+from gitclonesync.gitutils import parse_fetch_progress
+
+import csv
+import json
+
+
+def _results():
+    a = RepoTimer('/r/a')
+    a.add('status', 0.5)
+    a.add('fetch', 3.0, remote='origin')
+    a.add('fetch', 1.0, remote='upstream')
+    a.add_fetch('origin', 10, 2048)
+    a.add_fetch('upstream', 0, 0)
+    b = RepoTimer('/r/b')
+    b.add('status', 0.25)
+    return [
+        SyncResult('/r/b', SyncResult.SKIPPED, 0.3, timer=b),
+        SyncResult('/r/a', SyncResult.SYNCED, 4.6, timer=a),
+        SyncResult('/r/c', SyncResult.FAILED, 0.1, error='boom'),
+    ]
+
+
+class TestRepoTimer:
+
+    def test_phase(self):
+        t = RepoTimer('/r/a')
+        with t.phase('fetch', remote='origin'):
+            pass
+        assert len(t.phases) == 1
+        assert t.phases[0]['phase'] == 'fetch'
+        assert t.phases[0]['remote'] == 'origin'
+        assert t.total('fetch') >= 0.0
+        assert t.total('status') == 0
+
+    def test_as_dict(self):
+        d = _results()[1].timer.as_dict()
+        assert d['fetch_bytes'] == 2048
+        assert d['fetch_objects'] == 10
+        assert len(d['phases']) == 3
+
+
+class TestTimedIterator:
+
+    def test_iter(self):
+        it = TimedIterator(x for x in range(3))
+        assert list(it) == [0, 1, 2]
+        assert it.elapsed >= 0.0
+
+
+class TestSyncReport:
+
+    def test_slowest_and_totals(self):
+        r = SyncReport(_results(), 5.0, discovery_time=0.2, slowest=2)
+        assert [x.path for x in r.slowest_results()] == ['/r/a', '/r/b']
+        assert r.phase_totals() == {'status': 0.75, 'fetch': 4.0}
+
+    def test_write_json(self, tmpdir):
+        path = str(tmpdir.join('report.json'))
+        SyncReport(_results(), 5.0, discovery_time=0.2).write(path)
+        with open(path) as fh:
+            d = json.load(fh)
+        assert d['discovery_time'] == 0.2
+        assert [x['path'] for x in d['repos']] == ['/r/b', '/r/a', '/r/c']
+        assert d['repos'][1]['fetches']['origin'] == {'objects': 10, 'bytes': 2048}
+        assert d['repos'][2]['phases'] == []
+
+    def test_write_csv(self, tmpdir):
+        path = str(tmpdir.join('report.csv'))
+        SyncReport(_results(), 5.0, discovery_time=0.2).write(path)
+        with open(path) as fh:
+            rows = list(csv.DictReader(fh))
+        assert [(r['path'], r['phase'], r['remote']) for r in rows] == [
+            ('(discovery)', 'discovery', ''),
+            ('/r/a', 'status', ''),
+            ('/r/a', 'fetch', 'origin'),
+            ('/r/a', 'fetch', 'upstream'),
+            ('/r/b', 'status', ''),
+            ('/r/c', '', ''),
+        ]
+        assert rows[2]['fetch_bytes'] == '2048'
+
+
+class TestParseFetchProgress:
+
+    def test_parse(self):
+        stderr = ('remote: Enumerating objects: 5, done.\n'
+                  'Receiving objects:  40% (2/5)\rReceiving objects: 100% (5/5), 1.50 MiB | 2.00 MiB/s, done.\n'
+                  'Resolving deltas: 100% (1/1), done.\n')
+        assert parse_fetch_progress(stderr) == (5, 1572864)
+
+    def test_unpacking(self):
+        assert parse_fetch_progress('Unpacking objects: 100% (3/3), 250 bytes | 250.00 KiB/s, done.') == (3, 250)
+
+    def test_remote_total(self):
+        stderr = 'remote: Total 3 (delta 0), reused 0 (delta 0), pack-reused 0        \n'
+        assert parse_fetch_progress(stderr) == (3, 0)
+
+    def test_nothing(self):
+        assert parse_fetch_progress('') == (0, 0)
+        assert parse_fetch_progress(None) == (0, 0)
@@ -0,0 +1,90 @@
+from gitclonesync.watcher import CloneWatcher, Inotify, InotifyError, clone_git_dir
+from gitclonesync.tests.conftest import run_git
+
+from mock import MagicMock, call
+import os
+import pytest
+
+try:
+    Inotify().close()
+    HAVE_INOTIFY = True
+except InotifyError:
+    HAVE_INOTIFY = False
+
+needs_inotify = pytest.mark.skipif(not HAVE_INOTIFY, reason='inotify is not available')
+
+
+def test_clone_git_dir(gitfactory):
+    origin = gitfactory.bare('origin')
+    path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+    wt = os.path.join(gitfactory.root, 'wt')
+    run_git(path, 'worktree', 'add', '-q', '-b', 'wt', wt)
+    assert clone_git_dir(path) == os.path.join(path, '.git')
+    assert clone_git_dir(wt) == os.path.join(path, '.git', 'worktrees', 'wt')
+
+
+@pytest.fixture
+def watched(gitfactory):
+    origin = gitfactory.bare('origin')
+    path = gitfactory.clone(origin, os.path.join(gitfactory.root, 'clone'))
+    daemon = MagicMock()
+    daemon.trigger.return_value = True
+    w = CloneWatcher(daemon, settle=0)
+    w.update([path])
+    yield w, path, daemon
+    w.inotify.close()
+
+
+def drain(w):
+    """ process events until none arrive for a moment """
+    changed = set()
+    while True:
+        events = w.inotify.read(0.2)
+        if not events:
+            return changed
+        for wd, mask, name in events:
+            p = w.handle(wd, mask, name, 0)
+            if p is not None:
+                changed.add(p)
+
+
+@needs_inotify
+def test_local_commit_triggers(watched, gitfactory):
+    w, path, daemon = watched
+    gitfactory.commit(path, 'local')
+    assert drain(w) == set([path])
+    w.poll(0)
+    assert daemon.trigger.mock_calls == [call(path, local_change=True)]
+    assert w.triggered == 1
+
+
+@needs_inotify
+def test_ignores_remote_refs_and_fetch_head(watched):
+    w, path, daemon = watched
+    run_git(path, 'fetch', '-q', 'origin')
+    run_git(path, 'update-ref', 'refs/remotes/origin/other', 'HEAD')
+    with open(os.path.join(path, '.git', 'FETCH_HEAD'), 'a') as fh:
+        fh.write('\n')
+    assert drain(w) == set()
+
+
+@needs_inotify
+def test_branch_namespaces(watched):
+    w, path, daemon = watched
+    run_git(path, 'branch', 'feature/one')
+    assert drain(w) == set([path])
+    before = len(w._watches)
+    assert os.path.join(path, '.git', 'refs', 'heads', 'feature') in [d for _, d, _ in w._watches.values()]
+    run_git(path, 'branch', 'feature/two')
+    assert drain(w) == set([path])
+    assert len(w._watches) == before
+
+
+@needs_inotify
+def test_update_unwatches(watched):
+    w, path, daemon = watched
+    assert len(w._watches) == 2
+    w.update([])
+    assert w._watches == {}
+    run_git(path, 'branch', 'other')
+    assert drain(w) == set()
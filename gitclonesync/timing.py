@@ -0,0 +1,212 @@
+"""
+Per-clone, per-phase timing instrumentation and the machine-readable run report
+"""
+
+import csv
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# number of slowest clones listed in the report by default
+DEFAULT_SLOWEST = 10
+
+
+class RepoTimer:
+    """
+    Collects how long each phase of syncing one clone took, plus what each
+    remote fetch transferred. Safe to use from several threads (i.e.
+    concurrent remote fetches).
+    """
+
+    def __init__(self, path):
+        """
+        init
+
+        :param path: path to the clone
+        :type path: string
+        """
+        self.path = path
+        self.phases = []
+        self.fetches = {}
+        # pack and loose object counts before and after maintenance, if the clone was maintained
+        self.maintenance = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, remote=None):
+        """
+        context manager timing one phase
+
+        :param name: phase name, i.e. ``status`` or ``fetch``
+        :type name: string
+        :param remote: remote name, for per-remote phases
+        :type remote: string
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start, remote=remote)
+
+    def add(self, name, elapsed, remote=None):
+        """ record a phase that took ``elapsed`` seconds """
+        with self._lock:
+            self.phases.append({'phase': name, 'remote': remote, 'elapsed': elapsed})
+
+    def add_fetch(self, remote, objects, nbytes):
+        """
+        record what a fetch of ``remote`` transferred
+
+        :param remote: remote name
+        :type remote: string
+        :param objects: number of objects received
+        :type objects: int
+        :param nbytes: number of bytes received
+        :type nbytes: int
+        """
+        with self._lock:
+            self.fetches[remote] = {'objects': objects, 'bytes': nbytes}
+
+    def total(self, name=None):
+        """ total seconds spent in phase ``name``, or in all phases """
+        return sum(p['elapsed'] for p in self.phases if name is None or p['phase'] == name)
+
+    @classmethod
+    def from_dict(cls, d):
+        """ rebuild a timer from as_dict() output, i.e. one sent back by a worker process """
+        timer = cls(d['path'])
+        timer.phases = list(d['phases'])
+        timer.fetches = dict(d['fetches'])
+        timer.maintenance = d.get('maintenance')
+        return timer
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'phases': list(self.phases),
+            'fetches': dict(self.fetches),
+            'fetch_bytes': sum(f['bytes'] for f in self.fetches.values()),
+            'fetch_objects': sum(f['objects'] for f in self.fetches.values()),
+            'maintenance': self.maintenance,
+        }
+
+
+class TimedIterator:
+    """
+    Wraps an iterator (i.e. the streaming repository discovery) and adds up
+    the time spent producing its items
+    """
+
+    def __init__(self, iterable):
+        self._it = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            return next(self._it)
+        finally:
+            self.elapsed += time.time() - start
+
+    next = __next__
+
+
+class SyncReport:
+    """
+    Writes per-clone timings for a run to a JSON or CSV file
+    """
+
+    CSV_FIELDS = ['path', 'status', 'elapsed', 'phase', 'remote', 'phase_elapsed', 'fetch_bytes', 'fetch_objects']
+
+    def __init__(self, results, elapsed, discovery_time=0.0, slowest=DEFAULT_SLOWEST):
+        """
+        init
+
+        :param results: list of SyncResult (with ``timer`` set)
+        :type results: list
+        :param elapsed: wall time of the whole run, in seconds
+        :type elapsed: float
+        :param discovery_time: seconds spent discovering clones
+        :type discovery_time: float
+        :param slowest: how many of the slowest clones to list
+        :type slowest: int
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.results = results
+        self.elapsed = elapsed
+        self.discovery_time = discovery_time
+        self.slowest = slowest
+
+    def slowest_results(self):
+        """ the ``self.slowest`` results with the highest elapsed time """
+        return sorted(self.results, key=lambda r: r.elapsed, reverse=True)[:self.slowest]
+
+    def phase_totals(self):
+        """ dict of phase name to total seconds across all clones """
+        totals = {}
+        for r in self.results:
+            if r.timer is None:
+                continue
+            for p in r.timer.phases:
+                totals[p['phase']] = totals.get(p['phase'], 0.0) + p['elapsed']
+        return totals
+
+    def _repo_dict(self, r):
+        d = r.timer.as_dict() if r.timer is not None else {'path': r.path, 'phases': [], 'fetches': {}}
+        d.update({'status': r.status, 'elapsed': r.elapsed, 'error': r.error})
+        return d
+
+    def as_dict(self):
+        return {
+            'elapsed': self.elapsed,
+            'discovery_time': self.discovery_time,
+            'phase_totals': self.phase_totals(),
+            'slowest': [{'path': r.path, 'elapsed': r.elapsed} for r in self.slowest_results()],
+            'repos': [self._repo_dict(r) for r in self.results],
+        }
+
+    def write(self, path):
+        """
+        write the report; CSV if ``path`` ends in ``.csv``, otherwise JSON
+
+        :param path: output file path
+        :type path: string
+        """
+        if path.lower().endswith('.csv'):
+            self._write_csv(path)
+        else:
+            with open(path, 'w') as fh:
+                json.dump(self.as_dict(), fh, indent=2, sort_keys=True)
+        self.logger.info("Wrote timing report to {p}".format(p=path))
+
+    def _write_csv(self, path):
+        """ one row per clone phase, clones ordered slowest first """
+        with open(path, 'w') as fh:
+            w = csv.DictWriter(fh, fieldnames=self.CSV_FIELDS)
+            w.writeheader()
+            w.writerow({'path': '(discovery)', 'phase': 'discovery', 'phase_elapsed': self.discovery_time})
+            for r in sorted(self.results, key=lambda x: x.elapsed, reverse=True):
+                d = self._repo_dict(r)
+                base = {'path': r.path, 'status': r.status, 'elapsed': r.elapsed}
+                if not d['phases']:
+                    w.writerow(base)
+                for p in d['phases']:
+                    row = dict(base, phase=p['phase'], remote=p['remote'], phase_elapsed=p['elapsed'])
+                    if p['phase'] == 'fetch' and p['remote'] in d['fetches']:
+                        row['fetch_bytes'] = d['fetches'][p['remote']]['bytes']
+                        row['fetch_objects'] = d['fetches'][p['remote']]['objects']
+                    w.writerow(row)
+
+    def log_slowest(self):
+        """ log the slowest clones and the per-phase totals """
+        totals = self.phase_totals()
+        self.logger.info("Discovery took {d:.1f}s; phase totals: {t}".format(
+            d=self.discovery_time,
+            t=', '.join('{k}={v:.1f}s'.format(k=k, v=totals[k]) for k in sorted(totals)) or 'none'))
+        for r in self.slowest_results():
+            self.logger.info("slow: {e:.1f}s {p}".format(e=r.elapsed, p=r.path))
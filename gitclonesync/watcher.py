@@ -0,0 +1,286 @@
+"""
+Linux inotify watcher that queues a clone for an immediate daemon sync when
+its HEAD, index or local branches change, so that local commits and branch
+switches are pushed and fast-forwarded without waiting for the clone's
+next scheduled sync, and without polling anything
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct('iIII')
+
+# files in the git directory whose changes mean the checked-out branch, its commit or the index changed
+GIT_DIR_FILES = ('HEAD', 'index', 'packed-refs')
+
+# wait until a clone has had no events for this many seconds before queueing it; git writes several files per command
+DEFAULT_SETTLE = 2.0
+
+
+class InotifyError(Exception):
+    """
+    Exception for inotify being unavailable or failing
+    """
+    pass
+
+
+class InotifyLimitError(InotifyError):
+    """
+    Exception for reaching the per-user limit on inotify watches
+    """
+    pass
+
+
+class Inotify:
+    """
+    Minimal ctypes binding of inotify(7)
+    """
+
+    def __init__(self):
+        """ init - raises InotifyError if inotify isn't available (i.e. not on Linux) """
+        name = ctypes.util.find_library('c')
+        try:
+            self._libc = ctypes.CDLL(name, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise InotifyError("inotify is not available on this platform")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyError("inotify_init1 failed: {e}".format(e=os.strerror(ctypes.get_errno())))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        watch a directory
+
+        :returns: watch descriptor
+        :rtype: int
+        """
+        wd = self._libc.inotify_add_watch(self.fd, path.encode('utf-8'), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise InotifyLimitError("inotify watch limit reached; raise fs.inotify.max_user_watches")
+            raise InotifyError("inotify_add_watch {p} failed: {e}".format(p=path, e=os.strerror(err)))
+        return wd
+
+    def rm_watch(self, wd):
+        """ stop watching a watch descriptor; errors (i.e. the directory is gone) are ignored """
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        wait up to ``timeout`` seconds for events
+
+        :returns: list of (wd, mask, name) tuples
+        :rtype: list
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buf = os.read(self.fd, 65536)
+        except OSError as ex:
+            if ex.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def clone_git_dir(path):
+    """
+    the git directory of a clone, without running git; follows the
+    ``gitdir:`` file of linked worktrees and submodules
+
+    :rtype: string
+    """
+    dot_git = os.path.join(path, '.git')
+    if os.path.isfile(dot_git):
+        with open(dot_git) as fh:
+            line = fh.readline().strip()
+        if line.startswith('gitdir:'):
+            return os.path.normpath(os.path.join(path, line[len('gitdir:'):].strip()))
+    return dot_git
+
+
+class CloneWatcher:
+    """
+    Watches the git directory and ``refs/heads`` tree of every clone the
+    daemon tracks, and triggers a sync of a clone once its events settle
+    """
+
+    def __init__(self, daemon, settle=DEFAULT_SETTLE):
+        """
+        init - raises InotifyError if inotify isn't available
+
+        :param daemon: the daemon to trigger syncs on
+        :type daemon: gitclonesync.daemon.SyncDaemon
+        :param settle: seconds without events to wait before triggering a clone
+        :type settle: float
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.daemon = daemon
+        self.settle = settle
+        self.inotify = Inotify()
+        # wd -> (clone path, watched directory, whether it's the git directory itself)
+        self._watches = {}
+        # clone path -> list of wds
+        self._clones = {}
+        # clone path -> time of its most recent event
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+        self.triggered = 0
+
+    def _add(self, path, directory, is_git_dir=False):
+        """ watch one directory of a clone """
+        wd = self.inotify.add_watch(directory)
+        self._watches[wd] = (path, directory, is_git_dir)
+        self._clones.setdefault(path, []).append(wd)
+
+    def watch(self, path):
+        """ start watching a clone """
+        git_dir = clone_git_dir(path)
+        self._add(path, git_dir, is_git_dir=True)
+        heads = os.path.join(git_dir, 'refs', 'heads')
+        for root, dirs, files in os.walk(heads):
+            self._add(path, root)
+
+    def unwatch(self, path):
+        """ stop watching a clone """
+        for wd in self._clones.pop(path, []):
+            self.inotify.rm_watch(wd)
+            self._watches.pop(wd, None)
+        self._pending.pop(path, None)
+
+    def update(self, paths):
+        """
+        watch exactly ``paths``; called by the daemon after each discovery
+
+        :param paths: paths to the clones to watch
+        :type paths: iterable
+        """
+        paths = set(paths)
+        with self._lock:
+            for path in [p for p in self._clones if p not in paths]:
+                self.unwatch(path)
+            for path in sorted(p for p in paths if p not in self._clones):
+                try:
+                    self.watch(path)
+                except InotifyLimitError as ex:
+                    self.logger.error("Unable to watch {p} or any further clones: {e}".format(p=path, e=ex))
+                    self.unwatch(path)
+                    break
+                except InotifyError as ex:
+                    self.logger.error("Unable to watch {p}: {e}".format(p=path, e=ex))
+                    self.unwatch(path)
+            count = len(self._watches)
+        self.logger.info("Watching {n} clone(s) with {w} inotify watch(es)".format(n=len(self._clones), w=count))
+
+    def handle(self, wd, mask, name, now):
+        """
+        process one event
+
+        :returns: the clone path if the event is a relevant change, else None
+        """
+        if mask & IN_Q_OVERFLOW:
+            self.logger.warning("inotify queue overflowed; some local changes will wait for their scheduled sync")
+            return None
+        with self._lock:
+            watched = self._watches.get(wd)
+            if watched is None:
+                return None
+            path, directory, is_git_dir = watched
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                if wd in self._clones.get(path, []):
+                    self._clones[path].remove(wd)
+                return None
+            if mask & IN_ISDIR:
+                if not mask & (IN_CREATE | IN_MOVED_TO) or is_git_dir:
+                    return None
+                # a new branch namespace, i.e. refs/heads/feature/; its first branch
+                # may have been written before the watch was added, so count it as a change
+                for root, dirs, files in os.walk(os.path.join(directory, name)):
+                    try:
+                        self._add(path, root)
+                    except InotifyError as ex:
+                        self.logger.debug("Unable to watch {d}: {e}".format(d=root, e=ex))
+            elif name.endswith('.lock'):
+                return None
+            if is_git_dir and name not in GIT_DIR_FILES:
+                return None
+            self._pending[path] = now
+        return path
+
+    def due(self, now):
+        """
+        remove and return the clones whose events have settled
+
+        :rtype: list
+        """
+        with self._lock:
+            ready = sorted(p for p, t in self._pending.items() if now - t >= self.settle)
+            for path in ready:
+                del self._pending[path]
+        return ready
+
+    def poll(self, timeout):
+        """ wait up to ``timeout`` seconds for events, and trigger every clone whose events have settled """
+        for wd, mask, name in self.inotify.read(timeout):
+            self.handle(wd, mask, name, time.time())
+        for path in self.due(time.time()):
+            if self.daemon.trigger(path, local_change=True):
+                self.logger.debug("Local change in {p}; queued for sync".format(p=path))
+                self.triggered += 1
+
+    def _run(self):
+        while not self._stopping:
+            self.poll(self.settle / 2.0)
+
+    def start(self):
+        """ watch for events in a background thread """
+        self._thread = threading.Thread(target=self._run, name='clone-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ stop the background thread and close the inotify descriptor """
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+        self.inotify.close()
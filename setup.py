@@ -17,8 +17,8 @@ with open('CHANGES.rst') as file:
     long_description += '\n' + file.read()
 
 requires = [
-    'GitPython>=0.3.2.1',
-    'github3.py>=0.8.2',
+    'GitPython>=1.0.2',
+    'requests>=2.4.0',
 ]
 
 classifiers = [